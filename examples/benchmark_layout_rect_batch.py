@@ -0,0 +1,75 @@
+"""
+layout矩形分桶批量推理与原有正方形推理的精度、耗时对比。
+把多个pdf的页面按固定随机种子打乱，使每批页面尺寸不一(原有流程整批填充为imgsz*imgsz的正方形)，
+再开启MINERU_LAYOUT_RECT_BATCH按宽高比分桶推理，按类别+IoU匹配两者的检测框。
+用法: python benchmark_layout_rect_batch.py "/path/to/pdfs/*.pdf"
+"""
+import glob
+import os
+import random
+import sys
+import time
+
+from mineru.backend.pipeline.model_init import doclayout_yolo_model_init
+from mineru.utils.boxbase import calculate_iou
+from mineru.utils.config_reader import get_device
+from mineru.utils.enum_class import ImageType, ModelPath
+from mineru.utils.models_download_utils import auto_download_and_get_model_root_path
+from mineru.utils.pdf_image_tools import load_images_from_pdf
+
+# ==================== 配置参数 ====================
+PDF_GLOB = "demo/pdfs/*.pdf"  # 待对比的pdf
+BATCH_SIZE = 8  # 与pipeline中layout的批大小一致
+IOU_THRESHOLD = 0.9  # 同类别且IoU不低于该值视为同一检测框
+SEED = 0
+
+
+def poly_to_bbox(poly):
+    return [poly[0], poly[1], poly[4], poly[5]]
+
+
+def match_count(dets_a, dets_b):
+    """贪心匹配同类别、IoU达到阈值的检测框，返回匹配数"""
+    used, matched = set(), 0
+    for det_a in dets_a:
+        for index, det_b in enumerate(dets_b):
+            if index in used or det_a["category_id"] != det_b["category_id"]:
+                continue
+            if calculate_iou(poly_to_bbox(det_a["poly"]), poly_to_bbox(det_b["poly"])) >= IOU_THRESHOLD:
+                used.add(index)
+                matched += 1
+                break
+    return matched
+
+
+def timed_predict(model, images, rect):
+    os.environ["MINERU_LAYOUT_RECT_BATCH"] = "true" if rect else "false"
+    start = time.perf_counter()
+    results = model.batch_predict(images, BATCH_SIZE)
+    return results, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    images = []
+    for pdf_path in sorted(glob.glob(sys.argv[1] if len(sys.argv) > 1 else PDF_GLOB)):
+        with open(pdf_path, "rb") as f:
+            images_list, pdf_doc = load_images_from_pdf(f.read(), image_type=ImageType.NUMPY)
+        pdf_doc.close()
+        images.extend(image_dict["img_np"] for image_dict in images_list)
+    random.Random(SEED).shuffle(images)
+
+    weight = os.path.join(auto_download_and_get_model_root_path(ModelPath.doclayout_yolo), ModelPath.doclayout_yolo)
+    model = doclayout_yolo_model_init(weight, get_device())
+    timed_predict(model, images[:BATCH_SIZE], rect=False)  # 预热
+
+    square_results, square_time = timed_predict(model, images, rect=False)
+    rect_results, rect_time = timed_predict(model, images, rect=True)
+
+    square_total = sum(len(dets) for dets in square_results)
+    rect_total = sum(len(dets) for dets in rect_results)
+    matched = sum(match_count(a, b) for a, b in zip(square_results, rect_results))
+    print(f"{len(images)} pages, {len({image.shape for image in images})} page sizes")
+    print(f"square: {square_time:.2f}s, {square_total} dets")
+    print(f"rect:   {rect_time:.2f}s, {rect_total} dets")
+    print(f"matched (IoU>={IOU_THRESHOLD}): {matched}, "
+          f"recall {matched / max(square_total, 1):.4f}, precision {matched / max(rect_total, 1):.4f}")
@@ -0,0 +1,100 @@
+"""
+对比pipeline后端两种页面表示(PIL RGB / NumPy BGR)在渲染、裁剪和颜色转换上的CPU耗时与内存占用。
+裁剪框取自pdfium文本行，模拟layout结果送入OCR-det前的裁剪流程。
+"""
+import multiprocessing
+import sys
+import time
+
+import cv2
+import numpy as np
+import pypdfium2 as pdfium
+
+from mineru.utils.enum_class import ImageType
+from mineru.utils.memory_governor import get_rss_bytes
+from mineru.utils.model_utils import crop_img
+from mineru.utils.pdf_image_tools import load_images_from_pdf
+from mineru.utils.pdf_text_tool import get_page
+
+# ==================== 配置参数 ====================
+PDF_PATH = "demo/pdfs/demo1.pdf"  # 测试PDF
+CROP_PASTE = 50  # 与OCR-det裁剪时的留白一致
+REPEAT = 3  # 重复次数，取最小耗时
+
+
+def collect_crop_boxes(pdf_bytes, images_list):
+    pdf_doc = pdfium.PdfDocument(pdf_bytes)
+    boxes_list = []
+    for page_index, image_dict in enumerate(images_list):
+        scale = image_dict["scale"]
+        boxes = []
+        for block in get_page(pdf_doc[page_index])["blocks"]:
+            for line in block["lines"]:
+                x0, y0, x1, y1 = [int(v * scale) for v in line["bbox"].bbox]
+                boxes.append({"poly": [x0, y0, x1, y0, x1, y1, x0, y1]})
+        boxes_list.append(boxes)
+    pdf_doc.close()
+    return boxes_list
+
+
+def run_pil(pdf_bytes, boxes_list, rss_samples):
+    images_list, pdf_doc = load_images_from_pdf(pdf_bytes, image_type=ImageType.PIL)
+    crops = []
+    for image_dict, boxes in zip(images_list, boxes_list):
+        page_img = image_dict["img_pil"]
+        for res in boxes:
+            new_image, _ = crop_img(res, page_img, crop_paste_x=CROP_PASTE, crop_paste_y=CROP_PASTE)
+            crops.append(cv2.cvtColor(np.asarray(new_image), cv2.COLOR_RGB2BGR))
+        rss_samples.append(get_rss_bytes())
+    pdf_doc.close()
+    return len(images_list)
+
+
+def run_numpy(pdf_bytes, boxes_list, rss_samples):
+    images_list, pdf_doc = load_images_from_pdf(pdf_bytes, image_type=ImageType.NUMPY)
+    crops = []
+    for image_dict, boxes in zip(images_list, boxes_list):
+        page_img = image_dict["img_np"]
+        for res in boxes:
+            new_image, _ = crop_img(res, page_img, crop_paste_x=CROP_PASTE, crop_paste_y=CROP_PASTE)
+            crops.append(new_image)
+        rss_samples.append(get_rss_bytes())
+    pdf_doc.close()
+    return len(images_list)
+
+
+def _measure(fn, pdf_bytes, boxes_list):
+    """返回页数、每轮最小CPU耗时，以及整份文档页面与裁剪结果同时驻留时的RSS增长"""
+    best, rss_growth = float("inf"), 0
+    for _ in range(REPEAT):
+        rss_samples = []
+        rss_before = get_rss_bytes()
+        t0 = time.process_time()
+        page_count = fn(pdf_bytes, boxes_list, rss_samples)
+        best = min(best, time.process_time() - t0)
+        rss_growth = max(rss_growth, max(rss_samples) - rss_before)
+    return page_count, best, rss_growth
+
+
+def measure(fn, pdf_bytes, boxes_list):
+    # 每种表示在独立的子进程中测量，避免前一轮释放的内存被复用而低估RSS
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_measure, (fn, pdf_bytes, boxes_list))
+
+
+if __name__ == "__main__":
+    pdf_path = sys.argv[1] if len(sys.argv) > 1 else PDF_PATH
+    with open(pdf_path, "rb") as f:
+        pdf_bytes = f.read()
+    sample_images, sample_doc = load_images_from_pdf(pdf_bytes)
+    boxes_list = collect_crop_boxes(pdf_bytes, sample_images)
+    sample_doc.close()
+    del sample_images
+
+    for name, fn in [("pil", run_pil), ("numpy", run_numpy)]:
+        page_count, cpu_time, peak = measure(fn, pdf_bytes, boxes_list)
+        print(
+            f"{name:>6}: {page_count} pages, {sum(len(b) for b in boxes_list)} crops, "
+            f"cpu {cpu_time / page_count * 1000:.1f} ms/page, "
+            f"peak rss growth {peak / 1024 / 1024:.1f} MB"
+        )
@@ -1,3 +1,5 @@
+from contextlib import nullcontext
+
 import cv2
 from loguru import logger
 from tqdm import tqdm
@@ -7,22 +9,54 @@ import torch
 
 from .model_init import AtomModelSingleton
 from ...utils.config_reader import get_formula_enable, get_table_enable
+from ...utils.image_pyramid import ImagePyramid, get_base_image
 from ...utils.model_utils import crop_img, get_res_list_from_layout_res
 from ...utils.ocr_utils import get_adjusted_mfdetrec_res, get_ocr_result_list, OcrConfidence
+from ...utils.nvtx_utils import nvtx_range
+from ...utils.formula_precheck import is_formula_precheck_enabled, get_formula_precheck_stats
+from ...utils.formula_cache import is_formula_cache_enabled
+from ...model.mfd.yolo_v8 import is_mfd_bucket_batch_enabled
 
 YOLO_LAYOUT_BASE_BATCH_SIZE = 8
 MFD_BASE_BATCH_SIZE = 1
+# 分桶批量推理时每批MFD输入的像素预算(按batch_ratio放大)，约为两张imgsz=1888的竖版A4页面
+MFD_BASE_BATCH_PIXELS = 2 * 1888 * 1344
+# 分桶批量推理时每批MFD的页数上限(按batch_ratio放大)，小尺寸页面在像素预算内可以多放几页
+MFD_BUCKET_BASE_BATCH_SIZE = 8
 MFR_BASE_BATCH_SIZE = 16
 OCR_DET_BASE_BATCH_SIZE = 16
 
 
+def to_bgr_ndarray(image):
+    """兼容传入PIL图像的调用方，统一转换为BGR ndarray"""
+    if isinstance(image, np.ndarray):
+        return image
+    return cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+
 class BatchAnalyze:
-    def __init__(self, model_manager, batch_ratio: int, formula_enable, table_enable, enable_ocr_det_batch: bool = True):
+    def __init__(self, model_manager, batch_ratio: int, formula_enable, table_enable, enable_ocr_det_batch: bool = True, batch_tuner=None, device=None, stage_stats=None):
         self.batch_ratio = batch_ratio
         self.formula_enable = get_formula_enable(formula_enable)
         self.table_enable = get_table_enable(table_enable)
         self.model_manager = model_manager
         self.enable_ocr_det_batch = enable_ocr_det_batch
+        self.batch_tuner = batch_tuner
+        self.device = device
+        self.stage_stats = stage_stats
+
+    def _stage_busy(self, stage):
+        """传入stage_stats(StageStats)时记录该阶段的忙碌时间"""
+        if self.stage_stats is None:
+            return nullcontext()
+        return self.stage_stats.busy(stage)
+
+    def _run_stage(self, stage, default_batch_size, fn, n_items, tune=True):
+        """未启用自动调优(或tune为False)时使用固定批大小，否则由batch_tuner以同样的批大小为起点测量并选择批大小"""
+        with self._stage_busy(stage):
+            if self.batch_tuner is None or not tune:
+                return fn(default_batch_size)
+            return self.batch_tuner.run(stage, default_batch_size, fn, n_items)
 
     def __call__(self, images_with_extra_info: list) -> list:
         if len(images_with_extra_info) == 0:
@@ -34,37 +68,72 @@ class BatchAnalyze:
             lang=None,
             formula_enable=self.formula_enable,
             table_enable=self.table_enable,
+            device=self.device,
         )
         atom_model_manager = AtomModelSingleton()
 
-        images = [image for image, _, _ in images_with_extra_info]
+        pages = [image for image, _, _, _ in images_with_extra_info]
+        # 页面统一为BGR ndarray，每页只做一次颜色转换，后续裁剪直接在数组上切片
+        images = [to_bgr_ndarray(get_base_image(page)) for page in pages]
+        # 传入ImagePyramid时，layout和MFD直接使用预缩放的层级
+        model_images = [
+            page if isinstance(page, ImagePyramid) else image for page, image in zip(pages, images)
+        ]
 
         # doclayout_yolo
         layout_images = []
-        for image_index, image in enumerate(images):
+        for image_index, image in enumerate(model_images):
             layout_images.append(image)
 
 
-        images_layout_res += self.model.layout_model.batch_predict(
-            layout_images, YOLO_LAYOUT_BASE_BATCH_SIZE
+        images_layout_res += self._run_stage(
+            'layout', YOLO_LAYOUT_BASE_BATCH_SIZE,
+            lambda batch_size: self.model.layout_model.batch_predict(layout_images, batch_size),
+            len(layout_images),
         )
 
         if self.formula_enable:
+            # 文本层预检判定不含公式的页面不参与公式检测和识别
+            formula_indices = [
+                index for index, (_, _, _, mfd_enable) in enumerate(images_with_extra_info) if mfd_enable
+            ]
+            if is_formula_precheck_enabled():
+                get_formula_precheck_stats().add(len(images), len(images) - len(formula_indices))
+            mfd_images = [model_images[index] for index in formula_indices]
+            mfr_images = [images[index] for index in formula_indices]
+
             # 公式检测
-            images_mfd_res = self.model.mfd_model.batch_predict(
-                images, MFD_BASE_BATCH_SIZE
-            )
+            if is_mfd_bucket_batch_enabled():
+                # 每批页数同时受像素预算和页数上限约束，启用batch_tuner时以固定的页数上限为起点调优
+                images_mfd_res = self._run_stage(
+                    'mfd', self.batch_ratio * MFD_BUCKET_BASE_BATCH_SIZE,
+                    lambda batch_size: self.model.mfd_model.batch_predict(
+                        mfd_images, batch_size, pixel_budget=self.batch_ratio * MFD_BASE_BATCH_PIXELS
+                    ),
+                    len(mfd_images),
+                )
+            else:
+                images_mfd_res = self._run_stage(
+                    'mfd', MFD_BASE_BATCH_SIZE,
+                    lambda batch_size: self.model.mfd_model.batch_predict(mfd_images, batch_size),
+                    len(mfd_images),
+                )
 
             # 公式识别
-            images_formula_list = self.model.mfr_model.batch_predict(
-                images_mfd_res,
-                images,
-                batch_size=self.batch_ratio * MFR_BASE_BATCH_SIZE,
+            # 启用公式缓存时命中的公式不经过模型，测得的吞吐取决于命中率而不是批大小，MFR不参与调优
+            mfr_items = sum(len(mfd_res) for mfd_res in images_mfd_res)
+            images_formula_list = self._run_stage(
+                'mfr', self.batch_ratio * MFR_BASE_BATCH_SIZE,
+                lambda batch_size: self.model.mfr_model.batch_predict(
+                    images_mfd_res, mfr_images, batch_size=batch_size
+                ),
+                mfr_items,
+                tune=not is_formula_cache_enabled(),
             )
             mfr_count = 0
-            for image_index in range(len(images)):
-                images_layout_res[image_index] += images_formula_list[image_index]
-                mfr_count += len(images_formula_list[image_index])
+            for image_index, formula_list in zip(formula_indices, images_formula_list):
+                images_layout_res[image_index] += formula_list
+                mfr_count += len(formula_list)
 
         # 清理显存
         # clean_vram(self.model.device, vram_threshold=8)
@@ -72,9 +141,9 @@ class BatchAnalyze:
         ocr_res_list_all_page = []
         table_res_list_all_page = []
         for index in range(len(images)):
-            _, ocr_enable, _lang = images_with_extra_info[index]
+            _, ocr_enable, _lang, _ = images_with_extra_info[index]
             layout_res = images_layout_res[index]
-            pil_img = images[index]
+            page_img = images[index]
 
             ocr_res_list, table_res_list, single_page_mfdetrec_res = (
                 get_res_list_from_layout_res(layout_res)
@@ -83,13 +152,13 @@ class BatchAnalyze:
             ocr_res_list_all_page.append({'ocr_res_list':ocr_res_list,
                                           'lang':_lang,
                                           'ocr_enable':ocr_enable,
-                                          'pil_img':pil_img,
+                                          'page_img':page_img,
                                           'single_page_mfdetrec_res':single_page_mfdetrec_res,
                                           'layout_res':layout_res,
                                           })
 
             for table_res in table_res_list:
-                table_img, _ = crop_img(table_res, pil_img)
+                table_img, _ = crop_img(table_res, page_img)
                 table_res_list_all_page.append({'table_res':table_res,
                                                 'lang':_lang,
                                                 'table_img':table_img,
@@ -106,15 +175,12 @@ class BatchAnalyze:
 
                 for res in ocr_res_list_dict['ocr_res_list']:
                     new_image, useful_list = crop_img(
-                        res, ocr_res_list_dict['pil_img'], crop_paste_x=50, crop_paste_y=50
+                        res, ocr_res_list_dict['page_img'], crop_paste_x=50, crop_paste_y=50
                     )
                     adjusted_mfdetrec_res = get_adjusted_mfdetrec_res(
                         ocr_res_list_dict['single_page_mfdetrec_res'], useful_list
                     )
 
-                    # BGR转换
-                    new_image = cv2.cvtColor(np.asarray(new_image), cv2.COLOR_RGB2BGR)
-
                     all_cropped_images_info.append((
                         new_image, useful_list, ocr_res_list_dict, res, adjusted_mfdetrec_res, _lang
                     ))
@@ -136,7 +202,8 @@ class BatchAnalyze:
                 ocr_model = atom_model_manager.get_atom_model(
                     atom_model_name='ocr',
                     det_db_box_thresh=0.3,
-                    lang=lang
+                    lang=lang,
+                    device=self.device,
                 )
 
                 # 按分辨率分组并同时完成padding
@@ -172,12 +239,16 @@ class BatchAnalyze:
                         batch_images.append(padded_img)
 
                     # 批处理检测
-                    det_batch_size = min(len(batch_images), self.batch_ratio * OCR_DET_BASE_BATCH_SIZE)  # 增加批处理大小
-                    # logger.debug(f"OCR-det batch: {det_batch_size} images, target size: {target_h}x{target_w}")
-                    #14.6%
-                    from mineru.utils.nvtx_utils import nvtx_range
-                    with nvtx_range(f"OCR-det batch: {det_batch_size} images, target size: {target_h}x{target_w}"):
-                        batch_results = ocr_model.text_detector.batch_predict(batch_images, det_batch_size)
+                    def ocr_det_predict(max_batch_size):
+                        det_batch_size = min(len(batch_images), max_batch_size)  # 增加批处理大小
+                        # logger.debug(f"OCR-det batch: {det_batch_size} images, target size: {target_h}x{target_w}")
+                        #14.6%
+                        with nvtx_range(f"OCR-det batch: {det_batch_size} images, target size: {target_h}x{target_w}"):
+                            return ocr_model.text_detector.batch_predict(batch_images, det_batch_size)
+
+                    batch_results = self._run_stage(
+                        'ocr_det', self.batch_ratio * OCR_DET_BASE_BATCH_SIZE, ocr_det_predict, len(batch_images)
+                    )
                     # 处理批处理结果
                     for i, (crop_info, (dt_boxes, elapse)) in enumerate(zip(group_crops, batch_results)):
                         new_image, useful_list, ocr_res_list_dict, res, adjusted_mfdetrec_res, _lang = crop_info
@@ -225,20 +296,21 @@ class BatchAnalyze:
                     atom_model_name='ocr',
                     ocr_show_log=False,
                     det_db_box_thresh=0.3,
-                    lang=_lang
+                    lang=_lang,
+                    device=self.device,
                 )
                 for res in ocr_res_list_dict['ocr_res_list']:
                     new_image, useful_list = crop_img(
-                        res, ocr_res_list_dict['pil_img'], crop_paste_x=50, crop_paste_y=50
+                        res, ocr_res_list_dict['page_img'], crop_paste_x=50, crop_paste_y=50
                     )
                     adjusted_mfdetrec_res = get_adjusted_mfdetrec_res(
                         ocr_res_list_dict['single_page_mfdetrec_res'], useful_list
                     )
                     # OCR-det
-                    new_image = cv2.cvtColor(np.asarray(new_image), cv2.COLOR_RGB2BGR)
-                    ocr_res = ocr_model.ocr(
-                        new_image, mfd_res=adjusted_mfdetrec_res, rec=False
-                    )[0]
+                    with self._stage_busy('ocr_det'):
+                        ocr_res = ocr_model.ocr(
+                            new_image, mfd_res=adjusted_mfdetrec_res, rec=False
+                        )[0]
 
                     # Integration results
                     if ocr_res:
@@ -255,8 +327,10 @@ class BatchAnalyze:
                 table_model = atom_model_manager.get_atom_model(
                     atom_model_name='table',
                     lang=_lang,
+                    device=self.device,
                 )
-                html_code, table_cell_bboxes, logic_points, elapse = table_model.predict(table_res_dict['table_img'])
+                with self._stage_busy('table'):
+                    html_code, table_cell_bboxes, logic_points, elapse = table_model.predict(table_res_dict['table_img'])
                 # 判断是否返回正常
                 if html_code:
                     # 检查html_code是否包含'<table>'和'</table>'
@@ -310,9 +384,10 @@ class BatchAnalyze:
                     ocr_model = atom_model_manager.get_atom_model(
                         atom_model_name='ocr',
                         det_db_box_thresh=0.3,
-                        lang=lang
+                        lang=lang,
+                        device=self.device,
                     )
-                    with nvtx_range(f"OCR-rec batch: {len(img_crop_list)} images"):
+                    with nvtx_range(f"OCR-rec batch: {len(img_crop_list)} images"), self._stage_busy('ocr_rec'):
                         ocr_res_list = ocr_model.ocr(img_crop_list, det=False, tqdm_enable=True)[0]
 
                     # Verify we have matching counts
@@ -0,0 +1,187 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import json
+import os
+import statistics
+import threading
+import time
+
+import torch
+from loguru import logger
+
+from ...utils.model_utils import clean_memory, get_vram
+
+# 吞吐提升不足该比例时认为已到拐点，停止继续放大批大小
+MIN_THROUGHPUT_GAIN = 1.05
+# 峰值显存占比超过该值时不再放大批大小，为文档差异预留余量
+MAX_MEMORY_RATIO = 0.8
+# 批大小探索上限
+MAX_BATCH_SIZE = 512
+# 每个批大小测量的次数，取吞吐中位数比较，减小不同批次内容差异带来的噪声
+MEASURE_REPEATS = 3
+
+
+def _is_oom_error(e: Exception) -> bool:
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e).lower()
+
+
+def get_default_cache_path():
+    return os.getenv(
+        'MINERU_BATCH_AUTOTUNE_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'mineru', 'batch_size_cache.json')
+    )
+
+
+def get_device_key(device):
+    device = str(device)
+    if device.startswith('cuda') and torch.cuda.is_available():
+        name = torch.cuda.get_device_name(device)
+    elif device.startswith('npu'):
+        name = device
+    else:
+        return f'{device}_{os.cpu_count()}cores'
+    vram = get_vram(device)
+    return f'{name}_{round(vram)}GB' if vram else name
+
+
+class BatchSizeTuner:
+    """
+    按阶段自动选择批大小。
+    每个阶段从该阶段未启用调优时使用的批大小出发，在最初的若干批次上测量吞吐(items/s)和峰值显存，
+    同一批大小测量MEASURE_REPEATS次后取中位数与此前最好的吞吐比较，吞吐仍有明显提升
+    且显存有余量时翻倍，否则回退到吞吐最高的批大小并收敛；遇到OOM时减半重试并记录上限。
+    收敛结果按设备缓存到json文件，下次运行直接使用。CPU上没有显存信号，只依据吞吐决策。
+    """
+
+    def __init__(self, device, cache_path=None):
+        self.device = str(device)
+        self.device_key = get_device_key(device)
+        self.cache_path = cache_path or get_default_cache_path()
+        self.track_memory = self.device.startswith('cuda') and torch.cuda.is_available()
+        self.total_memory = torch.cuda.get_device_properties(self.device).total_memory if self.track_memory else None
+        self._lock = threading.Lock()
+
+        self.cached_sizes = self._load_cache().get(self.device_key, {})
+        self.states = {}
+        if self.cached_sizes:
+            logger.info(f'batch sizes loaded from cache for {self.device_key}: {self.cached_sizes}')
+
+    def get(self, stage) -> int:
+        return self.states[stage]['size']
+
+    def _get_state(self, stage, default_size):
+        """阶段第一次运行时以default_size(与未启用调优时相同的批大小)为起点，有缓存时直接使用缓存结果"""
+        with self._lock:
+            if stage not in self.states:
+                cached_size = self.cached_sizes.get(stage)
+                self.states[stage] = {
+                    'size': cached_size or default_size,
+                    'best_size': cached_size or default_size,
+                    'best_throughput': 0.0,
+                    'max_size': MAX_BATCH_SIZE,
+                    'warmed_up': False,
+                    'samples': [],
+                    'converged': cached_size is not None,
+                }
+            return self.states[stage]
+
+    def run(self, stage, default_size, fn, n_items):
+        """以当前批大小执行fn(batch_size)，记录测量结果并更新该阶段的批大小，OOM时减半重试"""
+        state = self._get_state(stage, default_size)
+        while True:
+            batch_size = state['size']
+            if self.track_memory:
+                torch.cuda.reset_peak_memory_stats(self.device)
+            start = time.perf_counter()
+            try:
+                result = fn(batch_size)
+            except RuntimeError as e:
+                if not _is_oom_error(e) or batch_size <= 1:
+                    raise
+                clean_memory(self.device)
+                self._on_oom(stage, batch_size)
+                if state['converged']:
+                    self._save_cache()
+                continue
+            elapsed = time.perf_counter() - start
+            break
+
+        if not state['converged']:
+            peak_ratio = 0.0
+            if self.track_memory:
+                # 使用本批次实际分配的峰值，缓存分配器保留的显存不会随批大小回落，不能反映本批次的占用
+                peak_ratio = torch.cuda.max_memory_allocated(self.device) / self.total_memory
+            self._update(stage, batch_size, n_items, elapsed, peak_ratio)
+        return result
+
+    def _on_oom(self, stage, batch_size):
+        with self._lock:
+            state = self.states[stage]
+            state['max_size'] = max(1, batch_size // 2)
+            state['size'] = state['max_size']
+            state['best_size'] = min(state['best_size'], state['max_size'])
+            state['samples'] = []
+            logger.warning(f'{stage} OOM at batch size {batch_size}, backing off to {state["size"]}')
+
+    def _update(self, stage, batch_size, n_items, elapsed, peak_ratio):
+        with self._lock:
+            state = self.states[stage]
+            # 输入不足一个批次时批大小没有起作用，测量结果不能用于决策
+            if n_items < batch_size or elapsed <= 0 or batch_size != state['size']:
+                return
+            # 第一次调用包含预热开销，不参与比较
+            if not state['warmed_up']:
+                state['warmed_up'] = True
+                return
+
+            # 单次调用的吞吐受该批内容影响较大，同一批大小测满MEASURE_REPEATS次后取中位数再比较
+            state['samples'].append(n_items / elapsed)
+            if len(state['samples']) < MEASURE_REPEATS:
+                return
+            throughput = statistics.median(state['samples'])
+            state['samples'] = []
+            if throughput > state['best_throughput'] * MIN_THROUGHPUT_GAIN:
+                state['best_throughput'] = throughput
+                state['best_size'] = batch_size
+                next_size = batch_size * 2
+                if next_size <= state['max_size'] and peak_ratio < MAX_MEMORY_RATIO:
+                    state['size'] = next_size
+                    return
+            state['size'] = state['best_size']
+            state['converged'] = True
+            logger.info(
+                f'{stage} batch size converged to {state["size"]} on {self.device_key} '
+                f'({round(state["best_throughput"], 2)} items/s)'
+            )
+        self._save_cache()
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self):
+        with self._lock:
+            converged = {stage: state['size'] for stage, state in self.states.items() if state['converged']}
+        try:
+            cache = self._load_cache()
+            cache.setdefault(self.device_key, {}).update(converged)
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=4)
+        except OSError as e:
+            logger.warning(f'failed to save batch size cache to {self.cache_path}: {e}')
+
+
+_tuners = {}
+_tuners_lock = threading.Lock()
+
+
+def get_batch_size_tuner(device) -> BatchSizeTuner:
+    """每个设备一个tuner，在多次batch_image_analyze调用之间保留测量状态"""
+    key = str(device)
+    with _tuners_lock:
+        if key not in _tuners:
+            _tuners[key] = BatchSizeTuner(device)
+        return _tuners[key]
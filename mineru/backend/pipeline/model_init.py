@@ -1,4 +1,5 @@
 import os
+import threading
 
 import torch
 from loguru import logger
@@ -9,17 +10,19 @@ from ...model.mfd.yolo_v8 import YOLOv8MFDModel
 from ...model.mfr.unimernet.Unimernet import UnimernetModel
 from ...model.ocr.paddleocr2pytorch.pytorch_paddle import PytorchPaddleOCR
 from ...model.table.rapid_table import RapidTableModel
+from ...utils.config_reader import get_device
 from ...utils.enum_class import ModelPath
 from ...utils.models_download_utils import auto_download_and_get_model_root_path
 
 
-def table_model_init(lang=None):
+def table_model_init(lang=None, device=None):
     atom_model_manager = AtomModelSingleton()
     ocr_engine = atom_model_manager.get_atom_model(
         atom_model_name='ocr',
         det_db_box_thresh=0.5,
         det_db_unclip_ratio=1.6,
-        lang=lang
+        lang=lang,
+        device=device,
     )
     table_model = RapidTableModel(ocr_engine)
     return table_model
@@ -47,6 +50,7 @@ def ocr_model_init(det_db_box_thresh=0.3,
                    lang=None,
                    use_dilation=True,
                    det_db_unclip_ratio=1.8,
+                   device=None,
                    ):
     if lang is not None and lang != '':
         model = PytorchPaddleOCR(
@@ -54,12 +58,14 @@ def ocr_model_init(det_db_box_thresh=0.3,
             lang=lang,
             use_dilation=use_dilation,
             det_db_unclip_ratio=det_db_unclip_ratio,
+            device=device,
         )
     else:
         model = PytorchPaddleOCR(
             det_db_box_thresh=det_db_box_thresh,
             use_dilation=use_dilation,
             det_db_unclip_ratio=det_db_unclip_ratio,
+            device=device,
         )
     return model
 
@@ -67,6 +73,8 @@ def ocr_model_init(det_db_box_thresh=0.3,
 class AtomModelSingleton:
     _instance = None
     _models = {}
+    # 多设备并行时各设备的推理线程会同时初始化模型
+    _lock = threading.RLock()
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -77,17 +85,21 @@ class AtomModelSingleton:
 
         lang = kwargs.get('lang', None)
         table_model_name = kwargs.get('table_model_name', None)
+        # 每个设备各持有一份模型
+        device = kwargs.get('device') or get_device()
+        kwargs['device'] = device
 
         if atom_model_name in [AtomicModel.OCR]:
-            key = (atom_model_name, lang)
+            key = (atom_model_name, lang, device)
         elif atom_model_name in [AtomicModel.Table]:
-            key = (atom_model_name, table_model_name, lang)
+            key = (atom_model_name, table_model_name, lang, device)
         else:
-            key = atom_model_name
+            key = (atom_model_name, device)
 
-        if key not in self._models:
-            self._models[key] = atom_model_init(model_name=atom_model_name, **kwargs)
-        return self._models[key]
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = atom_model_init(model_name=atom_model_name, **kwargs)
+            return self._models[key]
 
 def atom_model_init(model_name: str, **kwargs):
     atom_model = None
@@ -110,10 +122,12 @@ def atom_model_init(model_name: str, **kwargs):
         atom_model = ocr_model_init(
             kwargs.get('det_db_box_thresh'),
             kwargs.get('lang'),
+            device=kwargs.get('device'),
         )
     elif model_name == AtomicModel.Table:
         atom_model = table_model_init(
             kwargs.get('lang'),
+            kwargs.get('device'),
         )
     else:
         logger.error('model name not allow')
@@ -170,13 +184,15 @@ class MineruPipelineModel:
         self.ocr_model = atom_model_manager.get_atom_model(
             atom_model_name=AtomicModel.OCR,
             det_db_box_thresh=0.3,
-            lang=self.lang
+            lang=self.lang,
+            device=self.device,
         )
         # init table model
         if self.apply_table:
             self.table_model = atom_model_manager.get_atom_model(
                 atom_model_name=AtomicModel.Table,
                 lang=self.lang,
+                device=self.device,
             )
 
         logger.info('DocAnalysis init done!')
\ No newline at end of file
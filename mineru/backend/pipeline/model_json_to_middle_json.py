@@ -1,33 +1,54 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import multiprocessing
 import os
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
+import pypdfium2 as pdfium
 from loguru import logger
+from PIL import Image
 from tqdm import tqdm
 
 from mineru.utils.config_reader import get_device, get_llm_aided_config, get_formula_enable
 from mineru.backend.pipeline.model_init import AtomModelSingleton
 from mineru.backend.pipeline.para_split import para_split
+from mineru.data.data_reader_writer import DataWriter
 from mineru.utils.block_pre_proc import prepare_block_bboxes, process_groups
 from mineru.utils.block_sort import sort_blocks_by_bbox
 from mineru.utils.boxbase import calculate_overlap_area_in_bbox1_area_ratio
 from mineru.utils.cut_image import cut_image_and_table
-from mineru.utils.enum_class import ContentType
+from mineru.utils.enum_class import ContentType, ImageType
 from mineru.utils.llm_aided import llm_aided_title
 from mineru.utils.model_utils import clean_memory
+from mineru.utils.memory_governor import is_memory_governor_enabled, get_memory_governor
 from mineru.backend.pipeline.pipeline_magic_model import MagicModel
 from mineru.utils.ocr_utils import OcrConfidence
+from mineru.utils.pdf_classify import get_page_ocr_enable
 from mineru.utils.span_block_fix import fill_spans_in_blocks, fix_discarded_block, fix_block_spans
 from mineru.utils.span_pre_proc import remove_outside_spans, remove_overlaps_low_confidence_spans, \
     remove_overlaps_min_spans, txt_spans_extract
 from mineru.version import __version__
-from mineru.utils.hash_utils import str_md5
+from mineru.utils.pdf_image_tools import get_page_img_md5, restore_page_image, release_page_image, \
+    get_pdf_page_range, get_page_image, PdfPageRange
+from mineru.utils.shm_utils import ndarray_to_shm, ndarray_from_shm, release_shm
 
 
 def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer, page_index, ocr_enable=False, formula_enabled=True):
+    page_blocks = page_model_info_to_page_blocks(
+        page_model_info, image_dict, page, image_writer, page_index, ocr_enable=ocr_enable, formula_enabled=formula_enabled
+    )
+    if page_blocks is None:
+        return None
+    return page_blocks_to_page_info(page_blocks, page_index)
+
+
+def page_model_info_to_page_blocks(page_model_info, image_dict, page, image_writer, page_index, ocr_enable=False, formula_enabled=True):
+    """排序之前的页面处理，纯CPU计算且不依赖模型，可以放到子进程中并行执行"""
     scale = image_dict["scale"]
-    page_pil_img = image_dict["img_pil"]
-    page_img_md5 = str_md5(image_dict["img_base64"])
+    page_img = get_page_image(image_dict)
+    page_img_md5 = get_page_img_md5(image_dict)
     page_w, page_h = map(int, page.get_size())
     magic_model = MagicModel(page_model_info, scale)
 
@@ -137,7 +158,7 @@ def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer
         pass
     else:
         """使用新版本的混合ocr方案."""
-        spans = txt_spans_extract(page, spans, page_pil_img, scale, all_bboxes, all_discarded_blocks)
+        spans = txt_spans_extract(page, spans, page_img, scale, all_bboxes, all_discarded_blocks)
 
     """先处理不需要排版的discarded_blocks"""
     discarded_block_with_spans, spans = fill_spans_in_blocks(
@@ -153,7 +174,7 @@ def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer
     for span in spans:
         if span['type'] in [ContentType.IMAGE, ContentType.TABLE, ContentType.INTERLINE_EQUATION]:
             span = cut_image_and_table(
-                span, page_pil_img, page_img_md5, page_index, image_writer, scale=scale
+                span, page_img, page_img_md5, page_index, image_writer, scale=scale
             )
 
     """span填充进block"""
@@ -162,6 +183,12 @@ def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer
     """对block进行fix操作"""
     fix_blocks = fix_block_spans(block_with_spans)
 
+    return fix_blocks, footnote_blocks, fix_discarded_blocks, page_w, page_h
+
+
+def page_blocks_to_page_info(page_blocks, page_index):
+    fix_blocks, footnote_blocks, fix_discarded_blocks, page_w, page_h = page_blocks
+
     """对block进行排序"""
     sorted_blocks = sort_blocks_by_bbox(fix_blocks, page_w, page_h, footnote_blocks)
 
@@ -171,18 +198,143 @@ def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer
     return page_info
 
 
-def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=None, ocr_enable=False, formula_enabled=True):
-    middle_json = {"pdf_info": [], "_backend":"pipeline", "_version_name": __version__}
-    formula_enabled = get_formula_enable(formula_enabled)
-    for page_index, page_model_info in tqdm(enumerate(model_list), total=len(model_list), desc="Processing pages"):
+def _iter_page_blocks(model_list, images_list, pdf_doc, image_writer, ocr_enable, formula_enabled):
+    for page_index, page_model_info in enumerate(model_list):
         page = pdf_doc[page_index]
         image_dict = images_list[page_index]
-        page_info = page_model_info_to_page_info(
-            page_model_info, image_dict, page, image_writer, page_index, ocr_enable=ocr_enable, formula_enabled=formula_enabled
+        # 流式推理时页面位图已被释放，这里按需重新渲染，用完再释放
+        restored = restore_page_image(image_dict, page)
+        page_blocks = page_model_info_to_page_blocks(
+            page_model_info, image_dict, page, image_writer, page_index,
+            ocr_enable=get_page_ocr_enable(ocr_enable, page_index), formula_enabled=formula_enabled
         )
-        if page_info is None:
-            page_w, page_h = map(int, page.get_size())
+        if restored:
+            release_page_image(image_dict)
+        yield page_blocks
+
+
+_worker_pdf_doc = None
+
+
+class _CollectedImageWriter(DataWriter):
+    """子进程中只收集截图的路径和字节，由主进程用调用方传入的image_writer写出，image_writer无需可序列化"""
+
+    def __init__(self):
+        self.images = []
+
+    def write(self, path: str, data: bytes) -> None:
+        self.images.append((path, data))
+
+
+def _init_page_worker(pdf_bytes, start_page_id=0, end_page_id=None):
+    global _worker_pdf_doc
+    _worker_pdf_doc = get_pdf_page_range(pdfium.PdfDocument(pdf_bytes), start_page_id, end_page_id)
+
+
+def _page_blocks_worker(page_index, page_model_info, image_meta, image_type, scale, img_md5, write_images, ocr_enable, formula_enabled):
+    """返回页面区块、处理过程中被修改的page_model_info以及待写出的截图"""
+    page = _worker_pdf_doc[page_index]
+    image_dict = {"scale": scale, "img_md5": img_md5, "image_type": image_type}
+    if image_meta is not None:
+        if image_type == ImageType.NUMPY:
+            image_dict["img_np"] = ndarray_from_shm(image_meta)
+        else:
+            image_dict["img_pil"] = Image.fromarray(ndarray_from_shm(image_meta))
+    else:
+        restore_page_image(image_dict, page)
+    image_writer = _CollectedImageWriter() if write_images else None
+    page_blocks = page_model_info_to_page_blocks(
+        page_model_info, image_dict, page, image_writer, page_index, ocr_enable=ocr_enable, formula_enabled=formula_enabled
+    )
+    return page_blocks, page_model_info, image_writer.images if image_writer is not None else []
+
+
+def _get_page_worker_context():
+    """
+    调用方进程中通常还有其他线程(流式渲染、多设备推理)，fork会把它们正持有的pdfium_lock、模型初始化锁
+    以已加锁状态复制到子进程中导致死锁，因此用forkserver(不支持时用spawn)启动干净的子进程，
+    子进程只通过模块级的_init_page_worker初始化。
+    """
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(start_method)
+
+
+def _iter_page_blocks_parallel(model_list, images_list, pdf_bytes, image_writer, ocr_enable, formula_enabled, workers, start_page_id=0):
+    """
+    将页面分发到进程池并按页序产出结果，排序(可能用到layoutreader模型)仍在主进程完成。
+    每个子进程各自打开pdf文档，页面像素经共享内存传递；同时在途的页面数有上限，避免一次性拷贝全部页面。
+    子进程修改的是page_model_info的副本，主进程将其写回model_list，与串行路径原地修改的结果一致；
+    截图在主进程中用image_writer写出。
+    """
+    max_inflight = workers * 4
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=_get_page_worker_context(),
+            initializer=_init_page_worker,
+            initargs=(pdf_bytes, start_page_id, start_page_id + len(model_list) - 1),
+    ) as executor:
+        pending = deque()
+        next_page_index = 0
+        try:
+            while next_page_index < len(model_list) or pending:
+                while next_page_index < len(model_list) and len(pending) < max_inflight:
+                    image_dict = images_list[next_page_index]
+                    shm, image_meta = None, None
+                    page_img = get_page_image(image_dict)
+                    if page_img is not None:
+                        shm, image_meta = ndarray_to_shm(np.asarray(page_img))
+                    future = executor.submit(
+                        _page_blocks_worker, next_page_index, model_list[next_page_index], image_meta,
+                        image_dict.get("image_type", ImageType.PIL),
+                        image_dict["scale"], get_page_img_md5(image_dict), bool(image_writer),
+                        get_page_ocr_enable(ocr_enable, next_page_index), formula_enabled
+                    )
+                    pending.append((next_page_index, future, shm))
+                    next_page_index += 1
+                page_index, future, shm = pending.popleft()
+                try:
+                    page_blocks, page_model_info, images = future.result()
+                    model_list[page_index] = page_model_info
+                    for path, data in images:
+                        image_writer.write(path, data)
+                    yield page_blocks
+                finally:
+                    if shm is not None:
+                        release_shm(shm)
+        finally:
+            for _, future, shm in pending:
+                future.cancel()
+                if shm is not None:
+                    release_shm(shm)
+
+
+def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=None, ocr_enable=False, formula_enabled=True, pdf_bytes=None):
+    """
+    可通过环境变量MINERU_MIDDLE_JSON_WORKERS开启多进程并行构建页面(需同时传入pdf_bytes)，
+    结果按页序合并后再进行后置ocr和分段，与串行结果一致。
+    ocr_enable可以是整个文档的bool，也可以是doc_analyze按页分类得到的bool列表。
+    """
+    middle_json = {"pdf_info": [], "_backend":"pipeline", "_version_name": __version__}
+    formula_enabled = get_formula_enable(formula_enabled)
+
+    workers = int(os.getenv('MINERU_MIDDLE_JSON_WORKERS', 0))
+    if pdf_bytes is not None and workers > 1 and len(model_list) > 1:
+        # pdf_doc为页范围视图时，子进程按相同的起始页打开pdf_bytes
+        start_page_id = pdf_doc.start_page_id if isinstance(pdf_doc, PdfPageRange) else 0
+        page_blocks_iter = _iter_page_blocks_parallel(
+            model_list, images_list, pdf_bytes, image_writer, ocr_enable, formula_enabled, workers, start_page_id
+        )
+    else:
+        page_blocks_iter = _iter_page_blocks(
+            model_list, images_list, pdf_doc, image_writer, ocr_enable, formula_enabled
+        )
+
+    for page_index, page_blocks in tqdm(enumerate(page_blocks_iter), total=len(model_list), desc="Processing pages"):
+        if page_blocks is None:
+            page_w, page_h = map(int, pdf_doc[page_index].get_size())
             page_info = make_page_info_dict([], page_index, page_w, page_h, [])
+        else:
+            page_info = page_blocks_to_page_info(page_blocks, page_index)
         middle_json["pdf_info"].append(page_info)
 
     """后置ocr处理"""
@@ -243,7 +395,9 @@ def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=N
 
     """清理内存"""
     pdf_doc.close()
-    if os.getenv('MINERU_DONOT_CLEAN_MEM') is None and len(model_list) >= 10:
+    if is_memory_governor_enabled():
+        get_memory_governor().maybe_release(get_device())
+    elif os.getenv('MINERU_DONOT_CLEAN_MEM') is None and len(model_list) >= 10:
         clean_memory(get_device())
 
     return middle_json
@@ -0,0 +1,206 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+from ...model.layout.doclayout_yolo import is_layout_rect_batch_enabled
+from ...model.mfd.yolo_v8 import is_mfd_bucket_batch_enabled
+from ...model.mfr.unimernet.Unimernet import is_mfr_continuous_batching_enabled
+from ...model.ocr.paddleocr2pytorch.pytorch_paddle import get_ocr_lang, get_ocr_model_paths
+from ...utils.enum_class import ModelPath
+from ...utils.formula_decode_budget import is_mfr_early_stop_enabled
+from ...utils.image_pyramid import ImagePyramid, get_base_image
+from ...utils.models_download_utils import auto_download_and_get_model_root_path
+from ...utils.yolo_onnx import is_yolo_onnx_enabled
+from ...version import __version__
+
+# 超过容量上限后淘汰到该比例，避免每次写入都触发淘汰
+EVICT_TARGET_RATIO = 0.9
+
+
+def is_page_cache_enabled():
+    return os.getenv('MINERU_PAGE_CACHE', 'false').lower() == 'true'
+
+
+def get_default_cache_path():
+    return os.getenv(
+        'MINERU_PAGE_CACHE_PATH',
+        os.path.join(os.path.expanduser('~'), '.cache', 'mineru', 'page_result_cache.sqlite')
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_model_weight_path(relative_path):
+    return os.path.join(auto_download_and_get_model_root_path(relative_path), relative_path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_weight_fingerprint(path) -> str:
+    """权重文件(目录时为其下所有文件)的相对路径、大小和修改时间的摘要，替换权重后随之变化"""
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    hasher = hashlib.blake2b(digest_size=8)
+    for file in files:
+        stat = os.stat(file)
+        hasher.update(f'{os.path.relpath(file, path)}|{stat.st_size}|{stat.st_mtime_ns}|'.encode())
+    return hasher.hexdigest()
+
+
+def get_model_version_tag(lang, formula_enable, table_enable, device):
+    """代码版本或实际加载的模型权重变化时缓存键随之变化，旧结果不会被命中"""
+    weight_paths = [get_model_weight_path(ModelPath.doclayout_yolo)]
+    if formula_enable:
+        weight_paths += [get_model_weight_path(ModelPath.yolo_v8_mfd), get_model_weight_path(ModelPath.unimernet_small)]
+    if table_enable:
+        weight_paths.append(get_model_weight_path(ModelPath.slanet_plus))
+    # OCR模型按语言和设备选择，与PytorchPaddleOCR的选择规则一致
+    weight_paths += get_ocr_model_paths(get_ocr_lang(lang or 'ch', str(device)))
+    return '|'.join([__version__] + [get_weight_fingerprint(path) for path in weight_paths])
+
+
+def get_output_settings_tag(device):
+    """会改变推理结果的开关的实际取值"""
+    return '|'.join(f'{name}={value}' for name, value in [
+        ('yolo_onnx', is_yolo_onnx_enabled() and str(device) == 'cpu'),
+        ('layout_rect_batch', is_layout_rect_batch_enabled()),
+        ('mfd_bucket_batch', is_mfd_bucket_batch_enabled()),
+        ('mfr_early_stop', is_mfr_early_stop_enabled()),
+        ('mfr_continuous_batching', is_mfr_continuous_batching_enabled()),
+    ])
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class PageResultCache:
+    """
+    页面推理结果(layout_dets)的磁盘缓存，基于sqlite。
+    键为渲染后页面像素的哈希加上代码版本、模型权重、语言、ocr/公式/表格开关以及其他会改变结果的开关，
+    总大小超过上限时按最近访问时间(LRU)淘汰。
+    """
+
+    def __init__(self, cache_path=None, max_bytes=None):
+        self.cache_path = cache_path or get_default_cache_path()
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv('MINERU_PAGE_CACHE_SIZE_MB', 1024)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self._version_tags = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS page_results ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON page_results (last_access)')
+        self._conn.commit()
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM page_results').fetchone()[0]
+
+    def get_version_tag(self, lang, formula_enable, table_enable, device):
+        tag_key = (lang, bool(formula_enable), bool(table_enable), str(device))
+        with self._lock:
+            version_tag = self._version_tags.get(tag_key)
+        if version_tag is None:
+            version_tag = get_model_version_tag(*tag_key)
+            with self._lock:
+                self._version_tags[tag_key] = version_tag
+        return version_tag
+
+    def make_key(self, image, ocr_enable, lang, formula_enable, table_enable, device):
+        hasher = hashlib.blake2b(digest_size=20)
+        version_tag = self.get_version_tag(lang, formula_enable, table_enable, device)
+        settings_tag = f'{get_output_settings_tag(device)}|page_pyramid={isinstance(image, ImagePyramid)}'
+        image = get_base_image(image)
+        if isinstance(image, np.ndarray):
+            hasher.update(f'BGR|{image.shape[1]}x{image.shape[0]}|'.encode())
+            hasher.update(np.ascontiguousarray(image))
+        else:
+            hasher.update(f'{image.mode}|{image.width}x{image.height}|'.encode())
+            hasher.update(image.tobytes())
+        hasher.update(
+            f'|{version_tag}|{settings_tag}|{lang}|{ocr_enable}|{formula_enable}|{table_enable}'.encode()
+        )
+        return hasher.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM page_results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._conn.execute('UPDATE page_results SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, layout_dets):
+        """
+        写入推理结果并返回其经过JSON序列化往返后的值，与命中缓存时get返回的值一致
+        (numpy标量已转换为python类型)，调用方应使用返回值代替原始结果。
+        """
+        value = json.dumps(layout_dets, ensure_ascii=False, default=_json_default).encode('utf-8')
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM page_results WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO page_results (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+                (key, value, len(value), time.time())
+            )
+            self._total_bytes += len(value) - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+        return json.loads(value)
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        rows = self._conn.execute('SELECT key, size FROM page_results ORDER BY last_access ASC').fetchall()
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            self._conn.execute('DELETE FROM page_results WHERE key = ?', (key,))
+            self._total_bytes -= size
+            self._stats['evictions'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['bytes'] = self._total_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"page result cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"(hit rate {stats['hit_rate']:.1%}), {stats['evictions']} evictions, "
+            f"{round(stats['bytes'] / 1024 / 1024, 2)} MB"
+        )
+
+
+_page_result_cache = None
+_page_result_cache_lock = threading.Lock()
+
+
+def get_page_result_cache() -> PageResultCache:
+    global _page_result_cache
+    with _page_result_cache_lock:
+        if _page_result_cache is None:
+            _page_result_cache = PageResultCache()
+        return _page_result_cache
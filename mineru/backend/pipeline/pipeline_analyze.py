@@ -1,14 +1,28 @@
 import os
+import queue
+import threading
 import time
+from contextlib import closing
 from typing import List, Tuple
-import PIL.Image
+import numpy as np
+import pypdfium2 as pdfium
 from loguru import logger
 
 from .model_init import MineruPipelineModel
-from mineru.utils.config_reader import get_device
-from ...utils.pdf_classify import classify
-from ...utils.pdf_image_tools import load_images_from_pdf
+from .page_result_cache import is_page_cache_enabled, get_page_result_cache
+from mineru.utils.config_reader import get_device, get_devices, get_formula_enable, get_table_enable
+from ...utils.pdf_classify import classify_doc, classify_each_page, is_page_level_classify_enabled, get_page_ocr_enable
+from ...utils.pdf_image_tools import load_images_from_pdf, iter_images_from_pdf, release_page_image, pdfium_lock, \
+    get_pdf_page_range, get_render_workers, iter_images_from_pdf_parallel
 from ...utils.model_utils import get_vram, clean_memory
+from ...utils.memory_governor import is_memory_governor_enabled, get_memory_governor
+from ...utils.stage_stats import StageStats
+from ...utils.enum_class import ImageType
+from ...utils.image_pyramid import is_page_pyramid_enabled, get_page_pyramid_levels, get_smallest_image
+from ...utils.blank_page import is_blank_page_filter_enabled, get_blank_page_filter
+from ...utils.formula_precheck import is_formula_precheck_enabled, get_page_mfd_enable, get_formula_precheck_stats
+from ...utils.formula_cache import is_formula_cache_enabled, get_formula_cache
+from ...utils.formula_decode_budget import is_mfr_early_stop_enabled, get_decode_budget_stats
 
 
 os.environ['PYTORCH_ENABLE_MPS_FALLBACK'] = '1'  # 让mps可以fallback
@@ -17,6 +31,7 @@ os.environ['NO_ALBUMENTATIONS_UPDATE'] = '1'  # 禁止albumentations检查更新
 class ModelSingleton:
     _instance = None
     _models = {}
+    _lock = threading.RLock()
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -28,25 +43,31 @@ class ModelSingleton:
         lang=None,
         formula_enable=None,
         table_enable=None,
+        device=None,
     ):
-        key = (lang, formula_enable, table_enable)
-        if key not in self._models:
-            self._models[key] = custom_model_init(
-                lang=lang,
-                formula_enable=formula_enable,
-                table_enable=table_enable,
-            )
-        return self._models[key]
+        # 每个设备各持有一套模型
+        device = device or get_device()
+        key = (lang, formula_enable, table_enable, device)
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = custom_model_init(
+                    lang=lang,
+                    formula_enable=formula_enable,
+                    table_enable=table_enable,
+                    device=device,
+                )
+            return self._models[key]
 
 
 def custom_model_init(
     lang=None,
     formula_enable=True,
     table_enable=True,
+    device=None,
 ):
     model_init_start = time.time()
     # 从配置文件读取model-dir和device
-    device = get_device()
+    device = device or get_device()
 
     formula_config = {"enable": formula_enable}
     table_config = {"enable": table_enable}
@@ -72,84 +93,492 @@ def doc_analyze(
         parse_method: str = 'auto',
         formula_enable=True,
         table_enable=True,
+        streaming=None,
+        doc_ready_callback=None,
+        devices=None,
+        page_ranges=None,
 ):
     """
     适当调大MIN_BATCH_INFERENCE_SIZE可以提高性能，更大的 MIN_BATCH_INFERENCE_SIZE会消耗更多内存，
     可通过环境变量MINERU_MIN_BATCH_INFERENCE_SIZE设置，默认值为384。
+
+    streaming为True时边渲染边推理，页面位图在推理后即被释放，峰值内存只与批大小相关，
+    未指定时读取环境变量MINERU_PIPELINE_STREAMING，默认关闭。
+
+    doc_ready_callback不为None时，每个文档的所有页面推理完成后立即按文档顺序调用
+    doc_ready_callback(pdf_idx, model_list, images_list, pdf_doc, lang, ocr_enable)，
+    调用期间持有pdfium_lock，回调内可安全使用pdf_doc。
+
+    devices为设备列表(如["cuda:0", "cuda:1"])时每个设备各加载一套模型，批次被切分后由空闲的设备领取推理，
+    结果按原顺序返回；未指定时读取环境变量MINERU_DEVICES，默认只使用get_device()返回的设备。
+
+    page_ranges为每个文档的(start_page_id, end_page_id)，只渲染和推理范围内的页面，
+    返回的pdf_doc为按相对页号访问的PdfPageRange视图，无需预先把选中页另存为新的pdf bytes。
+
+    parse_method为auto且开启MINERU_PAGE_LEVEL_CLASSIFY时逐页判断是否需要OCR，
+    此时返回和回调中的ocr_enable为与页序对齐的bool列表，可直接传给result_to_middle_json。
+
+    开启MINERU_FORMULA_PRECHECK时根据pdf文本层逐页预检，没有任何公式迹象的电子版页面跳过MFD和MFR。
     """
     min_batch_inference_size = int(os.environ.get('MINERU_MIN_BATCH_INFERENCE_SIZE', 384))
+    if devices is None:
+        devices = get_devices()
+
+    if streaming is None:
+        streaming = os.getenv('MINERU_PIPELINE_STREAMING', 'false').lower() == 'true'
+    if streaming:
+        return _doc_analyze_streaming(
+            pdf_bytes_list, lang_list, parse_method,
+            formula_enable, table_enable, min_batch_inference_size,
+            doc_ready_callback, devices, page_ranges,
+        )
 
     # 收集所有页面信息
-    all_pages_info = []  # 存储(dataset_index, page_index, img, ocr, lang, width, height)
+    all_pages_info = []  # 存储(dataset_index, page_index, img, ocr, lang, mfd)
 
     all_image_lists = []
     all_pdf_docs = []
     ocr_enabled_list = []
     for pdf_idx, pdf_bytes in enumerate(pdf_bytes_list):
-        # 确定OCR设置
-        _ocr_enable = False
-        if parse_method == 'auto':
-            if classify(pdf_bytes) == 'ocr':
-                _ocr_enable = True
-        elif parse_method == 'ocr':
-            _ocr_enable = True
-
-        ocr_enabled_list.append(_ocr_enable)
         _lang = lang_list[pdf_idx]
 
         # 收集每个数据集中的页面
-        images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
+        start_page_id, end_page_id = _get_page_range(page_ranges, pdf_idx)
+        images_list, pdf_doc = load_images_from_pdf(
+            pdf_bytes, start_page_id=start_page_id, end_page_id=end_page_id, image_type=ImageType.NUMPY,
+            pyramid_levels=_get_pyramid_levels(),
+        )
         all_image_lists.append(images_list)
         all_pdf_docs.append(pdf_doc)
+
+        # 确定OCR设置
+        _ocr_enable = _get_ocr_enable(parse_method, pdf_doc)
+        ocr_enabled_list.append(_ocr_enable)
+        _mfd_enable = _get_mfd_enable(pdf_doc, _ocr_enable)
+
         for page_idx in range(len(images_list)):
             img_dict = images_list[page_idx]
             all_pages_info.append((
                 pdf_idx, page_idx,
-                img_dict['img_pil'], _ocr_enable, _lang,
+                _get_model_input(img_dict), get_page_ocr_enable(_ocr_enable, page_idx), _lang,
+                _mfd_enable is None or _mfd_enable[page_idx],
             ))
 
     # 准备批处理
-    images_with_extra_info = [(info[2], info[3], info[4]) for info in all_pages_info]
     batch_size = min_batch_inference_size
-    batch_images = [
-        images_with_extra_info[i:i + batch_size]
-        for i in range(0, len(images_with_extra_info), batch_size)
-    ]
+    total_pages = len(all_pages_info)
+    batch_count = (total_pages + batch_size - 1) // batch_size
 
     # 执行批处理
-    results = []
-    processed_images_count = 0
-    for index, batch_image in enumerate(batch_images):
-        processed_images_count += len(batch_image)
+    infer_results = [[] for _ in range(len(pdf_bytes_list))]
+    doc_page_counts = [len(images_list) for images_list in all_image_lists]
+    next_doc_idx = 0
+    for index, batch_start in enumerate(range(0, total_pages, batch_size)):
+        batch_end = min(batch_start + batch_size, total_pages)
+        batch_image = [(info[2], info[3], info[4], info[5]) for info in all_pages_info[batch_start:batch_end]]
         logger.info(
-            f'Batch {index + 1}/{len(batch_images)}: '
-            f'{processed_images_count} pages/{len(images_with_extra_info)} pages'
+            f'Batch {index + 1}/{batch_count}: '
+            f'{batch_end} pages/{total_pages} pages'
+        )
+        batch_results = multi_device_batch_image_analyze(batch_image, formula_enable, table_enable, devices)
+
+        # 构建返回结果
+        for page_info, result in zip(all_pages_info[batch_start:batch_end], batch_results):
+            pdf_idx, page_idx, page_img, _, _, _ = page_info
+            page_info_dict = {'page_no': page_idx, 'width': page_img.shape[1], 'height': page_img.shape[0]}
+            page_dict = {'layout_dets': result, 'page_info': page_info_dict}
+            infer_results[pdf_idx].append(page_dict)
+            # 金字塔层级只在推理阶段使用
+            all_image_lists[pdf_idx][page_idx].pop('img_pyramid', None)
+        # 不再持有已推理页面的引用，回调中释放的页面图像可以被及时回收
+        all_pages_info[batch_start:batch_end] = [None] * (batch_end - batch_start)
+
+        next_doc_idx = _emit_ready_docs(
+            doc_ready_callback, next_doc_idx, doc_page_counts, infer_results,
+            all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list,
         )
-        batch_results = batch_image_analyze(batch_image, formula_enable, table_enable)
-        results.extend(batch_results)
 
-    # 构建返回结果
-    infer_results = []
+    _emit_ready_docs(
+        doc_ready_callback, next_doc_idx, doc_page_counts, infer_results,
+        all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list,
+    )
+    _log_run_stats()
+
+    return infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list
+
+
+def _emit_ready_docs(
+        doc_ready_callback, next_doc_idx, doc_page_counts, infer_results,
+        all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list,
+):
+    """按文档顺序对所有页面都已推理完成的文档调用回调，返回下一个待检查的文档下标"""
+    if doc_ready_callback is None:
+        return next_doc_idx
+    while next_doc_idx < len(doc_page_counts) and \
+            len(infer_results[next_doc_idx]) == doc_page_counts[next_doc_idx]:
+        with pdfium_lock:
+            doc_ready_callback(
+                next_doc_idx, infer_results[next_doc_idx], all_image_lists[next_doc_idx],
+                all_pdf_docs[next_doc_idx], lang_list[next_doc_idx], ocr_enabled_list[next_doc_idx],
+            )
+        next_doc_idx += 1
+    return next_doc_idx
+
+
+def _log_run_stats():
+    if is_memory_governor_enabled():
+        get_memory_governor().log_stats()
+    if is_page_cache_enabled():
+        get_page_result_cache().log_stats()
+    if is_blank_page_filter_enabled():
+        get_blank_page_filter().log_stats()
+    if is_formula_precheck_enabled():
+        get_formula_precheck_stats().log_stats()
+    if is_formula_cache_enabled():
+        get_formula_cache().log_stats()
+    if is_mfr_early_stop_enabled():
+        get_decode_budget_stats().log_stats()
+
+
+_PAGE_STREAM_END = object()
+_last_stage_stats = None
+
+
+def get_last_stage_stats():
+    """返回最近一次流式doc_analyze各阶段的busy/idle统计"""
+    return _last_stage_stats.summary() if _last_stage_stats is not None else {}
+
+
+def _get_page_range(page_ranges, pdf_idx):
+    if page_ranges is None or page_ranges[pdf_idx] is None:
+        return 0, None
+    return page_ranges[pdf_idx]
+
+
+def _get_pyramid_levels():
+    return get_page_pyramid_levels() if is_page_pyramid_enabled() else None
+
+
+def _get_model_input(img_dict):
+    """启用页面金字塔时送入模型的是ImagePyramid，layout/MFD从中取预缩放的层级"""
+    if img_dict.get('img_pyramid') is not None:
+        return img_dict['img_pyramid']
+    return img_dict['img_np']
+
+
+def _get_ocr_enable(parse_method, pdf_doc):
+    """
+    返回整个文档的ocr开关；auto模式下只对pdf_doc(页面范围视图)内的页面分类，
+    开启MINERU_PAGE_LEVEL_CLASSIFY时按页分类，返回与pdf_doc页序对齐的bool列表，
+    只有扫描页走OCR识别，其余页面保留文本层。
+    """
+    if parse_method == 'auto':
+        if is_page_level_classify_enabled():
+            return [page_type == 'ocr' for page_type in classify_each_page(pdf_doc)]
+        return classify_doc(pdf_doc) == 'ocr'
+    return parse_method == 'ocr'
+
 
-    for _ in range(len(pdf_bytes_list)):
-        infer_results.append([])
+def _get_mfd_enable(pdf_doc, ocr_enable):
+    """开启MINERU_FORMULA_PRECHECK时返回与pdf_doc页序对齐的MFD开关列表，否则返回None(所有页面都做公式检测)"""
+    if is_formula_precheck_enabled():
+        return get_page_mfd_enable(pdf_doc, ocr_enable)
+    return None
 
-    for i, page_info in enumerate(all_pages_info):
-        pdf_idx, page_idx, pil_img, _, _ = page_info
-        result = results[i]
 
-        page_info_dict = {'page_no': page_idx, 'width': pil_img.width, 'height': pil_img.height}
-        page_dict = {'layout_dets': result, 'page_info': page_info_dict}
+def _produce_batches(
+        batch_queue, stop_event, batch_size, stage_stats,
+        pdf_bytes_list, lang_list, parse_method,
+        all_image_lists, all_pdf_docs, ocr_enabled_list, doc_page_counts,
+        page_ranges=None,
+):
+    """
+    生产者线程：在后台渲染并组装下一个批次。
+    队列容量为1且每次放入后等待消费者取走，保证内存中最多只有
+    "正在推理的批次 + 正在准备的批次" 两个批次（双缓冲）。
+    消费者出错退出时会设置stop_event，生产者随即停止渲染并返回。
+    """
+    def put(batch):
+        with stage_stats.idle('render'):
+            batch_queue.put(batch)
+            batch_queue.join()
+        return not stop_event.is_set()
+
+    render_workers = get_render_workers()
+    pyramid_levels = _get_pyramid_levels()
+    try:
+        pages = []
+        stage_start = time.perf_counter()
+        for pdf_idx, pdf_bytes in enumerate(pdf_bytes_list):
+            if stop_event.is_set():
+                return
+            start_page_id, end_page_id = _get_page_range(page_ranges, pdf_idx)
+            with pdfium_lock:
+                pdf_doc = get_pdf_page_range(pdfium.PdfDocument(pdf_bytes), start_page_id, end_page_id)
+                _ocr_enable = _get_ocr_enable(parse_method, pdf_doc)
+                _mfd_enable = _get_mfd_enable(pdf_doc, _ocr_enable)
+            ocr_enabled_list.append(_ocr_enable)
+            _lang = lang_list[pdf_idx]
+
+            all_pdf_docs.append(pdf_doc)
+            images_list = []
+            all_image_lists.append(images_list)
+            # 页数最后登记，消费者据此判断文档是否已全部推理完成
+            doc_page_counts.append(len(pdf_doc))
+            if render_workers > 1:
+                images_iter = iter_images_from_pdf_parallel(
+                    pdf_bytes, render_workers, start_page_id=start_page_id, end_page_id=end_page_id,
+                    image_type=ImageType.NUMPY, pyramid_levels=pyramid_levels,
+                )
+            else:
+                images_iter = iter_images_from_pdf(pdf_doc, image_type=ImageType.NUMPY, pyramid_levels=pyramid_levels)
+            # 提前返回时及时关闭页面迭代器，释放渲染进程池
+            with closing(images_iter):
+                for page_idx, img_dict in enumerate(images_iter):
+                    images_list.append(img_dict)
+                    pages.append((
+                        pdf_idx, page_idx, img_dict, get_page_ocr_enable(_ocr_enable, page_idx), _lang,
+                        _mfd_enable is None or _mfd_enable[page_idx],
+                    ))
+                    if len(pages) >= batch_size:
+                        stage_stats.add('render', 'busy', time.perf_counter() - stage_start)
+                        if not put(pages):
+                            return
+                        pages = []
+                        stage_start = time.perf_counter()
+        if pages:
+            stage_stats.add('render', 'busy', time.perf_counter() - stage_start)
+            if not put(pages):
+                return
+        batch_queue.put(_PAGE_STREAM_END)
+    except Exception as e:
+        batch_queue.put(e)
+
+
+def _doc_analyze_streaming(
+        pdf_bytes_list,
+        lang_list,
+        parse_method,
+        formula_enable,
+        table_enable,
+        batch_size,
+        doc_ready_callback=None,
+        devices=None,
+        page_ranges=None,
+):
+    global _last_stage_stats
 
-        infer_results[pdf_idx].append(page_dict)
+    all_image_lists = []
+    all_pdf_docs = []
+    ocr_enabled_list = []
+    doc_page_counts = []
+    next_doc_idx = 0
+    infer_results = [[] for _ in range(len(pdf_bytes_list))]
+    stage_stats = StageStats()
+
+    batch_queue = queue.Queue(maxsize=1)
+    stop_event = threading.Event()
+    producer = threading.Thread(
+        target=_produce_batches,
+        args=(batch_queue, stop_event, batch_size, stage_stats,
+              pdf_bytes_list, lang_list, parse_method,
+              all_image_lists, all_pdf_docs, ocr_enabled_list, doc_page_counts, page_ranges),
+        daemon=True,
+    )
+    producer.start()
+
+    batch_index = 0
+    processed_images_count = 0
+    completed = False
+    try:
+        while True:
+            with stage_stats.idle('infer'):
+                pages = batch_queue.get()
+                batch_queue.task_done()
+            if pages is _PAGE_STREAM_END:
+                break
+            if isinstance(pages, Exception):
+                raise pages
+
+            processed_images_count += len(pages)
+            logger.info(f'Batch {batch_index + 1}: {processed_images_count} pages (streaming)')
+            with stage_stats.busy('infer'):
+                batch_results = multi_device_batch_image_analyze(
+                    [
+                        (_get_model_input(img_dict), _ocr_enable, _lang, _mfd_enable)
+                        for _, _, img_dict, _ocr_enable, _lang, _mfd_enable in pages
+                    ],
+                    formula_enable, table_enable, devices, stage_stats
+                )
+            for (pdf_idx, page_idx, img_dict, _, _, _), result in zip(pages, batch_results):
+                np_img = img_dict['img_np']
+                page_info_dict = {'page_no': page_idx, 'width': np_img.shape[1], 'height': np_img.shape[0]}
+                infer_results[pdf_idx].append({'layout_dets': result, 'page_info': page_info_dict})
+                release_page_image(img_dict)
+            batch_index += 1
+
+            next_doc_idx = _emit_ready_docs(
+                doc_ready_callback, next_doc_idx, doc_page_counts, infer_results,
+                all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list,
+            )
 
+        _emit_ready_docs(
+            doc_ready_callback, next_doc_idx, doc_page_counts, infer_results,
+            all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list,
+        )
+        completed = True
+    finally:
+        _stop_producer(producer, batch_queue, stop_event)
+        if not completed:
+            # 出错时文档不会返回给调用方，在这里关闭
+            with pdfium_lock:
+                for pdf_doc in all_pdf_docs:
+                    pdf_doc.close()
+    stage_stats.log('streaming doc_analyze')
+    _log_run_stats()
+    _last_stage_stats = stage_stats
     return infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list
 
 
+def _stop_producer(producer, batch_queue, stop_event):
+    """通知生产者线程停止，并取走队列中剩余的批次，让阻塞在put/join上的生产者得以返回，然后等待其结束"""
+    stop_event.set()
+    while producer.is_alive():
+        try:
+            batch_queue.get(timeout=0.1)
+            batch_queue.task_done()
+        except queue.Empty:
+            pass
+    producer.join()
+
+
+def multi_device_batch_image_analyze(
+        images_with_extra_info: List[Tuple[np.ndarray, bool, str, bool]],
+        formula_enable=True,
+        table_enable=True,
+        devices=None,
+        stage_stats=None):
+    """
+    多设备数据并行：将批次切成若干块放入共享队列，每个设备一个线程，空闲的设备领取下一块(work stealing)，
+    各块结果按原顺序拼接返回。只有一个设备时直接调用batch_image_analyze。
+    stage_stats不为None时记录BatchAnalyze各阶段(layout/mfd/mfr/ocr_det/ocr_rec/table)的忙碌时间，多设备时为各设备之和。
+    """
+    if not devices or len(devices) <= 1:
+        device = devices[0] if devices else None
+        return batch_image_analyze(images_with_extra_info, formula_enable, table_enable, device, stage_stats)
+
+    # 每个设备平均领取两块，块越小负载越均衡，但单设备上的推理批次越小
+    chunk_size = max(1, -(-len(images_with_extra_info) // (len(devices) * 2)))
+    chunk_queue = queue.Queue()
+    chunk_count = 0
+    for chunk_start in range(0, len(images_with_extra_info), chunk_size):
+        chunk_queue.put((chunk_count, images_with_extra_info[chunk_start:chunk_start + chunk_size]))
+        chunk_count += 1
+    chunk_results = [None] * chunk_count
+    errors = []
+
+    def worker(device):
+        # 当前设备按线程生效，让未显式指定设备的操作也落在本线程的设备上
+        if ':' in str(device):
+            if str(device).startswith('cuda'):
+                import torch
+                torch.cuda.set_device(device)
+            elif str(device).startswith('npu'):
+                import torch_npu
+                torch_npu.npu.set_device(device)
+        while not errors:
+            try:
+                chunk_idx, chunk = chunk_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                chunk_results[chunk_idx] = batch_image_analyze(chunk, formula_enable, table_enable, device, stage_stats)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=worker, args=(device,), daemon=True) for device in devices]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    results = []
+    for chunk_result in chunk_results:
+        results.extend(chunk_result)
+    return results
+
+
 def batch_image_analyze(
-        images_with_extra_info: List[Tuple[PIL.Image.Image, bool, str]],
+        images_with_extra_info: List[Tuple[np.ndarray, bool, str, bool]],
+        formula_enable=True,
+        table_enable=True,
+        device=None,
+        stage_stats=None):
+    """开启空白页过滤(MINERU_BLANK_PAGE_FILTER)时，空白页直接得到空的layout_dets，其余页面才送入后续流程"""
+    if not is_blank_page_filter_enabled():
+        return _cached_batch_image_analyze(images_with_extra_info, formula_enable, table_enable, device, stage_stats)
+
+    blank_page_filter = get_blank_page_filter()
+    results = [[] for _ in images_with_extra_info]
+    # 有页面金字塔时在最小的层级上检查，不再从整页原图缩放
+    content_indices = [
+        index for index, (image, _, _, _) in enumerate(images_with_extra_info)
+        if not blank_page_filter.is_blank(get_smallest_image(image))
+    ]
+    if content_indices:
+        content_results = _cached_batch_image_analyze(
+            [images_with_extra_info[index] for index in content_indices],
+            formula_enable, table_enable, device, stage_stats
+        )
+        for index, result in zip(content_indices, content_results):
+            results[index] = result
+    return results
+
+
+def _cached_batch_image_analyze(
+        images_with_extra_info: List[Tuple[np.ndarray, bool, str, bool]],
+        formula_enable=True,
+        table_enable=True,
+        device=None,
+        stage_stats=None):
+    """开启页面结果缓存(MINERU_PAGE_CACHE)时，命中缓存的页面不再推理，只对未命中的页面调用模型"""
+    if not is_page_cache_enabled():
+        return _batch_image_analyze(images_with_extra_info, formula_enable, table_enable, device, stage_stats)
+
+    page_cache = get_page_result_cache()
+    _formula_enable = get_formula_enable(formula_enable)
+    _table_enable = get_table_enable(table_enable)
+    _device = device or get_device()
+    results = [None] * len(images_with_extra_info)
+    miss_indices = []
+    miss_keys = []
+    for index, (image, ocr_enable, lang, mfd_enable) in enumerate(images_with_extra_info):
+        key = page_cache.make_key(image, ocr_enable, lang, _formula_enable and mfd_enable, _table_enable, _device)
+        results[index] = page_cache.get(key)
+        if results[index] is None:
+            miss_indices.append(index)
+            miss_keys.append(key)
+
+    if miss_indices:
+        miss_results = _batch_image_analyze(
+            [images_with_extra_info[index] for index in miss_indices],
+            formula_enable, table_enable, device, stage_stats
+        )
+        for index, key, result in zip(miss_indices, miss_keys, miss_results):
+            # 与命中时一样返回JSON往返后的结果，两条路径的结果类型一致
+            results[index] = page_cache.put(key, result)
+    return results
+
+
+def _batch_image_analyze(
+        images_with_extra_info: List[Tuple[np.ndarray, bool, str, bool]],
         formula_enable=True,
-        table_enable=True):
+        table_enable=True,
+        device=None,
+        stage_stats=None):
     # os.environ['CUDA_VISIBLE_DEVICES'] = str(idx)
 
     from .batch_analyze import BatchAnalyze
@@ -157,7 +586,7 @@ def batch_image_analyze(
     model_manager = ModelSingleton()
 
     batch_ratio = 1
-    device = get_device()
+    device = device or get_device()
 
     if str(device).startswith('npu'):
         try:
@@ -190,10 +619,19 @@ def batch_image_analyze(
             batch_ratio = 1
             logger.info(f'Could not determine GPU memory, using default batch_ratio: {batch_ratio}')
 
-    batch_model = BatchAnalyze(model_manager, batch_ratio, formula_enable, table_enable)
+    # 开启自动调优时，以上面按显存估算的批大小为起点，由tuner测量吞吐和显存后选择各阶段批大小
+    batch_tuner = None
+    if os.getenv('MINERU_BATCH_AUTOTUNE', 'false').lower() == 'true':
+        from .batch_size_tuner import get_batch_size_tuner
+        batch_tuner = get_batch_size_tuner(device)
+
+    batch_model = BatchAnalyze(model_manager, batch_ratio, formula_enable, table_enable, batch_tuner=batch_tuner, device=device, stage_stats=stage_stats)
     #76%
     results = batch_model(images_with_extra_info)
 
-    clean_memory(get_device())
+    if is_memory_governor_enabled():
+        get_memory_governor().maybe_release(device)
+    else:
+        clean_memory(device)
 
     return results
\ No newline at end of file
@@ -5,9 +5,8 @@ import cv2
 from mineru.utils.config_reader import get_llm_aided_config
 from mineru.utils.cut_image import cut_image_and_table
 from mineru.utils.enum_class import ContentType
-from mineru.utils.hash_utils import str_md5
 from mineru.backend.vlm.vlm_magic_model import MagicModel
-from mineru.utils.pdf_image_tools import get_crop_img
+from mineru.utils.pdf_image_tools import get_crop_img, get_page_img_md5
 from mineru.version import __version__
 
 heading_level_import_success = False
@@ -33,7 +32,7 @@ def token_to_page_info(token, image_dict, page, image_writer, page_index) -> dic
 
     scale = image_dict["scale"]
     page_pil_img = image_dict["img_pil"]
-    page_img_md5 = str_md5(image_dict["img_base64"])
+    page_img_md5 = get_page_img_md5(image_dict)
     width, height = map(int, page.get_size())
 
     magic_model = MagicModel(token, width, height)
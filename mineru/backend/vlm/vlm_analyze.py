@@ -4,7 +4,7 @@ import time
 from loguru import logger
 
 from ...data.data_reader_writer import DataWriter
-from mineru.utils.pdf_image_tools import load_images_from_pdf
+from mineru.utils.pdf_image_tools import load_images_from_pdf, get_page_img_base64
 from .base_predictor import BasePredictor
 from .predictor import get_predictor
 from .token_to_middle_json import result_to_middle_json
@@ -54,7 +54,7 @@ def doc_analyze(
 
     # load_images_start = time.time()
     images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
-    images_base64_list = [image_dict["img_base64"] for image_dict in images_list]
+    images_base64_list = [get_page_img_base64(image_dict) for image_dict in images_list]
     # load_images_time = round(time.time() - load_images_start, 2)
     # logger.info(f"load images cost: {load_images_time}, speed: {round(len(images_base64_list)/load_images_time, 3)} images/s")
 
@@ -81,7 +81,7 @@ async def aio_doc_analyze(
 
     # load_images_start = time.time()
     images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
-    images_base64_list = [image_dict["img_base64"] for image_dict in images_list]
+    images_base64_list = [get_page_img_base64(image_dict) for image_dict in images_list]
     # load_images_time = round(time.time() - load_images_start, 2)
     # logger.info(f"load images cost: {load_images_time}, speed: {round(len(images_base64_list)/load_images_time, 3)} images/s")
 
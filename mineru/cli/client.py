@@ -118,7 +118,7 @@ from .common import do_parse, read_fn, pdf_suffixes, image_suffixes
     '--device',
     'device_mode',
     type=str,
-    help='Device mode for model inference, e.g., "cpu", "cuda", "cuda:0", "npu", "npu:0", "mps". Adapted only for the case where the backend is set to "pipeline". ',
+    help='Device mode for model inference, e.g., "cpu", "cuda", "cuda:0", "npu", "npu:0", "mps". A comma-separated list such as "cuda:0,cuda:1" runs one model set per device. Adapted only for the case where the backend is set to "pipeline". ',
     default=None,
 )
 @click.option(
@@ -149,9 +149,16 @@ def main(
     kwargs.update(arg_parse(ctx))
 
     if not backend.endswith('-client'):
+        if device_mode is not None and ',' in device_mode:
+            if os.getenv('MINERU_DEVICES', None) is None:
+                os.environ['MINERU_DEVICES'] = device_mode
+            primary_device_mode = device_mode.split(',')[0].strip()
+        else:
+            primary_device_mode = device_mode
+
         def get_device_mode() -> str:
-            if device_mode is not None:
-                return device_mode
+            if primary_device_mode is not None:
+                return primary_device_mode
             else:
                 return get_device()
         if os.getenv('MINERU_DEVICE_MODE', None) is None:
@@ -11,7 +11,7 @@ from loguru import logger
 from mineru.data.data_reader_writer import FileBasedDataWriter
 from mineru.utils.draw_bbox import draw_layout_bbox, draw_span_bbox
 from mineru.utils.enum_class import MakeMode
-from mineru.utils.pdf_image_tools import images_bytes_to_pdf_bytes
+from mineru.utils.pdf_image_tools import images_bytes_to_pdf_bytes, release_page_image
 from mineru.backend.vlm.vlm_middle_json_mkcontent import union_make as vlm_union_make
 from mineru.backend.vlm.vlm_analyze import doc_analyze as vlm_doc_analyze
 from mineru.backend.vlm.vlm_analyze import aio_doc_analyze as aio_vlm_doc_analyze
@@ -74,12 +74,26 @@ def convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id=0, end_page
     return output_bytes
 
 
+def _is_full_page_range(pdf_bytes, start_page_id=0, end_page_id=None):
+    if start_page_id is not None and start_page_id > 0:
+        return False
+    if end_page_id is None or end_page_id < 0:
+        return True
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return end_page_id >= len(pdf) - 1
+    finally:
+        pdf.close()
+
+
 def _prepare_pdf_bytes(pdf_bytes_list, start_page_id, end_page_id):
-    """准备处理PDF字节数据"""
+    """准备处理PDF字节数据，页范围覆盖整个文件时直接使用原始数据，不再重新序列化"""
     result = []
     for pdf_bytes in pdf_bytes_list:
-        new_pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
-        result.append(new_pdf_bytes)
+        if _is_full_page_range(pdf_bytes, start_page_id, end_page_id):
+            result.append(pdf_bytes)
+        else:
+            result.append(convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id))
     return result
 
 
@@ -172,36 +186,30 @@ def _process_pipeline(
         f_dump_orig_pdf,
         f_dump_content_list,
         f_make_md_mode,
+        start_page_id=0,
+        end_page_id=None,
 ):
-    """处理pipeline后端逻辑"""
+    """处理pipeline后端逻辑，页范围作为元数据传给doc_analyze，只在需要输出pdf时才截取选中页"""
     from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_json as pipeline_result_to_middle_json
     from mineru.backend.pipeline.pipeline_analyze import doc_analyze as pipeline_doc_analyze
 
-    infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = (
-        pipeline_doc_analyze(
-            pdf_bytes_list, p_lang_list, parse_method=parse_method,
-            formula_enable=p_formula_enable, table_enable=p_table_enable
-        )
-    )
-
-    for idx, model_list in enumerate(infer_results):
+    def process_doc(idx, model_list, images_list, pdf_doc, _lang, _ocr_enable):
         model_json = copy.deepcopy(model_list)
         pdf_file_name = pdf_file_names[idx]
         local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
         image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
 
-        images_list = all_image_lists[idx]
-        pdf_doc = all_pdf_docs[idx]
-        _lang = lang_list[idx]
-        _ocr_enable = ocr_enabled_list[idx]
-
+        pdf_bytes = pdf_bytes_list[idx]
         middle_json = pipeline_result_to_middle_json(
             model_list, images_list, pdf_doc, image_writer,
-            _lang, _ocr_enable, p_formula_enable
+            _lang, _ocr_enable, p_formula_enable, pdf_bytes=pdf_bytes
         )
 
         pdf_info = middle_json["pdf_info"]
-        pdf_bytes = pdf_bytes_list[idx]
+
+        # 画框和_origin.pdf需要与middle json页号对齐的pdf，只有这些输出开启时才截取选中页
+        if f_draw_layout_bbox or f_draw_span_bbox or f_dump_orig_pdf:
+            pdf_bytes = _prepare_pdf_bytes([pdf_bytes], start_page_id, end_page_id)[0]
 
         _process_output(
             pdf_info, pdf_bytes, pdf_file_name, local_md_dir, local_image_dir,
@@ -210,6 +218,36 @@ def _process_pipeline(
             f_make_md_mode, middle_json, model_json, is_pipeline=True
         )
 
+    page_ranges = [(start_page_id, end_page_id)] * len(pdf_bytes_list)
+
+    # 逐文档增量输出：文档的所有页面推理完成后立即生成middle json并写出结果，随后释放其页面图像
+    if os.getenv('MINERU_PIPELINE_INCREMENTAL_OUTPUT', 'false').lower() == 'true':
+        def on_doc_ready(idx, model_list, images_list, pdf_doc, _lang, _ocr_enable):
+            process_doc(idx, model_list, images_list, pdf_doc, _lang, _ocr_enable)
+            for image_dict in images_list:
+                release_page_image(image_dict)
+
+        pipeline_doc_analyze(
+            pdf_bytes_list, p_lang_list, parse_method=parse_method,
+            formula_enable=p_formula_enable, table_enable=p_table_enable,
+            doc_ready_callback=on_doc_ready, page_ranges=page_ranges,
+        )
+        return
+
+    infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = (
+        pipeline_doc_analyze(
+            pdf_bytes_list, p_lang_list, parse_method=parse_method,
+            formula_enable=p_formula_enable, table_enable=p_table_enable,
+            page_ranges=page_ranges,
+        )
+    )
+
+    for idx, model_list in enumerate(infer_results):
+        process_doc(
+            idx, model_list, all_image_lists[idx], all_pdf_docs[idx],
+            lang_list[idx], ocr_enabled_list[idx]
+        )
+
 
 async def _async_process_vlm(
         output_dir,
@@ -315,17 +353,18 @@ def do_parse(
         end_page_id=None,
         **kwargs,
 ):
-    # 预处理PDF字节数据
-    pdf_bytes_list = _prepare_pdf_bytes(pdf_bytes_list, start_page_id, end_page_id)
-
     if backend == "pipeline":
         _process_pipeline(
             output_dir, pdf_file_names, pdf_bytes_list, p_lang_list,
             parse_method, formula_enable, table_enable,
             f_draw_layout_bbox, f_draw_span_bbox, f_dump_md, f_dump_middle_json,
-            f_dump_model_output, f_dump_orig_pdf, f_dump_content_list, f_make_md_mode
+            f_dump_model_output, f_dump_orig_pdf, f_dump_content_list, f_make_md_mode,
+            start_page_id, end_page_id,
         )
     else:
+        # 预处理PDF字节数据
+        pdf_bytes_list = _prepare_pdf_bytes(pdf_bytes_list, start_page_id, end_page_id)
+
         if backend.startswith("vlm-"):
             backend = backend[4:]
 
@@ -362,18 +401,19 @@ async def aio_do_parse(
         end_page_id=None,
         **kwargs,
 ):
-    # 预处理PDF字节数据
-    pdf_bytes_list = _prepare_pdf_bytes(pdf_bytes_list, start_page_id, end_page_id)
-
     if backend == "pipeline":
         # pipeline模式暂不支持异步，使用同步处理方式
         _process_pipeline(
             output_dir, pdf_file_names, pdf_bytes_list, p_lang_list,
             parse_method, formula_enable, table_enable,
             f_draw_layout_bbox, f_draw_span_bbox, f_dump_md, f_dump_middle_json,
-            f_dump_model_output, f_dump_orig_pdf, f_dump_content_list, f_make_md_mode
+            f_dump_model_output, f_dump_orig_pdf, f_dump_content_list, f_make_md_mode,
+            start_page_id, end_page_id,
         )
     else:
+        # 预处理PDF字节数据
+        pdf_bytes_list = _prepare_pdf_bytes(pdf_bytes_list, start_page_id, end_page_id)
+
         if backend.startswith("vlm-"):
             backend = backend[4:]
 
@@ -1,9 +1,19 @@
+import os
 from typing import List, Dict, Union
+import cv2
 from doclayout_yolo import YOLOv10
 from tqdm import tqdm
 import numpy as np
 from PIL import Image
 
+from mineru.utils.detections import Detections, detections_from_predictions
+from mineru.utils.image_pyramid import ImagePyramid, iter_rect_batches, resolve_model_inputs
+from mineru.utils.yolo_onnx import is_yolo_onnx_enabled, load_yolo_onnx_session, scale_boxes
+
+
+def is_layout_rect_batch_enabled():
+    return os.getenv('MINERU_LAYOUT_RECT_BATCH', 'false').lower() == 'true'
+
 
 class DocLayoutYOLOModel:
     def __init__(
@@ -19,55 +29,74 @@ class DocLayoutYOLOModel:
         self.imgsz = imgsz
         self.conf = conf
         self.iou = iou
+        # cpu推理时可选onnxruntime后端，导出失败时为None，继续使用torch
+        self.onnx_session = None
+        if is_yolo_onnx_enabled() and str(device) == "cpu":
+            self.onnx_session = load_yolo_onnx_session(self.model, weight, imgsz)
 
-    def _parse_prediction(self, prediction) -> List[Dict]:
-        layout_res = []
+    def _run_predict(self, inputs: List) -> List[Detections]:
+        """推理一批图像，返回模型输入图像坐标下的Detections"""
+        if self.onnx_session is None:
+            predictions = self.model.predict(
+                inputs,
+                imgsz=self.imgsz,
+                conf=self.conf,
+                iou=self.iou,
+                verbose=False,
+            )
+            return detections_from_predictions(predictions)
+        return [
+            Detections.from_array(pred)
+            for pred in self.onnx_session.predict(inputs, self.imgsz, self.conf, self.iou, per_axis=False)
+        ]
 
-        # 容错处理
-        if not hasattr(prediction, "boxes") or prediction.boxes is None:
-            return layout_res
+    def _parse_prediction(self, detections: Detections, scale=None) -> List[Dict]:
+        return detections.rescale(scale, per_axis=False).to_dicts()
 
-        for xyxy, conf, cls in zip(
-            prediction.boxes.xyxy.cpu(),
-            prediction.boxes.conf.cpu(),
-            prediction.boxes.cls.cpu(),
-        ):
-            coords = list(map(int, xyxy.tolist()))
-            xmin, ymin, xmax, ymax = coords
-            layout_res.append({
-                "category_id": int(cls.item()),
-                "poly": [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax],
-                "score": round(float(conf.item()), 3),
-            })
-        return layout_res
-
-    def predict(self, image: Union[np.ndarray, Image.Image]) -> List[Dict]:
-        prediction = self.model.predict(
-            image,
-            imgsz=self.imgsz,
-            conf=self.conf,
-            iou=self.iou,
-            verbose=False
-        )[0]
-        return self._parse_prediction(prediction)
+    def predict(self, image: Union[np.ndarray, Image.Image, ImagePyramid]) -> List[Dict]:
+        inputs, scales = resolve_model_inputs([image], self.imgsz)
+        detections = self._run_predict(inputs)[0]
+        return self._parse_prediction(detections, scales[0])
 
     def batch_predict(
         self,
-        images: List[Union[np.ndarray, Image.Image]],
+        images: List[Union[np.ndarray, Image.Image, ImagePyramid]],
         batch_size: int = 4
     ) -> List[List[Dict]]:
+        if is_layout_rect_batch_enabled():
+            return self._rect_batch_predict(images, batch_size)
         results = []
         with tqdm(total=len(images), desc="Layout Predict") as pbar:
             for idx in range(0, len(images), batch_size):
-                batch = images[idx: idx + batch_size]
-                predictions = self.model.predict(
-                    batch,
-                    imgsz=self.imgsz,
-                    conf=self.conf,
-                    iou=self.iou,
-                    verbose=False,
-                )
-                for pred in predictions:
-                    results.append(self._parse_prediction(pred))
+                batch, scales = resolve_model_inputs(images[idx: idx + batch_size], self.imgsz)
+                for detections, scale in zip(self._run_predict(batch), scales):
+                    results.append(self._parse_prediction(detections, scale))
                 pbar.update(len(batch))
-        return results
\ No newline at end of file
+        return results
+
+    def _rect_batch_predict(
+        self,
+        images: List[Union[np.ndarray, Image.Image, ImagePyramid]],
+        batch_size: int = 4
+    ) -> List[List[Dict]]:
+        """
+        按矩形输入尺寸(由页面宽高比决定)分桶批量推理，同一批内的页面letterbox到相同的矩形尺寸，
+        模型按rect方式推理，不再因页面尺寸不一致而整批填充为imgsz*imgsz的正方形。
+        结果按输入顺序返回。
+        """
+        stride = int(max(self.model.model.stride))
+        inputs, scales = resolve_model_inputs(images, self.imgsz)
+        inputs = [
+            image if isinstance(image, np.ndarray)
+            else cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+            for image in inputs
+        ]
+        results = [None] * len(images)
+        with tqdm(total=len(images), desc="Layout Predict") as pbar:
+            for input_shape, batch_indices, batch in iter_rect_batches(inputs, self.imgsz, stride, batch_size):
+                for index, detections in zip(batch_indices, self._run_predict(batch)):
+                    # 检测框从矩形输入坐标换算回模型输入图像(原图或金字塔层级)坐标
+                    scale_boxes(detections.xyxy, input_shape, inputs[index].shape[:2], per_axis=False)
+                    results[index] = self._parse_prediction(detections, scales[index])
+                pbar.update(len(batch_indices))
+        return results
@@ -1,9 +1,19 @@
+import os
 from typing import List, Union
+import cv2
 from tqdm import tqdm
 from ultralytics import YOLO
 import numpy as np
 from PIL import Image
 
+from mineru.utils.detections import Detections, detections_from_predictions
+from mineru.utils.image_pyramid import ImagePyramid, iter_rect_batches, resolve_model_inputs
+from mineru.utils.yolo_onnx import is_yolo_onnx_enabled, load_yolo_onnx_session, scale_boxes
+
+
+def is_mfd_bucket_batch_enabled():
+    return os.getenv('MINERU_MFD_BUCKET_BATCH', 'false').lower() == 'true'
+
 
 class YOLOv8MFDModel:
     def __init__(
@@ -19,12 +29,18 @@ class YOLOv8MFDModel:
         self.imgsz = imgsz
         self.conf = conf
         self.iou = iou
+        # cpu推理时可选onnxruntime后端，导出失败时为None，继续使用torch
+        self.onnx_session = None
+        if is_yolo_onnx_enabled() and str(device) == "cpu":
+            self.onnx_session = load_yolo_onnx_session(self.model, weight, imgsz)
 
-    def _run_predict(
-        self,
-        inputs: Union[np.ndarray, Image.Image, List],
-        is_batch: bool = False
-    ) -> List:
+    def _infer(self, inputs: List) -> List[Detections]:
+        """推理一批图像，返回模型输入图像坐标下的Detections"""
+        if self.onnx_session is not None:
+            return [
+                Detections.from_array(pred)
+                for pred in self.onnx_session.predict(inputs, self.imgsz, self.conf, self.iou)
+            ]
         preds = self.model.predict(
             inputs,
             imgsz=self.imgsz,
@@ -33,16 +49,28 @@ class YOLOv8MFDModel:
             verbose=False,
             device=self.device
         )
-        return [pred.cpu() for pred in preds] if is_batch else preds[0].cpu()
+        return detections_from_predictions(preds)
 
-    def predict(self, image: Union[np.ndarray, Image.Image]):
+    def _run_predict(
+        self,
+        inputs: Union[np.ndarray, Image.Image, ImagePyramid, List],
+        is_batch: bool = False
+    ) -> Union[Detections, List[Detections]]:
+        inputs, scales = resolve_model_inputs(inputs if is_batch else [inputs], self.imgsz)
+        preds = [detections.rescale(scale) for detections, scale in zip(self._infer(inputs), scales)]
+        return preds if is_batch else preds[0]
+
+    def predict(self, image: Union[np.ndarray, Image.Image, ImagePyramid]) -> Detections:
         return self._run_predict(image)
 
     def batch_predict(
         self,
-        images: List[Union[np.ndarray, Image.Image]],
-        batch_size: int = 4
-    ) -> List:
+        images: List[Union[np.ndarray, Image.Image, ImagePyramid]],
+        batch_size: int = 4,
+        pixel_budget: int = None
+    ) -> List[Detections]:
+        if pixel_budget is not None:
+            return self._bucket_batch_predict(images, batch_size, pixel_budget)
         results = []
         with tqdm(total=len(images), desc="MFD Predict") as pbar:
             for idx in range(0, len(images), batch_size):
@@ -50,4 +78,33 @@ class YOLOv8MFDModel:
                 batch_preds = self._run_predict(batch, is_batch=True)
                 results.extend(batch_preds)
                 pbar.update(len(batch))
-        return results
\ No newline at end of file
+        return results
+
+    def _bucket_batch_predict(
+        self,
+        images: List[Union[np.ndarray, Image.Image, ImagePyramid]],
+        batch_size: int,
+        pixel_budget: int
+    ) -> List[Detections]:
+        """
+        按渲染尺寸对应的矩形输入尺寸分桶批量推理，同一批内输入尺寸一致，结果与逐页推理一致。
+        每批页数不超过batch_size，且输入像素总数不超过pixel_budget，结果按输入顺序返回。
+        """
+        stride = int(max(self.model.model.stride))
+        inputs, scales = resolve_model_inputs(images, self.imgsz)
+        inputs = [
+            image if isinstance(image, np.ndarray)
+            else cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+            for image in inputs
+        ]
+        results = [None] * len(images)
+        with tqdm(total=len(images), desc="MFD Predict") as pbar:
+            for input_shape, batch_indices, batch in iter_rect_batches(
+                inputs, self.imgsz, stride, batch_size, pixel_budget
+            ):
+                for index, detections in zip(batch_indices, self._infer(batch)):
+                    # 检测框从矩形输入坐标换算回模型输入图像(原图或金字塔层级)坐标
+                    scale_boxes(detections.xyxy, input_shape, inputs[index].shape[:2])
+                    results[index] = detections.rescale(scales[index])
+                pbar.update(len(batch_indices))
+        return results
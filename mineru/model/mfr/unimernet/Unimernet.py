@@ -1,7 +1,18 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
 import torch
+from PIL import Image
 from torch.utils.data import DataLoader, Dataset
 from tqdm import tqdm
 
+from mineru.utils.formula_cache import is_formula_cache_enabled, get_formula_cache
+from mineru.utils.formula_decode_budget import (
+    is_mfr_early_stop_enabled, get_crop_decode_budget, get_decode_budget_stats
+)
+
 
 class MathDataset(Dataset):
     def __init__(self, image_paths, transform=None):
@@ -18,6 +29,26 @@ class MathDataset(Dataset):
             return image
 
 
+def crop_formula_image(page_img, xmin, ymin, xmax, ymax) -> Image.Image:
+    """从页面图像上裁出公式区域，统一为RGB的PIL图像以沿用原有的预处理流程"""
+    if isinstance(page_img, np.ndarray):
+        # BGR页面上切片取视图，转为RGB
+        return Image.fromarray(cv2.cvtColor(page_img[ymin:ymax, xmin:xmax], cv2.COLOR_BGR2RGB))
+    return page_img.crop((xmin, ymin, xmax, ymax))
+
+
+def get_mfr_preprocess_workers():
+    """
+    公式图像预处理的线程数，从环境变量MINERU_MFR_PREPROCESS_WORKERS读取。
+    为0时沿用DataLoader逐张串行预处理，大于0时多线程预处理并预取下一批，预处理本身与DataLoader路径相同。
+    """
+    return int(os.getenv('MINERU_MFR_PREPROCESS_WORKERS', 0))
+
+
+def is_mfr_continuous_batching_enabled():
+    return os.getenv('MINERU_MFR_CONTINUOUS_BATCHING', 'false').lower() == 'true'
+
+
 class UnimernetModel(object):
     def __init__(self, weight_dir, _device_="cpu"):
         from .unimernet_hf import UnimernetModel
@@ -34,19 +65,11 @@ class UnimernetModel(object):
     def predict(self, mfd_res, image):
         formula_list = []
         mf_image_list = []
-        for xyxy, conf, cla in zip(
-            mfd_res.boxes.xyxy.cpu(), mfd_res.boxes.conf.cpu(), mfd_res.boxes.cls.cpu()
-        ):
-            xmin, ymin, xmax, ymax = [int(p.item()) for p in xyxy]
-            new_item = {
-                "category_id": 13 + int(cla.item()),
-                "poly": [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax],
-                "score": round(float(conf.item()), 2),
-                "latex": "",
-            }
+        for new_item in mfd_res.to_dicts(category_offset=13, score_ndigits=2):
+            new_item["latex"] = ""
             formula_list.append(new_item)
-            bbox_img = image[ymin:ymax, xmin:xmax]
-            mf_image_list.append(bbox_img)
+            xmin, ymin, xmax, ymax = new_item["poly"][0], new_item["poly"][1], new_item["poly"][4], new_item["poly"][5]
+            mf_image_list.append(crop_formula_image(image, xmin, ymin, xmax, ymax))
 
         dataset = MathDataset(mf_image_list, transform=self.model.transform)
         dataloader = DataLoader(dataset, batch_size=32, num_workers=0)
@@ -70,21 +93,15 @@ class UnimernetModel(object):
         # Collect images with their original indices
         for image_index in range(len(images_mfd_res)):
             mfd_res = images_mfd_res[image_index]
-            pil_img = images[image_index]
+            page_img = images[image_index]
             formula_list = []
 
-            for idx, (xyxy, conf, cla) in enumerate(zip(
-                    mfd_res.boxes.xyxy, mfd_res.boxes.conf, mfd_res.boxes.cls
-            )):
-                xmin, ymin, xmax, ymax = [int(p.item()) for p in xyxy]
-                new_item = {
-                    "category_id": 13 + int(cla.item()),
-                    "poly": [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax],
-                    "score": round(float(conf.item()), 2),
-                    "latex": "",
-                }
+            # mfd_res为Detections，整体转换为dict，不再逐个标量同步设备
+            for new_item in mfd_res.to_dicts(category_offset=13, score_ndigits=2):
+                new_item["latex"] = ""
                 formula_list.append(new_item)
-                bbox_img = pil_img.crop((xmin, ymin, xmax, ymax))
+                xmin, ymin, xmax, ymax = new_item["poly"][0], new_item["poly"][1], new_item["poly"][4], new_item["poly"][5]
+                bbox_img = crop_formula_image(page_img, xmin, ymin, xmax, ymax)
                 area = (xmax - xmin) * (ymax - ymin)
 
                 curr_idx = len(mf_image_list)
@@ -108,32 +125,157 @@ class UnimernetModel(object):
         # 如果batch_size > len(sorted_images)，则设置为不超过len(sorted_images)的2的幂
         batch_size = min(batch_size, max(1, 2 ** (len(sorted_images).bit_length() - 1))) if sorted_images else 1
 
-        dataloader = DataLoader(dataset, batch_size=batch_size, num_workers=0)
+        preprocess_workers = get_mfr_preprocess_workers()
+        decode_budgets = self._get_decode_budgets(sorted_images)
+        if is_formula_cache_enabled():
+            mfr_res = self._cached_generate(sorted_images, batch_size, preprocess_workers, decode_budgets)
+        else:
+            if preprocess_workers > 0:
+                dataloader = self._iter_preprocessed_batches(sorted_images, batch_size, preprocess_workers)
+            else:
+                dataloader = DataLoader(dataset, batch_size=batch_size, num_workers=0)
+            mfr_res, _, _ = self._generate(dataloader, len(sorted_images), batch_size, decode_budgets)
+
+        # Restore original order
+        unsorted_results = [""] * len(mfr_res)
+        for new_idx, latex in enumerate(mfr_res):
+            original_idx = index_mapping[new_idx]
+            unsorted_results[original_idx] = latex
+
+        # Fill results back
+        for res, latex in zip(backfill_list, unsorted_results):
+            res["latex"] = latex
+
+        return images_formula_list
+
+    @staticmethod
+    def _get_decode_budgets(images: list):
+        """开启MINERU_MFR_EARLY_STOP时按各公式裁剪图的尺寸给出解码预算，否则返回None"""
+        if not is_mfr_early_stop_enabled():
+            return None
+        get_decode_budget_stats().add_crops(len(images))
+        return [
+            get_crop_decode_budget(*(image.size if isinstance(image, Image.Image) else image.shape[1::-1]))
+            for image in images
+        ]
+
+    def _generate(self, dataloader, total: int, batch_size: int, decode_budgets=None):
+        """
+        逐批解码，返回各公式的latex、解码步数(不含bos的非pad token数)和是否被提前结束；
+        decode_budgets与公式顺序对齐。
+        """
+        if is_mfr_continuous_batching_enabled() and self.model.supports_continuous_batching():
+            with tqdm(total=total, desc="MFR Predict") as pbar:
+                batches = (mf_img.to(dtype=self.model.dtype).to(self.device) for mf_img in dataloader)
+                output = self.model.generate_continuous(
+                    batches, batch_size=batch_size, on_finish=pbar.update, decode_budgets=decode_budgets
+                )
+            decode_steps = (output["pred_ids"] != self.model.tokenizer.pad_token_id).sum(axis=1).tolist()
+            return output["fixed_str"], decode_steps, output["early_stopped"]
 
         # Process batches and store results
         mfr_res = []
+        decode_steps = []
+        early_stopped = []
         # for mf_img in dataloader:
 
-        with tqdm(total=len(sorted_images), desc="MFR Predict") as pbar:
+        with tqdm(total=total, desc="MFR Predict") as pbar:
             for index, mf_img in enumerate(dataloader):
                 mf_img = mf_img.to(dtype=self.model.dtype)
                 mf_img = mf_img.to(self.device)
+                batch_budgets = None
+                if decode_budgets is not None:
+                    batch_budgets = decode_budgets[index * batch_size: index * batch_size + len(mf_img)]
                 with torch.no_grad():
-                    output = self.model.generate({"image": mf_img}, batch_size=batch_size)
+                    output = self.model.generate({"image": mf_img}, batch_size=batch_size, decode_budgets=batch_budgets)
                 mfr_res.extend(output["fixed_str"])
+                decode_steps.extend((output["pred_ids"] != self.model.tokenizer.pad_token_id).sum(axis=1).tolist())
+                early_stopped.extend(output["early_stopped"])
 
                 # 更新进度条，每次增加batch_size，但要注意最后一个batch可能不足batch_size
-                current_batch_size = min(batch_size, len(sorted_images) - index * batch_size)
+                current_batch_size = min(batch_size, total - index * batch_size)
                 pbar.update(current_batch_size)
+        return mfr_res, decode_steps, early_stopped
 
-        # Restore original order
-        unsorted_results = [""] * len(mfr_res)
-        for new_idx, latex in enumerate(mfr_res):
-            original_idx = index_mapping[new_idx]
-            unsorted_results[original_idx] = latex
+    def _cached_generate(self, images: list, batch_size: int, workers: int, decode_budgets=None) -> list:
+        """
+        按裁边、缩放和填充后的公式图像查公式缓存，缓存命中和同一批内重复的公式直接复用结果，
+        只对各不相同的未命中公式解码，解码结果写回缓存；被提前结束的结果可能不完整，不写入缓存。
+        """
+        formula_cache = get_formula_cache()
+        prepared_images = self._prepare_inputs(images, workers)
+        results = [None] * len(images)
+        decode_inputs, decode_keys, decode_owners, decode_indices = [], [], [], []
+        key_to_decode = {}
+        for index, prepared in enumerate(prepared_images):
+            key = formula_cache.make_key(prepared)
+            latex = formula_cache.get(key)
+            if latex is not None:
+                results[index] = latex
+                continue
+            position = key_to_decode.get(key)
+            if position is None:
+                position = len(decode_inputs)
+                decode_inputs.append(prepared)
+                decode_keys.append(key)
+                decode_owners.append([])
+                decode_indices.append(index)
+                key_to_decode[key] = position
+            decode_owners[position].append(index)
 
-        # Fill results back
-        for res, latex in zip(backfill_list, unsorted_results):
-            res["latex"] = latex
+        if decode_inputs:
+            # 解码数可能远小于原批大小，与batch_predict相同地收缩到不超过解码数的2的幂
+            batch_size = min(batch_size, 2 ** (len(decode_inputs).bit_length() - 1))
+            mfr_res, decode_steps, early_stopped = self._generate(
+                self._iter_prepared_batches(decode_inputs, batch_size), len(decode_inputs), batch_size,
+                [decode_budgets[index] for index in decode_indices] if decode_budgets is not None else None,
+            )
+            for key, owners, latex, steps, stopped in zip(
+                    decode_keys, decode_owners, mfr_res, decode_steps, early_stopped
+            ):
+                if not stopped:
+                    formula_cache.put(key, latex, steps, duplicates=len(owners) - 1)
+                for index in owners:
+                    results[index] = latex
+        return results
 
-        return images_formula_list
+    def _prepare_inputs(self, images: list, workers: int) -> list:
+        """公式图像的裁边、缩放和填充(UnimerSwinImageProcessor.prepare_input)，workers大于0时多线程并行"""
+        transform = self.model.transform
+        if workers > 0:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(transform.prepare_input, images))
+        return [transform.prepare_input(image) for image in images]
+
+    def _to_tensor(self, prepared) -> torch.Tensor:
+        """对prepare_input的结果做与UnimerSwinImageProcessor.__call__相同的变换"""
+        return self.model.transform.transform(image=prepared)['image'][:1]
+
+    def _to_model_input(self, tensors: list) -> torch.Tensor:
+        """预处理后的公式图像拼成一批，与DataLoader的拼接方式相同，cuda上使用锁页内存异步拷贝"""
+        batch = torch.stack(tensors)
+        pin_memory = torch.device(self.device).type == "cuda"
+        if pin_memory:
+            batch = batch.pin_memory()
+        return batch.to(self.device, non_blocking=pin_memory)
+
+    def _iter_prepared_batches(self, prepared_images: list, batch_size: int):
+        for start in range(0, len(prepared_images), batch_size):
+            yield self._to_model_input([self._to_tensor(prepared) for prepared in prepared_images[start: start + batch_size]])
+
+    def _iter_preprocessed_batches(self, images: list, batch_size: int, workers: int):
+        """
+        线程池并行完成公式图像的预处理(与DataLoader路径相同的UnimerSwinImageProcessor.__call__)，
+        每批拼成张量(cuda上使用锁页内存异步拷贝)后产出；产出当前批之前先提交下一批的预处理，与解码过程重叠。
+        """
+        transform = self.model.transform
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def submit(start):
+                return [executor.submit(transform, image) for image in images[start: start + batch_size]]
+
+            pending = submit(0)
+            for start in range(0, len(images), batch_size):
+                tensors = [future.result() for future in pending]
+                if start + batch_size < len(images):
+                    pending = submit(start + batch_size)
+                yield self._to_model_input(tensors)
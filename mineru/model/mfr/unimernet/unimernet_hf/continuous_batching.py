@@ -0,0 +1,203 @@
+from collections import deque
+
+import torch
+
+from mineru.utils.formula_decode_budget import LOOP_WINDOW
+
+
+class ContinuousBatchDecoder:
+    """
+    UniMERNet解码器的连续批处理(in-flight batching)贪心解码。
+    固定批次的generate要等批内最长的公式解码结束，短公式占着槽位空转；
+    这里每步把已结束(eos或达到长度上限)的序列移出，用待解码的公式补进空出的槽位。
+
+    self-attention的KV按右对齐存放：每步新token都写在同一列，新加入的序列左侧填充并用mask屏蔽，
+    位置编码按各序列自身的长度计算；cross-attention的KV在序列加入时由编码器输出计算一次后复用。
+    贪心结果与逐批generate一致，只适用于greedy解码(不采样、不带其他logits processor)。
+    """
+
+    def __init__(self, model, max_batch_size: int, max_new_tokens: int):
+        self.model = model
+        self.decoder = model.decoder.model.decoder
+        self.lm_head = model.decoder.lm_head
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+
+        generation_config = model.generation_config
+        eos_token_id = generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = model.config.decoder.eos_token_id
+        self.eos_token_ids = set(eos_token_id if isinstance(eos_token_id, (list, tuple)) else [eos_token_id])
+        self.forced_eos_token_id = generation_config.forced_eos_token_id
+        self.bos_token_id = model.tokenizer.tokenizer.bos_token_id
+
+        self.project_encoder = (
+            model.encoder.config.hidden_size != model.decoder.config.hidden_size
+            and model.decoder.config.cross_attention_hidden_size is None
+        )
+
+    def encode(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        if pixel_values.shape[1] == 1:
+            pixel_values = pixel_values.repeat(1, 3, 1, 1)
+        encoder_hidden_states = self.model.encoder(pixel_values=pixel_values)[0]
+        if self.project_encoder:
+            encoder_hidden_states = self.model.enc_to_dec_proj(encoder_hidden_states)
+        return encoder_hidden_states
+
+    def _cross_cache(self, encoder_hidden_states: torch.Tensor) -> list:
+        bsz = encoder_hidden_states.shape[0]
+        caches = []
+        for layer in self.decoder.layers:
+            attn = layer.encoder_attn
+            caches.append((
+                attn._shape_qk(attn.k_proj(encoder_hidden_states), -1, bsz),
+                attn._shape_v(attn.v_proj(encoder_hidden_states), -1, bsz),
+            ))
+        return caches
+
+    def _empty_self_cache(self, bsz: int, length: int, like: torch.Tensor) -> list:
+        caches = []
+        for layer in self.decoder.layers:
+            attn = layer.self_attn
+            caches.append((
+                like.new_zeros((bsz, attn.num_heads, length, attn.squeeze_head_dim)),
+                like.new_zeros((bsz, attn.num_heads, length, attn.head_dim)),
+            ))
+        return caches
+
+    def _step(self, tokens, positions, starts, encoder_hidden_states, caches):
+        """解码一步，返回下一个token的logits和更新后的各层KV"""
+        hidden_states = self.decoder.embed_tokens(tokens[:, None])
+        hidden_states = hidden_states + self.decoder.embed_positions.weight[
+            positions + self.decoder.embed_positions.offset
+        ][:, None].to(hidden_states.dtype)
+        hidden_states = self.decoder.layernorm_embedding(hidden_states)
+
+        src_len = caches[0][0].shape[2] + 1
+        attention_mask = None
+        if bool((starts > 0).any()):
+            # 右对齐的填充列不参与attention
+            invalid = torch.arange(src_len, device=tokens.device)[None, :] < starts[:, None]
+            attention_mask = torch.zeros(invalid.shape, dtype=hidden_states.dtype, device=tokens.device)
+            attention_mask = attention_mask.masked_fill(invalid, torch.finfo(hidden_states.dtype).min)[:, None, None, :]
+
+        new_caches = []
+        for layer, past_key_value in zip(self.decoder.layers, caches):
+            layer_outputs = layer(
+                hidden_states,
+                attention_mask=attention_mask,
+                encoder_hidden_states=encoder_hidden_states,
+                past_key_value=past_key_value,
+                use_cache=True,
+            )
+            hidden_states = layer_outputs[0]
+            new_caches.append(layer_outputs[1])
+        hidden_states = self.decoder.layer_norm(hidden_states)
+        return self.lm_head(hidden_states[:, -1]), new_caches
+
+    @torch.no_grad()
+    def generate(self, batches, on_finish=None, stopper=None) -> list:
+        """
+        batches逐批产出已归一化的(B, C, H, W)公式图像，按需编码后进入解码槽位。
+        返回与输入顺序一致的各公式token列表(以bos开头，含结束时的eos)；on_finish(n)在每步有n条序列结束时调用。
+        stopper(CropEarlyStopper)不为None时按各公式的解码预算和重复循环提前结束序列。
+        """
+        batches = iter(batches)
+        pending = deque()  # (公式序号, 编码器输出)
+        next_index = 0
+        results = []
+
+        rows = []  # 各槽位对应的公式序号
+        sequences = []  # 各槽位已生成的token
+        encoder_hidden_states = tokens = positions = starts = caches = None
+
+        while True:
+            # 补满空出的槽位，待解码的公式不够时再编码下一批
+            free = self.max_batch_size - len(rows)
+            while free > len(pending):
+                pixel_values = next(batches, None)
+                if pixel_values is None:
+                    break
+                for hidden in self.encode(pixel_values):
+                    pending.append((next_index, hidden))
+                    results.append(None)
+                    next_index += 1
+            if free > 0 and pending:
+                admitted = [pending.popleft() for _ in range(min(free, len(pending)))]
+                new_hidden = torch.stack([hidden for _, hidden in admitted])
+                length = caches[0][0].shape[2] if caches is not None else 0
+                new_caches = [
+                    self_cache + cross_cache for self_cache, cross_cache in zip(
+                        self._empty_self_cache(len(admitted), length, new_hidden),
+                        self._cross_cache(new_hidden),
+                    )
+                ]
+                new_tokens = torch.full((len(admitted),), self.bos_token_id, dtype=torch.long, device=new_hidden.device)
+                new_positions = torch.zeros_like(new_tokens)
+                new_starts = torch.full_like(new_tokens, length)
+                if caches is None:
+                    encoder_hidden_states, caches = new_hidden, new_caches
+                    tokens, positions, starts = new_tokens, new_positions, new_starts
+                else:
+                    encoder_hidden_states = torch.cat([encoder_hidden_states, new_hidden])
+                    caches = [
+                        tuple(torch.cat([old, new]) for old, new in zip(layer_cache, new_layer_cache))
+                        for layer_cache, new_layer_cache in zip(caches, new_caches)
+                    ]
+                    tokens = torch.cat([tokens, new_tokens])
+                    positions = torch.cat([positions, new_positions])
+                    starts = torch.cat([starts, new_starts])
+                for index, _ in admitted:
+                    rows.append(index)
+                    sequences.append([self.bos_token_id])
+
+            if not rows:
+                break
+
+            logits, caches = self._step(tokens, positions, starts, encoder_hidden_states, caches)
+            positions = positions + 1
+            # 与generate的ForcedEOSTokenLogitsProcessor一致：最后一个token强制为eos
+            if self.forced_eos_token_id is not None:
+                at_limit = positions >= self.max_new_tokens
+                if bool(at_limit.any()):
+                    logits[at_limit] = torch.finfo(logits.dtype).min
+                    logits[at_limit, self.forced_eos_token_id] = 0
+            tokens = logits.argmax(-1)
+
+            keep = []
+            for slot, token in enumerate(tokens.tolist()):
+                sequences[slot].append(token)
+                sequence = sequences[slot]
+                if (
+                    token in self.eos_token_ids
+                    or len(sequence) > self.max_new_tokens
+                    or (stopper is not None and stopper.check(
+                        rows[slot], len(sequence) - 1, sequence[max(1, len(sequence) - LOOP_WINDOW):]
+                    ))
+                ):
+                    results[rows[slot]] = sequence
+                else:
+                    keep.append(slot)
+            finished = len(rows) - len(keep)
+            if finished:
+                if on_finish is not None:
+                    on_finish(finished)
+                rows = [rows[slot] for slot in keep]
+                sequences = [sequences[slot] for slot in keep]
+                if not keep:
+                    encoder_hidden_states = tokens = positions = starts = caches = None
+                    continue
+                keep = torch.tensor(keep, device=tokens.device)
+                encoder_hidden_states = encoder_hidden_states[keep]
+                tokens, positions, starts = tokens[keep], positions[keep], starts[keep]
+                # 去掉所有序列都不再需要的左侧填充列
+                trim = int(starts.min())
+                caches = [
+                    tuple(
+                        cache[keep][:, :, trim:] if index < 2 else cache[keep]
+                        for index, cache in enumerate(layer_cache)
+                    )
+                    for layer_cache in caches
+                ]
+                starts = starts - trim
+        return results
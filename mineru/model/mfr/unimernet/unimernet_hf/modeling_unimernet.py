@@ -3,16 +3,20 @@ import re
 import warnings
 from typing import Optional
 
+import numpy as np
 import torch
 from ftfy import fix_text
 from loguru import logger
 
 from transformers import AutoConfig, AutoModel, AutoModelForCausalLM, AutoTokenizer, PretrainedConfig, PreTrainedModel
 from transformers import VisionEncoderDecoderConfig, VisionEncoderDecoderModel
+from transformers import StoppingCriteria, StoppingCriteriaList
 from transformers.models.vision_encoder_decoder.modeling_vision_encoder_decoder import logger as base_model_logger
 
 from .unimer_swin import UnimerSwinConfig, UnimerSwinModel, UnimerSwinImageProcessor
 from .unimer_mbart import UnimerMBartConfig, UnimerMBartForCausalLM
+from .continuous_batching import ContinuousBatchDecoder
+from mineru.utils.formula_decode_budget import CropEarlyStopper, LOOP_WINDOW
 
 AutoConfig.register(UnimerSwinConfig.model_type, UnimerSwinConfig)
 AutoConfig.register(UnimerMBartConfig.model_type, UnimerMBartConfig)
@@ -382,6 +386,25 @@ def latex_rm_whitespace(s: str):
     return s
 
 
+class CropEarlyStoppingCriteria(StoppingCriteria):
+    """把CropEarlyStopper接入generate，已经生成eos的序列不再判断"""
+
+    def __init__(self, stopper: CropEarlyStopper, eos_token_id):
+        self.stopper = stopper
+        self.eos_token_id = eos_token_id
+        self.finished = set()
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        length = input_ids.shape[1] - 1
+        tails = input_ids[:, 1:][:, -LOOP_WINDOW:].tolist()
+        is_done = []
+        for row, tail in enumerate(tails):
+            if row not in self.finished and (tail[-1] == self.eos_token_id or self.stopper.check(row, length, tail)):
+                self.finished.add(row)
+            is_done.append(row in self.finished)
+        return torch.tensor(is_done, dtype=torch.bool, device=input_ids.device)
+
+
 class UnimernetModel(VisionEncoderDecoderModel):
     def __init__(
         self,
@@ -468,7 +491,7 @@ class UnimernetModel(VisionEncoderDecoderModel):
         ).loss
         return {"loss": loss}
 
-    def generate(self, samples, do_sample: bool = False, temperature: float = 0.2, top_p: float = 0.95, batch_size=64):
+    def generate(self, samples, do_sample: bool = False, temperature: float = 0.2, top_p: float = 0.95, batch_size=64, decode_budgets=None):
         pixel_values = samples["image"]
         num_channels = pixel_values.shape[1]
         if num_channels == 1:
@@ -479,23 +502,75 @@ class UnimernetModel(VisionEncoderDecoderModel):
             kwargs["temperature"] = temperature
             kwargs["top_p"] = top_p
 
-        if self.tokenizer.tokenizer.model_max_length > 1152:
-            if batch_size <= 32:
-                self.tokenizer.tokenizer.model_max_length = 1152  # 6g
-            else:
-                self.tokenizer.tokenizer.model_max_length = 1344  # 8g
+        max_new_tokens = self._get_max_new_tokens(batch_size)
+        stopper = None
+        if decode_budgets is not None:
+            # 按各公式的解码预算和重复循环提前结束序列
+            stopper = CropEarlyStopper(decode_budgets, max_new_tokens)
+            kwargs["stopping_criteria"] = StoppingCriteriaList([
+                CropEarlyStoppingCriteria(stopper, self.tokenizer.eos_token_id)
+            ])
 
         outputs = super().generate(
             pixel_values=pixel_values,
-            max_new_tokens=self.tokenizer.tokenizer.model_max_length, # required
+            max_new_tokens=max_new_tokens, # required
             decoder_start_token_id=self.tokenizer.tokenizer.bos_token_id,
             do_sample=do_sample,
             **kwargs,
         )
 
-        outputs = outputs[:, 1:].cpu().numpy()
+        return self._decode_outputs(outputs[:, 1:].cpu().numpy(), stopper)
+
+    def _get_max_new_tokens(self, batch_size):
+        if self.tokenizer.tokenizer.model_max_length > 1152:
+            if batch_size <= 32:
+                self.tokenizer.tokenizer.model_max_length = 1152  # 6g
+            else:
+                self.tokenizer.tokenizer.model_max_length = 1344  # 8g
+        return self.tokenizer.tokenizer.model_max_length
+
+    def supports_continuous_batching(self) -> bool:
+        """连续批处理只实现了贪心解码，generation_config带有其他解码策略或logits processor时不适用"""
+        config = self.generation_config
+        return (
+            self.decoder.config._attn_implementation in ("eager", "sdpa")
+            and (config.num_beams or 1) == 1
+            and not config.do_sample
+            and config.repetition_penalty in (None, 1.0)
+            and not config.no_repeat_ngram_size
+            and not config.min_length
+            and not config.min_new_tokens
+            and config.bad_words_ids is None
+            and config.suppress_tokens is None
+            and config.begin_suppress_tokens is None
+            and config.forced_bos_token_id is None
+        )
+
+    def generate_continuous(self, batches, batch_size=64, on_finish=None, decode_budgets=None):
+        """
+        连续批处理贪心解码，batches逐批产出归一化后的公式图像，最多batch_size条序列同时解码。
+        返回与generate相同格式的结果，顺序与输入一致；decode_budgets与输入顺序对齐。
+        """
+        max_new_tokens = self._get_max_new_tokens(batch_size)
+        stopper = CropEarlyStopper(decode_budgets, max_new_tokens) if decode_budgets is not None else None
+        decoder = ContinuousBatchDecoder(self, batch_size, max_new_tokens)
+        sequences = decoder.generate(batches, on_finish=on_finish, stopper=stopper)
+        outputs = np.full(
+            (len(sequences), max((len(sequence) for sequence in sequences), default=1)),
+            self.tokenizer.pad_token_id, dtype=np.int64,
+        )
+        for row, sequence in enumerate(sequences):
+            outputs[row, :len(sequence)] = sequence
+        return self._decode_outputs(outputs[:, 1:], stopper)
+
+    def _decode_outputs(self, outputs, stopper=None):
+        """early_stopped标记各序列是否被解码预算或重复循环截断，截断的结果不完整"""
         pred_tokens = self.tokenizer.detokenize(outputs)
         pred_str = self.tokenizer.token2str(outputs)
         fixed_str = [latex_rm_whitespace(s) for s in pred_str]
-        return {"pred_ids": outputs, "pred_tokens": pred_tokens, "pred_str": pred_str, "fixed_str": fixed_str}
+        early_stopped = [stopper is not None and stopper.is_stopped(row) for row in range(len(outputs))]
+        return {
+            "pred_ids": outputs, "pred_tokens": pred_tokens, "pred_str": pred_str, "fixed_str": fixed_str,
+            "early_stopped": early_stopped,
+        }
 
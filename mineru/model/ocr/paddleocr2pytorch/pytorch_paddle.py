@@ -50,44 +50,53 @@ def get_model_params(lang, config):
 root_dir = Path(__file__).resolve().parent
 
 
+def get_ocr_lang(lang, device):
+    """将语言映射为实际使用的模型语言(语系合并，CPU上中文类语言使用ch_lite)"""
+    if device == 'cpu' and lang in ['ch', 'ch_server', 'japan', 'chinese_cht']:
+        # logger.warning("The current device in use is CPU. To ensure the speed of parsing, the language is automatically switched to ch_lite.")
+        lang = 'ch_lite'
+
+    if lang in latin_lang:
+        lang = 'latin'
+    elif lang in arabic_lang:
+        lang = 'arabic'
+    elif lang in cyrillic_lang:
+        lang = 'cyrillic'
+    elif lang in devanagari_lang:
+        lang = 'devanagari'
+    elif lang in east_slavic_lang:
+        lang = 'east_slavic'
+    return lang
+
+
+def get_ocr_model_paths(lang):
+    """返回模型语言lang对应的(det模型路径, rec模型路径, rec字典路径)，模型不存在时自动下载"""
+    models_config_path = os.path.join(root_dir, 'pytorchocr', 'utils', 'resources', 'models_config.yml')
+    with open(models_config_path) as file:
+        config = yaml.safe_load(file)
+        det, rec, dict_file = get_model_params(lang, config)
+    ocr_models_dir = ModelPath.pytorch_paddle
+
+    det_model_path = f"{ocr_models_dir}/{det}"
+    det_model_path = os.path.join(auto_download_and_get_model_root_path(det_model_path), det_model_path)
+    rec_model_path = f"{ocr_models_dir}/{rec}"
+    rec_model_path = os.path.join(auto_download_and_get_model_root_path(rec_model_path), rec_model_path)
+    rec_char_dict_path = os.path.join(root_dir, 'pytorchocr', 'utils', 'resources', 'dict', dict_file)
+    return det_model_path, rec_model_path, rec_char_dict_path
+
+
 class PytorchPaddleOCR(TextSystem):
     def __init__(self, *args, **kwargs):
         parser = utility.init_args()
         args = parser.parse_args(args)
 
-        self.lang = kwargs.get('lang', 'ch')
-
-        device = get_device()
-        if device == 'cpu' and self.lang in ['ch', 'ch_server', 'japan', 'chinese_cht']:
-            # logger.warning("The current device in use is CPU. To ensure the speed of parsing, the language is automatically switched to ch_lite.")
-            self.lang = 'ch_lite'
-
-        if self.lang in latin_lang:
-            self.lang = 'latin'
-        elif self.lang in arabic_lang:
-            self.lang = 'arabic'
-        elif self.lang in cyrillic_lang:
-            self.lang = 'cyrillic'
-        elif self.lang in devanagari_lang:
-            self.lang = 'devanagari'
-        elif self.lang in east_slavic_lang:
-            self.lang = 'east_slavic'
-        else:
-            pass
-
-        models_config_path = os.path.join(root_dir, 'pytorchocr', 'utils', 'resources', 'models_config.yml')
-        with open(models_config_path) as file:
-            config = yaml.safe_load(file)
-            det, rec, dict_file = get_model_params(self.lang, config)
-        ocr_models_dir = ModelPath.pytorch_paddle
+        device = kwargs.get('device') or get_device()
+        self.lang = get_ocr_lang(kwargs.get('lang', 'ch'), device)
 
-        det_model_path = f"{ocr_models_dir}/{det}"
-        det_model_path = os.path.join(auto_download_and_get_model_root_path(det_model_path), det_model_path)
-        rec_model_path = f"{ocr_models_dir}/{rec}"
-        rec_model_path = os.path.join(auto_download_and_get_model_root_path(rec_model_path), rec_model_path)
+        det_model_path, rec_model_path, rec_char_dict_path = get_ocr_model_paths(self.lang)
         kwargs['det_model_path'] = det_model_path
         kwargs['rec_model_path'] = rec_model_path
-        kwargs['rec_char_dict_path'] = os.path.join(root_dir, 'pytorchocr', 'utils', 'resources', 'dict', dict_file)
+        kwargs['rec_char_dict_path'] = rec_char_dict_path
         kwargs['rec_batch_num'] = 16
 
         kwargs['device'] = device
@@ -23,7 +23,11 @@ class RapidTableModel(object):
 
 
     def predict(self, image):
-        bgr_image = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+        # ndarray输入约定为BGR，PIL输入为RGB
+        if isinstance(image, np.ndarray):
+            bgr_image = image
+        else:
+            bgr_image = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
 
         # First check the overall image aspect ratio (height/width)
         img_height, img_width = bgr_image.shape[:2]
@@ -63,8 +67,7 @@ class RapidTableModel(object):
             # Rotate image if necessary
             if is_rotated:
                 # logger.debug("Table appears to be in portrait orientation, rotating 90 degrees clockwise")
-                image = cv2.rotate(np.asarray(image), cv2.ROTATE_90_CLOCKWISE)
-                bgr_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+                bgr_image = cv2.rotate(bgr_image, cv2.ROTATE_90_CLOCKWISE)
 
         # Continue with OCR on potentially rotated image
         ocr_result = self.ocr_engine.ocr(bgr_image)[0]
@@ -77,7 +80,7 @@ class RapidTableModel(object):
 
         if ocr_result:
             try:
-                table_results = self.table_model(np.asarray(image), ocr_result)
+                table_results = self.table_model(cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB), ocr_result)
                 html_code = table_results.pred_html
                 table_cell_bboxes = table_results.cell_bboxes
                 logic_points = table_results.logic_points
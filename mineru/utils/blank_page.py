@@ -0,0 +1,80 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import os
+import threading
+
+import cv2
+import numpy as np
+from loguru import logger
+
+# 检测前把页面缩小到长边不超过该值，INTER_AREA缩放同时平滑掉扫描噪点
+BLANK_CHECK_MAX_SIZE = 512
+
+
+def is_blank_page_filter_enabled():
+    return os.getenv('MINERU_BLANK_PAGE_FILTER', 'false').lower() == 'true'
+
+
+def get_ink_ratio(image, ink_delta) -> float:
+    """
+    缩小后的灰度图中与背景(中位数)灰度差超过ink_delta的像素比例。
+    image为BGR ndarray或PIL.Image。
+    """
+    if not isinstance(image, np.ndarray):
+        image = cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+    height, width = image.shape[:2]
+    if height == 0 or width == 0:
+        return 0.0
+    ratio = min(1.0, BLANK_CHECK_MAX_SIZE / max(height, width))
+    if ratio < 1.0:
+        image = cv2.resize(
+            image, (max(1, round(width * ratio)), max(1, round(height * ratio))), interpolation=cv2.INTER_AREA
+        )
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    background = int(np.median(gray))
+    ink = cv2.absdiff(gray, np.full_like(gray, background)) > ink_delta
+    return float(np.count_nonzero(ink)) / ink.size
+
+
+class BlankPageFilter:
+    """
+    推理前过滤空白页和近似空白页(扫描件的分隔页、背面等)，
+    墨迹占比低于阈值的页面不送入模型，直接得到空的layout_dets。
+    """
+
+    def __init__(self, ink_ratio_threshold=None, ink_delta=None):
+        if ink_ratio_threshold is None:
+            ink_ratio_threshold = float(os.getenv('MINERU_BLANK_PAGE_INK_RATIO', 0.001))
+        if ink_delta is None:
+            ink_delta = int(os.getenv('MINERU_BLANK_PAGE_INK_DELTA', 40))
+        self.ink_ratio_threshold = ink_ratio_threshold
+        self.ink_delta = ink_delta
+        self._lock = threading.Lock()
+        self._stats = {'checked': 0, 'skipped': 0}
+
+    def is_blank(self, image) -> bool:
+        blank = get_ink_ratio(image, self.ink_delta) < self.ink_ratio_threshold
+        with self._lock:
+            self._stats['checked'] += 1
+            if blank:
+                self._stats['skipped'] += 1
+        return blank
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"blank page filter: skipped {stats['skipped']}/{stats['checked']} pages")
+
+
+_blank_page_filter = None
+_blank_page_filter_lock = threading.Lock()
+
+
+def get_blank_page_filter() -> BlankPageFilter:
+    global _blank_page_filter
+    with _blank_page_filter_lock:
+        if _blank_page_filter is None:
+            _blank_page_filter = BlankPageFilter()
+        return _blank_page_filter
@@ -90,6 +90,19 @@ def get_device():
         return "cpu"
 
 
+def get_devices():
+    """
+    多设备数据并行时使用的设备列表，从环境变量MINERU_DEVICES读取，以逗号分隔，如"cuda:0,cuda:1"，
+    未设置时只使用get_device()返回的单个设备
+    """
+    devices_env = os.getenv('MINERU_DEVICES', None)
+    if devices_env:
+        devices = [device.strip() for device in devices_env.split(',') if device.strip()]
+        if devices:
+            return devices
+    return [get_device()]
+
+
 def get_formula_enable(formula_enable):
     formula_enable_env = os.getenv('MINERU_FORMULA_ENABLE')
     formula_enable = formula_enable if formula_enable_env is None else formula_enable_env.lower() == 'true'
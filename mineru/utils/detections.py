@@ -0,0 +1,66 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import numpy as np
+
+from mineru.utils.image_pyramid import rescale_boxes
+
+
+class Detections:
+    """
+    单张图的YOLO检测结果，以host端ndarray保存：xyxy(n, 4)、conf(n,)、cls(n,)。
+    下游按数组整体读取，不再逐个标量调用.item()触发设备同步。
+    """
+
+    __slots__ = ('xyxy', 'conf', 'cls')
+
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    @classmethod
+    def from_array(cls, data: np.ndarray) -> 'Detections':
+        """data为(n, 6)的[x1, y1, x2, y2, score, cls]"""
+        return cls(data[:, :4], data[:, 4], data[:, 5].astype(np.int64))
+
+    def __len__(self):
+        return len(self.conf)
+
+    def rescale(self, scale, per_axis=True) -> 'Detections':
+        """检测框从金字塔层级坐标换算回原图坐标，scale为None时原样返回"""
+        if scale is None:
+            return self
+        return Detections(rescale_boxes(self.xyxy, scale, per_axis), self.conf, self.cls)
+
+    def to_dicts(self, category_offset=0, score_ndigits=3) -> list:
+        """转换为layout_dets格式的dict列表，坐标截断为int"""
+        x0, y0, x1, y1 = self.xyxy.astype(np.int64).T
+        polys = np.stack([x0, y0, x1, y0, x1, y1, x0, y1], axis=1).tolist()
+        categories = (self.cls + category_offset).tolist()
+        return [
+            {"category_id": category_id, "poly": poly, "score": round(score, score_ndigits)}
+            for category_id, poly, score in zip(categories, polys, self.conf.tolist())
+        ]
+
+
+def detections_from_predictions(predictions) -> list:
+    """把一批ultralytics/doclayout_yolo的预测结果一次性拷贝到host，拆分为各图的Detections"""
+    datas = [
+        prediction.boxes.data if getattr(prediction, "boxes", None) is not None else None
+        for prediction in predictions
+    ]
+    present = [data for data in datas if data is not None]
+    if not present:
+        return [Detections.from_array(np.zeros((0, 6), dtype=np.float32)) for _ in predictions]
+
+    import torch
+
+    merged = torch.cat([data[:, :6] for data in present]).float().cpu().numpy()
+    splits = np.split(merged, np.cumsum([len(data) for data in present])[:-1])
+    results, split_index = [], 0
+    for data in datas:
+        if data is None:
+            results.append(Detections.from_array(np.zeros((0, 6), dtype=np.float32)))
+        else:
+            results.append(Detections.from_array(splits[split_index]))
+            split_index += 1
+    return results
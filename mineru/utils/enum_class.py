@@ -61,6 +61,11 @@ class ModelPath:
     slanet_plus = "models/TabRec/SlanetPlus/slanet-plus.onnx"
 
 
+class ImageType:
+    PIL = 'pil_img'  # PIL.Image, RGB
+    NUMPY = 'numpy_img'  # 连续的uint8 ndarray, BGR
+
+
 class SplitFlag:
     CROSS_PAGE = 'cross_page'
     LINES_DELETED = 'lines_deleted'
\ No newline at end of file
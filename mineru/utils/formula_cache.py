@@ -0,0 +1,85 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+
+
+def is_formula_cache_enabled():
+    return os.getenv('MINERU_FORMULA_CACHE', 'false').lower() == 'true'
+
+
+def exact_key(image: np.ndarray) -> bytes:
+    return hashlib.blake2b(np.ascontiguousarray(image), digest_size=16).digest()
+
+
+class FormulaCache:
+    """
+    进程内的公式识别结果缓存(LRU)，键为裁边、缩放和填充后(prepare_input)的公式图像的哈希，
+    同时记录每个结果的解码步数，用于统计命中节省的解码量。
+    只有像素完全相同的输入才会命中，不做近似匹配，避免把相似公式(如x_1与x_2)的结果互相替代。
+    """
+
+    def __init__(self, max_entries=None):
+        if max_entries is None:
+            max_entries = int(os.getenv('MINERU_FORMULA_CACHE_SIZE', 100000))
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'hits': 0, 'saved_steps': 0}
+
+    @staticmethod
+    def make_key(image: np.ndarray) -> bytes:
+        return exact_key(image)
+
+    def get(self, key):
+        """命中时返回latex，未命中返回None"""
+        with self._lock:
+            self._stats['lookups'] += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            latex, steps = entry
+            self._stats['hits'] += 1
+            self._stats['saved_steps'] += steps
+            return latex
+
+    def put(self, key, latex, steps, duplicates=0):
+        """写入解码结果，duplicates为同一批内复用该结果、未解码的重复公式数"""
+        with self._lock:
+            self._entries[key] = (latex, steps)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._stats['hits'] += duplicates
+            self._stats['saved_steps'] += steps * duplicates
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 3) if stats['lookups'] else 0.0
+        return stats
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"formula cache: {stats['hits']}/{stats['lookups']} hits (hit rate {stats['hit_rate']:.1%}), "
+            f"{stats['saved_steps']} decode steps saved, {stats['entries']} entries"
+        )
+
+
+_formula_cache = None
+_formula_cache_lock = threading.Lock()
+
+
+def get_formula_cache() -> FormulaCache:
+    global _formula_cache
+    with _formula_cache_lock:
+        if _formula_cache is None:
+            _formula_cache = FormulaCache()
+        return _formula_cache
@@ -0,0 +1,102 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import math
+import os
+import threading
+
+from loguru import logger
+
+# 页面按200dpi渲染，一个字符约占20x20像素，按裁剪面积估算字符数(偏小的字符面积使预算偏宽松)
+GLYPH_AREA = 20 * 20
+BASE_TOKENS = 64
+TOKENS_PER_GLYPH = 4
+# 末尾至少LOOP_MIN_TOKENS个token由周期不超过LOOP_MAX_PERIOD的片段重复LOOP_MIN_REPEATS次以上构成时视为陷入循环
+LOOP_MAX_PERIOD = 16
+LOOP_MIN_REPEATS = 6
+LOOP_MIN_TOKENS = 96
+LOOP_WINDOW = LOOP_MIN_TOKENS + LOOP_MAX_PERIOD
+
+
+def is_mfr_early_stop_enabled():
+    return os.getenv('MINERU_MFR_EARLY_STOP', 'false').lower() == 'true'
+
+
+def get_crop_decode_budget(width, height) -> int:
+    """按公式裁剪图的尺寸估算字符数，给出该公式的解码步数上限"""
+    glyphs = math.ceil(max(width, 1) * max(height, 1) / GLYPH_AREA)
+    return BASE_TOKENS + TOKENS_PER_GLYPH * glyphs
+
+
+def has_repetition_loop(tokens) -> bool:
+    """tokens末尾是否是同一片段的大量重复(解码器陷入循环)"""
+    for period in range(1, LOOP_MAX_PERIOD + 1):
+        span = max(LOOP_MIN_TOKENS, period * LOOP_MIN_REPEATS)
+        span += -span % period
+        if len(tokens) < span:
+            continue
+        tail = tokens[-span:]
+        if tail[period:] == tail[:-period]:
+            return True
+    return False
+
+
+class CropEarlyStopper:
+    """
+    一次解码中各公式的提前结束判断：达到按尺寸估算的解码预算，或末尾陷入重复循环。
+    budgets与公式下标对齐，超过max_new_tokens的预算不起作用；被提前结束的公式下标记录在stopped中。
+    """
+
+    def __init__(self, budgets, max_new_tokens):
+        self.budgets = [min(budget, max_new_tokens) for budget in budgets]
+        self.max_new_tokens = max_new_tokens
+        self.stats = get_decode_budget_stats()
+        self.stopped = set()
+
+    def check(self, index, length, tail) -> bool:
+        """length为该公式已生成的token数(不含bos)，tail为最近生成的token，需要提前结束时记入统计并返回True"""
+        if length >= self.budgets[index] and self.budgets[index] < self.max_new_tokens:
+            self.stats.add_stop('budget_stops', self.max_new_tokens - length)
+            self.stopped.add(index)
+            return True
+        if has_repetition_loop(tail):
+            self.stats.add_stop('loop_stops', self.max_new_tokens - length)
+            self.stopped.add(index)
+            return True
+        return False
+
+    def is_stopped(self, index) -> bool:
+        return index in self.stopped
+
+
+class DecodeBudgetStats:
+    """统计达到解码预算、陷入循环而提前结束的公式数和最多节省的解码步数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'crops': 0, 'budget_stops': 0, 'loop_stops': 0, 'saved_steps': 0}
+
+    def add_crops(self, crops):
+        with self._lock:
+            self._stats['crops'] += crops
+
+    def add_stop(self, reason, saved_steps):
+        with self._lock:
+            self._stats[reason] += 1
+            self._stats['saved_steps'] += saved_steps
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"formula decode budget: {stats['budget_stops']}/{stats['crops']} crops hit the cap, "
+            f"{stats['loop_stops']} stopped on repetition loops, up to {stats['saved_steps']} decode steps saved"
+        )
+
+
+_decode_budget_stats = DecodeBudgetStats()
+
+
+def get_decode_budget_stats() -> DecodeBudgetStats:
+    return _decode_budget_stats
@@ -0,0 +1,116 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import ctypes
+import os
+import re
+import threading
+
+import pypdfium2.raw as pdfium_c
+from loguru import logger
+
+from mineru.utils.pdf_classify import CHARS_THRESHOLD, count_unicode_map_errors, get_page_ocr_enable
+
+# 数学相关的unicode字符：希腊字母、上下标、数学字母符号、箭头、数学运算符、杂项技术符号(大括号分段等)、
+# 数学符号扩展、私有区(Symbol等字体的公式字形常落在此区)以及常见的±×÷√∞
+MATH_CHAR_PATTERN = re.compile(
+    '[\u00b1\u00d7\u00f7\u0370-\u03ff\u2032-\u2037\u2070-\u209f'
+    '\u2102\u210a-\u2113\u2115\u2118-\u211d\u2124\u2128\u212c\u212d\u212f-\u2131\u2133-\u2138'
+    '\u2190-\u21ff\u2200-\u22ff\u2308-\u230b\u239b-\u23b3\u27c0-\u27ef\u2980-\u29ff\u2a00-\u2aff'
+    '\ue000-\uf8ff\ufffd\U0001d400-\U0001d7ff]'
+)
+# 纯ASCII书写的公式特征：单字母变量与比较/赋值符号相连(如x = 1、a<b)、上标^、下标_、LaTeX命令
+ASCII_FORMULA_PATTERN = re.compile(
+    r'(?<![A-Za-z])[A-Za-z]\s?[=<>]\s?[-+(]?[A-Za-z0-9]'
+    r'|[A-Za-z0-9)\]]\^'
+    r'|(?<![A-Za-z0-9])[A-Za-z]_\{?[A-Za-z0-9]'
+    r'|\\(?:frac|sum|int|sqrt|alpha|beta|gamma|delta|theta|lambda|sigma|mathbb|mathrm)\b'
+)
+# 数学字体(去掉子集前缀ABCDEF+后匹配)：TeX的CM/AMS/Euler/RSFS等、Cambria Math、STIX、MathType、Symbol
+MATH_FONT_PATTERN = re.compile(
+    r'(?i)math|^(?:cm(?:mi|sy|ex|bsy|mib)|msam|msbm|eu[frsx]m|rsfs|esint|wasy|stmary|'
+    r'(?:tx|px)(?:sy|ex|mi)|rtxmi|mt ?extra|euclid|symbol|stix|xits)'
+)
+
+
+def is_formula_precheck_enabled():
+    return os.getenv('MINERU_FORMULA_PRECHECK', 'false').lower() == 'true'
+
+
+def get_font_name(text_obj) -> str:
+    font = pdfium_c.FPDFTextObj_GetFont(text_obj.raw)
+    if not font:
+        return ''
+    length = pdfium_c.FPDFFont_GetBaseFontName(font, None, 0)
+    if length <= 0:
+        return ''
+    buffer = ctypes.create_string_buffer(length)
+    pdfium_c.FPDFFont_GetBaseFontName(font, buffer, length)
+    name = buffer.value.decode('utf-8', errors='ignore')
+    return name.split('+', 1)[1] if re.match(r'^[A-Z]{6}\+', name) else name
+
+
+def page_may_contain_formula(page) -> bool:
+    """
+    根据pdfium文本层保守判断页面是否可能含有公式，只有文本层完整且没有任何公式迹象时才返回False：
+    文本过少、存在无法映射unicode的字符、含数学unicode字符或ASCII公式写法、使用数学字体、
+    含有嵌入图像(公式可能以图片形式存在)的页面都视为可能含有公式。
+    """
+    text_page = page.get_textpage()
+    try:
+        text = text_page.get_text_bounded()
+        invalid_chars = count_unicode_map_errors(text_page)
+    finally:
+        text_page.close()
+
+    if len(re.sub(r'\s+', '', text)) < CHARS_THRESHOLD or invalid_chars > 0:
+        return True
+    if MATH_CHAR_PATTERN.search(text) or ASCII_FORMULA_PATTERN.search(text):
+        return True
+
+    for obj in page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_TEXT, pdfium_c.FPDF_PAGEOBJ_IMAGE)):
+        if obj.type == pdfium_c.FPDF_PAGEOBJ_IMAGE:
+            return True
+        if MATH_FONT_PATTERN.search(get_font_name(obj)):
+            return True
+    return False
+
+
+def get_page_mfd_enable(pdf_doc, ocr_enable) -> list:
+    """
+    返回与pdf_doc页序对齐的bool列表，False表示该页可以跳过公式检测和识别。
+    需要OCR的页面文本层不可信，始终保留公式检测。
+    """
+    return [
+        get_page_ocr_enable(ocr_enable, index) or page_may_contain_formula(pdf_doc[index])
+        for index in range(len(pdf_doc))
+    ]
+
+
+class FormulaPrecheckStats:
+    """
+    统计因文本层预检而跳过MFD/MFR的页数，只计入实际送入BatchAnalyze的页面；
+    空白页过滤和页面结果缓存跳过的页面分别由各自的统计记录。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'pages': 0, 'skipped': 0}
+
+    def add(self, pages, skipped):
+        with self._lock:
+            self._stats['pages'] += pages
+            self._stats['skipped'] += skipped
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"formula precheck: skipped MFD/MFR on {stats['skipped']}/{stats['pages']} inferred pages")
+
+
+_formula_precheck_stats = FormulaPrecheckStats()
+
+
+def get_formula_precheck_stats() -> FormulaPrecheckStats:
+    return _formula_precheck_stats
@@ -0,0 +1,159 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import os
+import threading
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+# 与DocLayoutYOLOModel、YOLOv8MFDModel默认的imgsz保持一致
+DEFAULT_PYRAMID_LEVELS = (1280, 1888)
+
+
+def is_page_pyramid_enabled():
+    return os.getenv('MINERU_PAGE_PYRAMID', 'false').lower() == 'true'
+
+
+def get_page_pyramid_levels():
+    """渲染时预先生成的层级(模型输入的imgsz)，可通过MINERU_PAGE_PYRAMID_LEVELS用逗号分隔配置"""
+    levels = os.getenv('MINERU_PAGE_PYRAMID_LEVELS')
+    if not levels:
+        return DEFAULT_PYRAMID_LEVELS
+    return tuple(int(level) for level in levels.split(',') if level.strip())
+
+
+def letterbox_size(shape, imgsz) -> (int, int):
+    """与YOLO letterbox相同的缩放比例(长边缩放到imgsz)和取整方式，返回(width, height)"""
+    ratio = min(imgsz / shape[0], imgsz / shape[1])
+    return round(shape[1] * ratio), round(shape[0] * ratio)
+
+
+def rect_input_shape(shape, imgsz, stride=32) -> (int, int):
+    """YOLO矩形(rect)推理时的模型输入尺寸：letterbox后只把短边填充到stride的整数倍，返回(height, width)"""
+    width, height = letterbox_size(shape, imgsz)
+    return height + (imgsz - height) % stride, width + (imgsz - width) % stride
+
+
+def letterbox_to(image: np.ndarray, input_shape, imgsz, pad_value=114) -> np.ndarray:
+    """
+    与YOLO letterbox相同的缩放和居中填充，输出尺寸为input_shape(height, width)。
+    填充后的图像再交给YOLO时不会被二次缩放或填充。
+    """
+    width, height = letterbox_size(image.shape, imgsz)
+    if (height, width) != image.shape[:2]:
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+    pad_height, pad_width = (input_shape[0] - height) / 2, (input_shape[1] - width) / 2
+    top, left = round(pad_height - 0.1), round(pad_width - 0.1)
+    bottom, right = input_shape[0] - height - top, input_shape[1] - width - left
+    return cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(pad_value,) * 3)
+
+
+def iter_rect_batches(images, imgsz, stride, batch_size, pixel_budget=None):
+    """
+    把BGR ndarray按矩形输入尺寸分桶，逐批产出(input_shape, 图像下标列表, letterbox到input_shape的图像列表)。
+    同一批内输入尺寸一致，YOLO按rect方式推理，结果与逐张推理一致；
+    pixel_budget不为None时每批输入像素总数不超过pixel_budget(每批至少1张)。
+    """
+    buckets = defaultdict(list)
+    for index, image in enumerate(images):
+        buckets[rect_input_shape(image.shape, imgsz, stride)].append(index)
+    for input_shape, indices in buckets.items():
+        size = batch_size
+        if pixel_budget is not None:
+            size = max(1, min(size, pixel_budget // (input_shape[0] * input_shape[1])))
+        for idx in range(0, len(indices), size):
+            batch_indices = indices[idx: idx + size]
+            yield input_shape, batch_indices, [
+                letterbox_to(images[index], input_shape, imgsz) for index in batch_indices
+            ]
+
+
+class ImagePyramid:
+    """
+    页面BGR位图及其按模型输入尺寸(imgsz)预缩放的各级图像。
+    各级尺寸与YOLO letterbox的缩放结果一致，模型拿到对应层级后不会再缩放，
+    每页每个层级只缩放一次，检测结果按层级与原图的尺寸比换算回原图坐标。
+    """
+
+    def __init__(self, base: np.ndarray, levels=()):
+        self.base = base
+        self._levels = {}
+        self._lock = threading.Lock()
+        for imgsz in levels:
+            self.get_level(imgsz)
+
+    @property
+    def shape(self):
+        return self.base.shape
+
+    @property
+    def levels(self) -> dict:
+        with self._lock:
+            return dict(self._levels)
+
+    def set_level(self, imgsz, image: np.ndarray):
+        with self._lock:
+            self._levels[imgsz] = image
+
+    def get_level(self, imgsz) -> np.ndarray:
+        """返回imgsz对应层级的图像，层级不存在时缩放一次并缓存"""
+        with self._lock:
+            image = self._levels.get(imgsz)
+            if image is None:
+                size = letterbox_size(self.base.shape, imgsz)
+                if size == (self.base.shape[1], self.base.shape[0]):
+                    image = self.base
+                else:
+                    image = cv2.resize(self.base, size, interpolation=cv2.INTER_LINEAR)
+                self._levels[imgsz] = image
+        return image
+
+
+def get_base_image(image):
+    if isinstance(image, ImagePyramid):
+        return image.base
+    return image
+
+
+def get_smallest_image(image):
+    """返回ImagePyramid中已有的最小层级(没有层级时为原图)，供只需要缩略图的检查使用"""
+    if isinstance(image, ImagePyramid):
+        levels = image.levels
+        if levels:
+            return min(levels.values(), key=lambda level: level.shape[0] * level.shape[1])
+        return image.base
+    return image
+
+
+def resolve_model_inputs(images, imgsz):
+    """
+    将ImagePyramid替换为imgsz对应的层级，返回模型输入和各图的(层级shape, 原图shape)，
+    普通图像对应None，检测框无需换算。
+    """
+    inputs, scales = [], []
+    for image in images:
+        if isinstance(image, ImagePyramid):
+            level = image.get_level(imgsz)
+            inputs.append(level)
+            scales.append((level.shape[:2], image.shape[:2]))
+        else:
+            inputs.append(image)
+            scales.append(None)
+    return inputs, scales
+
+
+def rescale_boxes(xyxy, scale, per_axis=True):
+    """
+    把层级坐标系下的xyxy检测框(ndarray)换算回原图坐标，并裁剪到原图范围内。
+    per_axis与模型库自身的scale_boxes保持一致：新版ultralytics按宽高分别换算，doclayout_yolo使用统一的比例。
+    """
+    if scale is None:
+        return xyxy
+    (level_height, level_width), (height, width) = scale
+    gain_x, gain_y = level_width / width, level_height / height
+    if not per_axis:
+        gain_x = gain_y = min(gain_x, gain_y)
+    xyxy = xyxy.copy()
+    xyxy[:, 0::2] = (xyxy[:, 0::2] / gain_x).clip(0, width)
+    xyxy[:, 1::2] = (xyxy[:, 1::2] / gain_y).clip(0, height)
+    return xyxy
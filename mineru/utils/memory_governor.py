@@ -0,0 +1,135 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import gc
+import os
+import threading
+import time
+
+from loguru import logger
+
+from mineru.utils.model_utils import clean_memory
+
+try:
+    import torch
+    import torch_npu
+except ImportError:
+    pass
+
+
+def is_memory_governor_enabled():
+    return os.getenv('MINERU_MEMORY_GOVERNOR', 'false').lower() == 'true'
+
+
+def get_rss_bytes():
+    """当前进程常驻内存，优先读/proc，其次psutil，都不可用时返回None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def get_total_host_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_device_memory_ratio(device):
+    """设备上缓存分配器占用(reserved)占总显存的比例，无法获取时返回None"""
+    device = str(device)
+    try:
+        if device.startswith('cuda') and torch.cuda.is_available():
+            total = torch.cuda.get_device_properties(device).total_memory
+            return torch.cuda.memory_reserved(device) / total
+        elif device.startswith('npu') and torch_npu.npu.is_available():
+            total = torch_npu.npu.get_device_properties(device).total_memory
+            return torch_npu.npu.memory_reserved(device) / total
+        elif device.startswith('mps'):
+            return torch.mps.driver_allocated_memory() / torch.mps.recommended_max_memory()
+    except Exception:
+        pass
+    return None
+
+
+class MemoryGovernor:
+    """
+    按水位线决定是否释放缓存，替代每个批次无条件的clean_memory。
+    设备显存占用超过水位线时清空设备缓存(含gc)，进程常驻内存超过水位线时只做gc，
+    两者都未超过时什么也不做，避免反复预热分配器和全量gc停顿。
+    """
+
+    def __init__(self, rss_high_watermark=None, device_high_watermark=None):
+        if rss_high_watermark is None:
+            rss_gb = os.getenv('MINERU_RSS_HIGH_WATERMARK_GB')
+            if rss_gb is not None:
+                rss_high_watermark = float(rss_gb) * (1024 ** 3)
+            else:
+                total = get_total_host_memory()
+                rss_high_watermark = total * 0.8 if total else None
+        if device_high_watermark is None:
+            device_high_watermark = float(os.getenv('MINERU_DEVICE_MEM_HIGH_WATERMARK', 0.85))
+        self.rss_high_watermark = rss_high_watermark
+        self.device_high_watermark = device_high_watermark
+        self._lock = threading.Lock()
+        self._stats = {
+            'checks': 0,
+            'device_releases': 0,
+            'host_releases': 0,
+            'pause_time': 0.0,
+        }
+
+    def maybe_release(self, device) -> bool:
+        """检查内存压力，必要时释放缓存，返回是否发生了释放"""
+        device_ratio = get_device_memory_ratio(device)
+        rss = get_rss_bytes()
+        device_pressure = device_ratio is not None and device_ratio > self.device_high_watermark
+        host_pressure = rss is not None and self.rss_high_watermark is not None and rss > self.rss_high_watermark
+
+        pause = 0.0
+        if device_pressure or host_pressure:
+            start = time.perf_counter()
+            if device_pressure:
+                clean_memory(device)
+            else:
+                gc.collect()
+            pause = time.perf_counter() - start
+
+        with self._lock:
+            self._stats['checks'] += 1
+            if device_pressure:
+                self._stats['device_releases'] += 1
+            elif host_pressure:
+                self._stats['host_releases'] += 1
+            self._stats['pause_time'] += pause
+        return device_pressure or host_pressure
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pause_time'] = round(stats['pause_time'], 3)
+        return stats
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"memory governor: {stats['checks']} checks, {stats['device_releases']} device releases, "
+            f"{stats['host_releases']} host releases, paused {stats['pause_time']}s"
+        )
+
+
+_memory_governor = None
+_memory_governor_lock = threading.Lock()
+
+
+def get_memory_governor() -> MemoryGovernor:
+    global _memory_governor
+    with _memory_governor_lock:
+        if _memory_governor is None:
+            _memory_governor = MemoryGovernor()
+        return _memory_governor
@@ -23,16 +23,28 @@ def crop_img(input_res, input_img, crop_paste_x=0, crop_paste_y=0):
     crop_new_height = crop_ymax - crop_ymin + crop_paste_y * 2
 
     if isinstance(input_img, np.ndarray):
-
-        # Create a white background array
-        return_image = np.ones((crop_new_height, crop_new_width, 3), dtype=np.uint8) * 255
-
-        # Crop the original image using numpy slicing
-        cropped_img = input_img[crop_ymin:crop_ymax, crop_xmin:crop_xmax]
-
-        # Paste the cropped image onto the white background
-        return_image[crop_paste_y:crop_paste_y + (crop_ymax - crop_ymin),
-        crop_paste_x:crop_paste_x + (crop_xmax - crop_xmin)] = cropped_img
+        img_height, img_width = input_img.shape[:2]
+        in_bounds = 0 <= crop_xmin <= crop_xmax <= img_width and 0 <= crop_ymin <= crop_ymax <= img_height
+
+        if in_bounds and crop_paste_x == 0 and crop_paste_y == 0:
+            # 不需要留白时直接返回原图上的视图，避免拷贝
+            return_image = input_img[crop_ymin:crop_ymax, crop_xmin:crop_xmax]
+        else:
+            # Create a white background array
+            return_image = np.full((crop_new_height, crop_new_width, 3), 255, dtype=np.uint8)
+            # 与PIL.crop一致，超出原图的部分填充为黑色
+            return_image[crop_paste_y:crop_paste_y + (crop_ymax - crop_ymin),
+            crop_paste_x:crop_paste_x + (crop_xmax - crop_xmin)] = 0
+
+            # Crop the original image using numpy slicing
+            src_xmin, src_ymin = max(crop_xmin, 0), max(crop_ymin, 0)
+            src_xmax, src_ymax = min(crop_xmax, img_width), min(crop_ymax, img_height)
+            if src_xmax > src_xmin and src_ymax > src_ymin:
+                dst_x = crop_paste_x + src_xmin - crop_xmin
+                dst_y = crop_paste_y + src_ymin - crop_ymin
+                # Paste the cropped image onto the white background
+                return_image[dst_y:dst_y + (src_ymax - src_ymin), dst_x:dst_x + (src_xmax - src_xmin)] = \
+                    input_img[src_ymin:src_ymax, src_xmin:src_xmax]
     else:
         # Create a white background array
         return_image = Image.new('RGB', (crop_new_width, crop_new_height), 'white')
@@ -400,10 +412,11 @@ def get_res_list_from_layout_res(layout_res, iou_threshold=0.7, overlap_threshol
 
 
 def clean_memory(device='cuda'):
-    if device == 'cuda':
+    if str(device).startswith('cuda'):
         if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.ipc_collect()
+            with torch.cuda.device(device):
+                torch.cuda.empty_cache()
+                torch.cuda.ipc_collect()
     elif str(device).startswith("npu"):
         if torch_npu.npu.is_available():
             torch_npu.npu.empty_cache()
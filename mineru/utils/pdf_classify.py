@@ -1,23 +1,29 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import os
 import re
-from io import BytesIO
 import numpy as np
 import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 from loguru import logger
-from pdfminer.high_level import extract_text
-from pdfminer.pdfparser import PDFParser
-from pdfminer.pdfdocument import PDFDocument
-from pdfminer.pdfpage import PDFPage
-from pdfminer.pdfinterp import PDFResourceManager
-from pdfminer.pdfinterp import PDFPageInterpreter
-from pdfminer.layout import LAParams, LTImage, LTFigure
-from pdfminer.converter import PDFPageAggregator
+
+
+# 检查的页面数（最多检查10页）
+MAX_PAGES_TO_CHECK = 10
+# 如果每页平均少于50个有效字符，认为需要OCR
+CHARS_THRESHOLD = 50
+# 图像覆盖率不低于80%的页面视为高覆盖率页面
+HIGH_IMAGE_COVERAGE_THRESHOLD = 0.8
+# 存在5%以上的乱码字符时，认为该文档为乱码文档
+INVALID_CHARS_THRESHOLD = 0.05
 
 
 def classify(pdf_bytes):
     """
     判断PDF文件是可以直接提取文本还是需要OCR
 
+    直接在原文档上随机抽取最多10页，用pdfium一次遍历完成字符统计、乱码检测和图像覆盖率计算，
+    不再生成采样PDF，也不再用pdfminer重复解析。
+
     Args:
         pdf_bytes: PDF文件的字节数据
 
@@ -25,233 +31,151 @@ def classify(pdf_bytes):
         str: 'txt' 表示可以直接提取文本，'ocr' 表示需要OCR
     """
     try:
-        # 从字节数据加载PDF
-        sample_pdf_bytes = extract_pages(pdf_bytes)
-        pdf = pdfium.PdfDocument(sample_pdf_bytes)
-
-        # 获取PDF页数
-        page_count = len(pdf)
-
-        # 如果PDF页数为0，直接返回OCR
-        if page_count == 0:
-            return 'ocr'
-
-        # 检查的页面数（最多检查10页）
-        pages_to_check = min(page_count, 10)
+        pdf = pdfium.PdfDocument(pdf_bytes)
+    except Exception as e:
+        logger.error(f"判断PDF类型时出错: {e}")
+        # 出错时默认使用OCR
+        return 'ocr'
+    try:
+        return classify_doc(pdf)
+    finally:
+        pdf.close()
 
-        # 设置阈值：如果每页平均少于50个有效字符，认为需要OCR
-        chars_threshold = 50
 
-        if (get_avg_cleaned_chars_per_page(pdf, pages_to_check) < chars_threshold) or detect_invalid_chars(sample_pdf_bytes):
+def classify_doc(pdf_doc):
+    """
+    与classify相同，但直接在已打开的文档上判断，pdf_doc可以是PdfPageRange视图，
+    此时只在选中的页面范围内抽样。
+    """
+    try:
+        # 如果PDF页数为0(或页面范围为空)，直接返回OCR
+        if len(pdf_doc) <= 0:
             return 'ocr'
-        else:
-
-            if get_high_image_coverage_ratio(sample_pdf_bytes, pages_to_check) >= 0.8:
-                return 'ocr'
-
-            return 'txt'
+        return classify_pages(pdf_doc, sample_page_indices(len(pdf_doc)))
     except Exception as e:
         logger.error(f"判断PDF类型时出错: {e}")
         # 出错时默认使用OCR
         return 'ocr'
 
 
-def get_avg_cleaned_chars_per_page(pdf_doc, pages_to_check):
-    # 总字符数
-    total_chars = 0
-    # 清理后的总字符数
-    cleaned_total_chars = 0
+def sample_page_indices(total_page, max_pages=MAX_PAGES_TO_CHECK):
+    """从总页数中随机选择最多max_pages页"""
+    return np.random.choice(total_page, min(max_pages, total_page), replace=False).tolist()
 
-    # 检查前几页的文本
-    for i in range(pages_to_check):
-        page = pdf_doc[i]
-        text_page = page.get_textpage()
-        text = text_page.get_text_bounded()
-        total_chars += len(text)
-
-        # 清理提取的文本，移除空白字符
-        cleaned_text = re.sub(r'\s+', '', text)
-        cleaned_total_chars += len(cleaned_text)
 
-    # 计算平均每页字符数
-    avg_cleaned_chars_per_page = cleaned_total_chars / pages_to_check
+def is_page_level_classify_enabled():
+    return os.getenv('MINERU_PAGE_LEVEL_CLASSIFY', 'false').lower() == 'true'
 
-    # logger.debug(f"PDF分析: 平均每页清理后{avg_cleaned_chars_per_page:.1f}字符")
 
-    pdf_doc.close()  # 关闭PDF文档
+def classify_each_page(pdf_doc):
+    """
+    逐页判断是'txt'还是'ocr'，用于扫描页与电子版页面混排的文档，
+    判定规则与classify相同，只是统计范围为单页。pdf_doc可以是PdfPageRange视图。
+    """
+    extractable = is_extractable(pdf_doc)
+    results = []
+    for index in range(len(pdf_doc)):
+        stat = get_page_classify_stats(pdf_doc[index])
+        invalid_chars_ratio = stat['invalid_chars'] / stat['total_chars'] if stat['total_chars'] > 0 else 0
+        if (
+            stat['cleaned_chars'] < CHARS_THRESHOLD
+            or invalid_chars_ratio > INVALID_CHARS_THRESHOLD
+            or not extractable
+            or stat['image_coverage'] >= HIGH_IMAGE_COVERAGE_THRESHOLD
+        ):
+            results.append('ocr')
+        else:
+            results.append('txt')
+    return results
 
-    return avg_cleaned_chars_per_page
 
+def get_page_ocr_enable(ocr_enable, page_index):
+    """ocr_enable可以是整个文档的bool，也可以是按页的bool列表"""
+    if isinstance(ocr_enable, (list, tuple)):
+        return ocr_enable[page_index]
+    return ocr_enable
 
-def get_high_image_coverage_ratio(sample_pdf_bytes, pages_to_check):
-    # 创建内存文件对象
-    pdf_stream = BytesIO(sample_pdf_bytes)
 
-    # 创建PDF解析器
-    parser = PDFParser(pdf_stream)
+def classify_pages(pdf_doc, page_indices):
+    """根据page_indices指定的页面判断文档是'txt'还是'ocr'"""
+    stats = [get_page_classify_stats(pdf_doc[index]) for index in page_indices]
+    pages_to_check = len(stats)
 
-    # 创建PDF文档对象
-    document = PDFDocument(parser)
+    avg_cleaned_chars = sum(stat['cleaned_chars'] for stat in stats) / pages_to_check
+    total_chars = sum(stat['total_chars'] for stat in stats)
+    invalid_chars = sum(stat['invalid_chars'] for stat in stats)
+    invalid_chars_ratio = invalid_chars / total_chars if total_chars > 0 else 0
 
-    # 检查文档是否允许文本提取
-    if not document.is_extractable:
-        # logger.warning("PDF不允许内容提取")
-        return 1.0  # 默认为高覆盖率，因为无法提取内容
+    if avg_cleaned_chars < CHARS_THRESHOLD or invalid_chars_ratio > INVALID_CHARS_THRESHOLD:
+        return 'ocr'
 
-    # 创建资源管理器和参数对象
-    rsrcmgr = PDFResourceManager()
-    laparams = LAParams(
-        line_overlap=0.5,
-        char_margin=2.0,
-        line_margin=0.5,
-        word_margin=0.1,
-        boxes_flow=None,
-        detect_vertical=False,
-        all_texts=False,
+    # 文档不允许内容提取时按高覆盖率处理
+    if not is_extractable(pdf_doc):
+        return 'ocr'
+    high_coverage_pages = sum(
+        1 for stat in stats if stat['image_coverage'] >= HIGH_IMAGE_COVERAGE_THRESHOLD
     )
+    if high_coverage_pages / pages_to_check >= 0.8:
+        return 'ocr'
 
-    # 创建聚合器
-    device = PDFPageAggregator(rsrcmgr, laparams=laparams)
-
-    # 创建解释器
-    interpreter = PDFPageInterpreter(rsrcmgr, device)
-
-    # 记录高图像覆盖率的页面数量
-    high_image_coverage_pages = 0
-    page_count = 0
-
-    # 遍历页面
-    for page in PDFPage.create_pages(document):
-        # 控制检查的页数
-        if page_count >= pages_to_check:
-            break
-
-        # 处理页面
-        interpreter.process_page(page)
-        layout = device.get_result()
-
-        # 页面尺寸
-        page_width = layout.width
-        page_height = layout.height
-        page_area = page_width * page_height
-
-        # 计算图像覆盖的总面积
-        image_area = 0
-
-        # 遍历页面元素
-        for element in layout:
-            # 检查是否为图像或图形元素
-            if isinstance(element, (LTImage, LTFigure)):
-                # 计算图像边界框面积
-                img_width = element.width
-                img_height = element.height
-                img_area = img_width * img_height
-                image_area += img_area
-
-        # 计算覆盖率
-        coverage_ratio = min(image_area / page_area, 1.0) if page_area > 0 else 0
-        # logger.debug(f"PDF分析: 页面 {page_count + 1} 图像覆盖率: {coverage_ratio:.2f}")
-
-        # 判断是否为高覆盖率
-        if coverage_ratio >= 0.8:  # 使用80%作为高覆盖率的阈值
-            high_image_coverage_pages += 1
-
-        page_count += 1
-
-    # 如果没有处理任何页面，返回0
-    if page_count == 0:
-        return 0.0
-
-    # 计算高图像覆盖率的页面比例
-    high_coverage_ratio = high_image_coverage_pages / page_count
-    # logger.debug(f"PDF分析: 高图像覆盖页面比例: {high_coverage_ratio:.2f}")
-
-    # 关闭资源
-    pdf_stream.close()
-
-    return high_coverage_ratio
+    return 'txt'
 
 
-def extract_pages(src_pdf_bytes: bytes) -> bytes:
+def get_page_classify_stats(page):
     """
-    从PDF字节数据中随机提取最多10页，返回新的PDF字节数据
-
-    Args:
-        src_pdf_bytes: PDF文件的字节数据
-
-    Returns:
-        bytes: 提取页面后的PDF字节数据
+    一次遍历页面的文本和页面对象，返回:
+        cleaned_chars: 去除空白后的字符数
+        total_chars: 不含换行的字符数
+        invalid_chars: 无法映射到unicode的字符数(pdfminer中表现为(cid:xxx))
+        image_coverage: 顶层图像和Form XObject的面积占页面面积的比例
     """
-
-    # 从字节数据加载PDF
-    pdf = pdfium.PdfDocument(src_pdf_bytes)
-
-    # 获取PDF页数
-    total_page = len(pdf)
-    if total_page == 0:
-        # 如果PDF没有页面，直接返回空文档
-        logger.warning("PDF is empty, return empty document")
-        return b''
-
-    # 选择最多10页
-    select_page_cnt = min(10, total_page)
-
-    # 从总页数中随机选择页面
-    page_indices = np.random.choice(total_page, select_page_cnt, replace=False).tolist()
-
-    # 创建一个新的PDF文档
-    sample_docs = pdfium.PdfDocument.new()
-
+    text_page = page.get_textpage()
     try:
-        # 将选择的页面导入新文档
-        sample_docs.import_pages(pdf, page_indices)
+        text = text_page.get_text_bounded()
+        invalid_chars = count_unicode_map_errors(text_page)
+    finally:
+        text_page.close()
+
+    page_width, page_height = page.get_size()
+    page_area = page_width * page_height
+    image_area = 0
+    for obj in page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE, pdfium_c.FPDF_PAGEOBJ_FORM), max_depth=1):
+        left, bottom, right, top = get_object_bounds(obj)
+        image_area += abs(right - left) * abs(top - bottom)
+
+    return {
+        'cleaned_chars': len(re.sub(r'\s+', '', text)),
+        'total_chars': len(text) - text.count('\n') - text.count('\r'),
+        'invalid_chars': invalid_chars,
+        'image_coverage': min(image_area / page_area, 1.0) if page_area > 0 else 0,
+    }
+
+
+def count_unicode_map_errors(text_page):
+    char_count = pdfium_c.FPDFText_CountChars(text_page.raw)
+    if hasattr(pdfium_c, 'FPDFText_HasUnicodeMapError'):
+        return sum(
+            1 for index in range(char_count)
+            if pdfium_c.FPDFText_HasUnicodeMapError(text_page.raw, index) == 1
+        )
+    # 旧版pdfium没有该接口，退化为统计替换字符和空字符
+    return sum(
+        1 for index in range(char_count)
+        if pdfium_c.FPDFText_GetUnicode(text_page.raw, index) in (0, 0xFFFD)
+    )
 
-        # 将新PDF保存到内存缓冲区
-        output_buffer = BytesIO()
-        sample_docs.save(output_buffer)
 
-        # 获取字节数据
-        return output_buffer.getvalue()
-    except Exception as e:
-        logger.exception(e)
-        return b''  # 出错时返回空字节
+def get_object_bounds(obj):
+    # pypdfium2 5.x为get_bounds，4.x为get_pos
+    if hasattr(obj, 'get_bounds'):
+        return obj.get_bounds()
+    return obj.get_pos()
 
 
-def detect_invalid_chars(sample_pdf_bytes: bytes) -> bool:
-    """"
-    检测PDF中是否包含非法字符
-    """
-    '''pdfminer比较慢,需要先随机抽取10页左右的sample'''
-    # sample_pdf_bytes = extract_pages(src_pdf_bytes)
-    sample_pdf_file_like_object = BytesIO(sample_pdf_bytes)
-    laparams = LAParams(
-        line_overlap=0.5,
-        char_margin=2.0,
-        line_margin=0.5,
-        word_margin=0.1,
-        boxes_flow=None,
-        detect_vertical=False,
-        all_texts=False,
-    )
-    text = extract_text(pdf_file=sample_pdf_file_like_object, laparams=laparams)
-    text = text.replace("\n", "")
-    # logger.info(text)
-    '''乱码文本用pdfminer提取出来的文本特征是(cid:xxx)'''
-    cid_pattern = re.compile(r'\(cid:\d+\)')
-    matches = cid_pattern.findall(text)
-    cid_count = len(matches)
-    cid_len = sum(len(match) for match in matches)
-    text_len = len(text)
-    if text_len == 0:
-        cid_chars_radio = 0
-    else:
-        cid_chars_radio = cid_count/(cid_count + text_len - cid_len)
-    # logger.debug(f"cid_count: {cid_count}, text_len: {text_len}, cid_chars_radio: {cid_chars_radio}")
-    '''当一篇文章存在5%以上的文本是乱码时,认为该文档为乱码文档'''
-    if cid_chars_radio > 0.05:
-        return True  # 乱码文档
-    else:
-        return False   # 正常文档
+def is_extractable(pdf_doc):
+    # 未加密文档返回全部权限；第5位(0x10)为允许提取文本和图形
+    permissions = pdfium_c.FPDF_GetDocPermissions(pdf_doc.raw)
+    return bool(permissions & 0x10)
 
 
 if __name__ == '__main__':
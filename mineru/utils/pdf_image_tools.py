@@ -1,57 +1,329 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 
+import numpy as np
 import pypdfium2 as pdfium
 from loguru import logger
 from PIL import Image
 
 from mineru.data.data_reader_writer import FileBasedDataWriter
-from mineru.utils.pdf_reader import image_to_b64str, image_to_bytes, page_to_image
-from .hash_utils import str_sha256
+from mineru.utils.enum_class import ImageType
+from mineru.utils.image_pyramid import ImagePyramid
+from mineru.utils.pdf_reader import image_to_b64str, image_to_bytes, page_to_image, page_to_numpy
+from .hash_utils import str_md5, str_sha256
+from .shm_utils import ndarray_to_shm, take_ndarray_from_shm, detach_shm
 
+# pdfium不是线程安全的，后台渲染线程与主线程并发访问pdfium时需持有此锁
+pdfium_lock = threading.RLock()
 
-def pdf_page_to_image(page: pdfium.PdfPage, dpi=200) -> dict:
-    """Convert pdfium.PdfDocument to image, Then convert the image to base64.
+
+# image_dict中存放页面位图的键
+_IMAGE_KEYS = {
+    ImageType.PIL: "img_pil",
+    ImageType.NUMPY: "img_np",
+}
+
+
+def pdf_page_to_image(page: pdfium.PdfPage, dpi=200, image_type=ImageType.PIL) -> dict:
+    """Convert pdfium.PdfDocument to image.
+
+    不再预先把每页编码为PNG+base64，需要base64的调用方(如vlm)通过get_page_img_base64按需生成，
+    图片命名所需的哈希由get_page_img_md5按需从原始位图计算。
+
+    image_type为ImageType.NUMPY时直接导出pdfium位图为BGR ndarray(键为img_np)，不经过PIL。
 
     Args:
         page (_type_): pdfium.PdfPage
         dpi (int, optional): reset the dpi of dpi. Defaults to 200.
+        image_type (str, optional): ImageType.PIL or ImageType.NUMPY. Defaults to ImageType.PIL.
 
     Returns:
-        dict:  {'img_base64': str, 'img_pil': pil_img, 'scale': float }
+        dict:  {'img_pil' or 'img_np': image, 'scale': float, 'image_type': str }
     """
-    pil_img, scale = page_to_image(page, dpi=dpi)
-    img_base64 = image_to_b64str(pil_img)
+    if image_type == ImageType.NUMPY:
+        image, scale = page_to_numpy(page, dpi=dpi)
+    else:
+        image, scale = page_to_image(page, dpi=dpi)
 
     image_dict = {
-        "img_base64": img_base64,
-        "img_pil": pil_img,
+        _IMAGE_KEYS[image_type]: image,
         "scale": scale,
+        "image_type": image_type,
     }
     return image_dict
 
 
+class PdfPageRange:
+    """
+    pdf_doc中[start_page_id, end_page_id]页的零拷贝视图，按相对页号访问页面，
+    替代把选中页导入新文档再序列化为新的pdf bytes。
+    """
+
+    def __init__(self, pdf_doc: pdfium.PdfDocument, start_page_id: int, end_page_id: int):
+        self.pdf_doc = pdf_doc
+        self.start_page_id = start_page_id
+        self.end_page_id = end_page_id
+
+    def __len__(self):
+        return self.end_page_id - self.start_page_id + 1
+
+    def __getitem__(self, index: int) -> pdfium.PdfPage:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"page index {index} out of range")
+        return self.pdf_doc[self.start_page_id + index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getattr__(self, name):
+        return getattr(self.pdf_doc, name)
+
+    def close(self):
+        self.pdf_doc.close()
+
+
+def normalize_page_range(pdf_page_num, start_page_id=0, end_page_id=None):
+    start_page_id = max(start_page_id or 0, 0)
+    end_page_id = end_page_id if end_page_id is not None and end_page_id >= 0 else pdf_page_num - 1
+    if end_page_id > pdf_page_num - 1:
+        logger.warning("end_page_id is out of range, use images length")
+        end_page_id = pdf_page_num - 1
+    return start_page_id, end_page_id
+
+
+def get_pdf_page_range(pdf_doc: pdfium.PdfDocument, start_page_id=0, end_page_id=None):
+    """范围覆盖整本文档时直接返回pdf_doc，否则返回PdfPageRange视图"""
+    pdf_page_num = len(pdf_doc)
+    start_page_id, end_page_id = normalize_page_range(pdf_page_num, start_page_id, end_page_id)
+    if start_page_id == 0 and end_page_id == pdf_page_num - 1:
+        return pdf_doc
+    return PdfPageRange(pdf_doc, start_page_id, end_page_id)
+
+
+def get_render_workers():
+    """多进程渲染的进程数，从环境变量MINERU_PDF_RENDER_WORKERS读取，不大于1时串行渲染"""
+    return int(os.getenv('MINERU_PDF_RENDER_WORKERS', 0))
+
+
 def load_images_from_pdf(
     pdf_bytes: bytes,
     dpi=200,
     start_page_id=0,
     end_page_id=None,
+    render_workers=None,
+    image_type=ImageType.PIL,
+    pyramid_levels=None,
 ):
-    images_list = []
+    """返回的pdf_doc与images_list按相对页号对齐，指定了页范围时为PdfPageRange视图"""
+    if render_workers is None:
+        render_workers = get_render_workers()
     pdf_doc = pdfium.PdfDocument(pdf_bytes)
+    if render_workers > 1:
+        images_iter = iter_images_from_pdf_parallel(
+            pdf_bytes, render_workers, dpi, start_page_id, end_page_id, image_type, pyramid_levels
+        )
+    else:
+        images_iter = iter_images_from_pdf(pdf_doc, dpi, start_page_id, end_page_id, image_type, pyramid_levels)
+    images_list = list(images_iter)
+    return images_list, get_pdf_page_range(pdf_doc, start_page_id, end_page_id)
+
+
+def iter_images_from_pdf(
+    pdf_doc: pdfium.PdfDocument,
+    dpi=200,
+    start_page_id=0,
+    end_page_id=None,
+    image_type=ImageType.PIL,
+    pyramid_levels=None,
+):
+    """逐页渲染pdf_doc，按页序惰性产出image_dict，供流式推理使用"""
     pdf_page_num = len(pdf_doc)
-    end_page_id = end_page_id if end_page_id is not None and end_page_id >= 0 else pdf_page_num - 1
-    if end_page_id > pdf_page_num - 1:
-        logger.warning("end_page_id is out of range, use images length")
-        end_page_id = pdf_page_num - 1
+    start_page_id, end_page_id = normalize_page_range(pdf_page_num, start_page_id, end_page_id)
 
     for index in range(0, pdf_page_num):
         if start_page_id <= index <= end_page_id:
-            page = pdf_doc[index]
-            image_dict = pdf_page_to_image(page, dpi=dpi)
-            images_list.append(image_dict)
+            with pdfium_lock:
+                page = pdf_doc[index]
+                image_dict = pdf_page_to_image(page, dpi=dpi, image_type=image_type)
+            if pyramid_levels and image_type == ImageType.NUMPY:
+                # 按模型输入尺寸预先缩放出金字塔层级，缩放不涉及pdfium，放在锁外进行
+                image_dict["img_pyramid"] = ImagePyramid(image_dict["img_np"], pyramid_levels)
+            yield image_dict
+
+
+_render_worker_pdf_doc = None
+
+
+def _init_render_worker(pdf_bytes):
+    global _render_worker_pdf_doc
+    _render_worker_pdf_doc = pdfium.PdfDocument(pdf_bytes)
+
+
+def _render_page_worker(page_index, dpi, image_type, pyramid_levels):
+    if image_type == ImageType.NUMPY:
+        image, scale = page_to_numpy(_render_worker_pdf_doc[page_index], dpi=dpi)
+    else:
+        image, scale = page_to_image(_render_worker_pdf_doc[page_index], dpi=dpi)
+    shm, image_meta = ndarray_to_shm(np.asarray(image))
+    detach_shm(shm)
+
+    # 金字塔层级也在子进程中缩放好再传回，与原图尺寸相同的层级不重复传输
+    level_metas = {}
+    if pyramid_levels and image_type == ImageType.NUMPY:
+        for imgsz, level in ImagePyramid(image, pyramid_levels).levels.items():
+            if level is image:
+                level_metas[imgsz] = None
+                continue
+            level_shm, level_metas[imgsz] = ndarray_to_shm(level)
+            detach_shm(level_shm)
+    return image_meta, scale, level_metas
+
+
+def _take_rendered_page(result, image_type):
+    image_meta, scale, level_metas = result
+    image = take_ndarray_from_shm(image_meta)
+    image_dict = {"scale": scale, "image_type": image_type}
+    if level_metas:
+        pyramid = ImagePyramid(image)
+        for imgsz, level_meta in level_metas.items():
+            pyramid.set_level(imgsz, image if level_meta is None else take_ndarray_from_shm(level_meta))
+        image_dict["img_pyramid"] = pyramid
+    if image_type == ImageType.PIL:
+        image = Image.fromarray(image)
+    image_dict[_IMAGE_KEYS[image_type]] = image
+    return image_dict
 
-    return images_list, pdf_doc
+
+def iter_images_from_pdf_parallel(
+    pdf_bytes: bytes,
+    workers: int,
+    dpi=200,
+    start_page_id=0,
+    end_page_id=None,
+    image_type=ImageType.PIL,
+    pyramid_levels=None,
+):
+    """
+    多进程渲染，按页序产出与iter_images_from_pdf相同的image_dict。
+    每个子进程只打开一次pdf_bytes，页面像素经共享内存传回，同时在途的页面数有上限。
+    """
+    with pdfium_lock:
+        pdf_doc = pdfium.PdfDocument(pdf_bytes)
+        pdf_page_num = len(pdf_doc)
+        pdf_doc.close()
+    start_page_id, end_page_id = normalize_page_range(pdf_page_num, start_page_id, end_page_id)
+    page_indices = iter(range(start_page_id, end_page_id + 1))
+    workers = max(1, min(workers, end_page_id - start_page_id + 1))
+    max_inflight = workers * 2
+
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_render_worker,
+            initargs=(pdf_bytes,),
+    ) as executor:
+        pending = deque()
+
+        def submit_pages():
+            while len(pending) < max_inflight:
+                page_index = next(page_indices, None)
+                if page_index is None:
+                    return
+                pending.append(executor.submit(_render_page_worker, page_index, dpi, image_type, pyramid_levels))
+
+        try:
+            # 子进程在首次提交时fork，持锁避免复制其他线程正在使用中的pdfium状态
+            with pdfium_lock:
+                submit_pages()
+            while pending:
+                image_dict = _take_rendered_page(pending.popleft().result(), image_type)
+                submit_pages()
+                yield image_dict
+        finally:
+            for future in pending:
+                if not future.cancel():
+                    try:
+                        _take_rendered_page(future.result(), image_type)
+                    except Exception:
+                        pass
+
+
+def get_page_image(image_dict: dict):
+    """返回页面位图(PIL.Image或BGR ndarray)，已释放时返回None"""
+    for key in _IMAGE_KEYS.values():
+        if image_dict.get(key) is not None:
+            return image_dict[key]
+    return None
+
+
+def get_page_image_size(image_dict: dict) -> (int, int):
+    image = get_page_image(image_dict)
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.width, image.height
+
+
+def release_page_image(image_dict: dict):
+    """释放页面位图，只保留图片名计算和重新渲染所需的信息"""
+    if get_page_image(image_dict) is not None:
+        get_page_img_md5(image_dict)
+    image_dict.pop("img_base64", None)
+    image_dict.pop("img_pyramid", None)
+    for key in _IMAGE_KEYS.values():
+        image_dict.pop(key, None)
+
+
+def restore_page_image(image_dict: dict, page: pdfium.PdfPage) -> bool:
+    """按原scale和原位图类型重新渲染被释放的页面位图，返回是否发生了重新渲染"""
+    if get_page_image(image_dict) is not None:
+        return False
+    image_type = image_dict.get("image_type", ImageType.PIL)
+    bitmap = page.render(scale=image_dict["scale"])
+    try:
+        if image_type == ImageType.NUMPY:
+            image_dict["img_np"] = bitmap.to_numpy()
+        else:
+            image_dict["img_pil"] = bitmap.to_pil()
+    finally:
+        bitmap.close()
+    return True
+
+
+def get_page_img_md5(image_dict: dict) -> str:
+    """页面内容哈希，用于裁剪图片命名；首次调用时对原始位图计算并缓存，同一页面的结果稳定不变"""
+    if "img_md5" not in image_dict:
+        image = get_page_image(image_dict)
+        if isinstance(image, np.ndarray):
+            hasher = hashlib.md5(f"BGR_{image.shape[1]}_{image.shape[0]}".encode('utf-8'))
+            hasher.update(np.ascontiguousarray(image))
+            image_dict["img_md5"] = hasher.hexdigest()
+        elif image is not None:
+            hasher = hashlib.md5(f"{image.mode}_{image.width}_{image.height}".encode('utf-8'))
+            hasher.update(image.tobytes())
+            image_dict["img_md5"] = hasher.hexdigest()
+        else:
+            image_dict["img_md5"] = str_md5(image_dict["img_base64"])
+    return image_dict["img_md5"]
+
+
+def get_page_img_base64(image_dict: dict) -> str:
+    """按需将页面位图编码为base64(PNG)，结果不缓存，避免长期持有大字符串"""
+    if "img_base64" in image_dict:
+        return image_dict["img_base64"]
+    image = get_page_image(image_dict)
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image[..., ::-1])
+    return image_to_b64str(image)
 
 
 def cut_image(bbox: tuple, page_num: int, page_pil_img, return_path, image_writer: FileBasedDataWriter, scale=2):
@@ -70,6 +342,8 @@ def cut_image(bbox: tuple, page_num: int, page_pil_img, return_path, image_write
     # img_hash256_path = f'{img_path}.jpg'
 
     crop_img = get_crop_img(bbox, page_pil_img, scale=scale)
+    if isinstance(crop_img, np.ndarray):
+        crop_img = Image.fromarray(crop_img[..., ::-1])
 
     img_bytes = image_to_bytes(crop_img, image_format="JPEG")
 
@@ -78,13 +352,26 @@ def cut_image(bbox: tuple, page_num: int, page_pil_img, return_path, image_write
 
 
 def get_crop_img(bbox: tuple, pil_img, scale=2):
+    """pil_img为ndarray时返回原数组的视图；越界部分与PIL.Image.crop一样以黑色填充(此时会拷贝)"""
     scale_bbox = (
         int(bbox[0] * scale),
         int(bbox[1] * scale),
         int(bbox[2] * scale),
         int(bbox[3] * scale),
     )
-    return pil_img.crop(scale_bbox)
+    if not isinstance(pil_img, np.ndarray):
+        return pil_img.crop(scale_bbox)
+
+    x0, y0, x1, y1 = scale_bbox
+    height, width = pil_img.shape[:2]
+    if 0 <= x0 <= x1 <= width and 0 <= y0 <= y1 <= height:
+        return pil_img[y0:y1, x0:x1]
+    crop = np.zeros((max(y1 - y0, 0), max(x1 - x0, 0)) + pil_img.shape[2:], dtype=pil_img.dtype)
+    src_x0, src_y0 = max(x0, 0), max(y0, 0)
+    src_x1, src_y1 = min(x1, width), min(y1, height)
+    if src_x1 > src_x0 and src_y1 > src_y0:
+        crop[src_y0 - y0:src_y1 - y0, src_x0 - x0:src_x1 - x0] = pil_img[src_y0:src_y1, src_x0:src_x1]
+    return crop
 
 
 def images_bytes_to_pdf_bytes(image_bytes):
@@ -2,21 +2,48 @@
 import base64
 from io import BytesIO
 
+import numpy as np
 from loguru import logger
 from PIL import Image
 from pypdfium2 import PdfBitmap, PdfDocument, PdfPage
 
 
-def page_to_image(
-    page: PdfPage,
-    dpi: int = 144,  # changed from 200 to 144
-    max_width_or_height: int = 2560,  # changed from 4500 to 2560
-) -> (Image.Image, float):
+def get_render_scale(page: PdfPage, dpi: int = 144, max_width_or_height: int = 2560) -> float:
     scale = dpi / 72
 
     long_side_length = max(*page.get_size())
     if (long_side_length*scale) > max_width_or_height:
         scale = max_width_or_height / long_side_length
+    return scale
+
+
+def page_to_numpy(
+    page: PdfPage,
+    dpi: int = 144,
+    max_width_or_height: int = 2560,
+) -> (np.ndarray, float):
+    """渲染为连续的uint8 BGR数组，直接使用pdfium位图缓冲区，不经过PIL和颜色转换"""
+    scale = get_render_scale(page, dpi, max_width_or_height)
+    bitmap: PdfBitmap = page.render(scale=scale)  # type: ignore
+    try:
+        # 位图缓冲区由python分配且紧密排列，close后数组仍持有缓冲区的引用
+        image = bitmap.to_numpy()
+    finally:
+        try:
+            bitmap.close()
+        except Exception:
+            pass
+    if not image.flags['C_CONTIGUOUS']:
+        image = np.ascontiguousarray(image)
+    return image, scale
+
+
+def page_to_image(
+    page: PdfPage,
+    dpi: int = 144,  # changed from 200 to 144
+    max_width_or_height: int = 2560,  # changed from 4500 to 2560
+) -> (Image.Image, float):
+    scale = get_render_scale(page, dpi, max_width_or_height)
 
     bitmap: PdfBitmap = page.render(scale=scale)  # type: ignore
     try:
@@ -0,0 +1,54 @@
+# Copyright (c) Opendatalab. All rights reserved.
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+def ndarray_to_shm(array: np.ndarray):
+    """
+    将ndarray拷贝到一块新建的共享内存中，用于跨进程传递页面像素，避免pickle大数组
+
+    Returns:
+        (shm, meta): shm由创建方负责调用release_shm释放，meta可跨进程传递给ndarray_from_shm
+    """
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def ndarray_from_shm(meta) -> np.ndarray:
+    """按meta挂载共享内存并拷贝出ndarray，挂载方只关闭不unlink"""
+    name, shape, dtype = meta
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+
+
+def take_ndarray_from_shm(meta) -> np.ndarray:
+    """按meta挂载共享内存，拷贝出ndarray后释放该共享内存，用于接收方持有所有权的场景"""
+    name, shape, dtype = meta
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+    finally:
+        release_shm(shm)
+
+
+def detach_shm(shm: shared_memory.SharedMemory):
+    """创建方放弃共享内存的所有权：关闭句柄且不再由本进程的resource_tracker回收，由接收方负责释放"""
+    shm.close()
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def release_shm(shm: shared_memory.SharedMemory):
+    try:
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
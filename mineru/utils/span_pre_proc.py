@@ -120,7 +120,7 @@ def __replace_unicode(text: str):
 
 
 """pdf_text dict方案 char级别"""
-def txt_spans_extract(pdf_page, spans, pil_img, scale, all_bboxes, all_discarded_blocks):
+def txt_spans_extract(pdf_page, spans, page_img, scale, all_bboxes, all_discarded_blocks):
 
     page_dict = get_page(pdf_page)
 
@@ -195,8 +195,12 @@ def txt_spans_extract(pdf_page, spans, pil_img, scale, all_bboxes, all_discarded
 
         for span in need_ocr_spans:
             # 对span的bbox截图再ocr
-            span_pil_img = get_crop_img(span['bbox'], pil_img, scale)
-            span_img = cv2.cvtColor(np.array(span_pil_img), cv2.COLOR_RGB2BGR)
+            if isinstance(page_img, np.ndarray):
+                # BGR页面上的裁剪结果为视图，拷贝一份避免后续持有整页位图
+                span_img = get_crop_img(span['bbox'], page_img, scale).copy()
+            else:
+                span_pil_img = get_crop_img(span['bbox'], page_img, scale)
+                span_img = cv2.cvtColor(np.array(span_pil_img), cv2.COLOR_RGB2BGR)
             # 计算span的对比度，低于0.20的span不进行ocr
             if calculate_contrast(span_img, img_mode='bgr') <= 0.17:
                 spans.remove(span)
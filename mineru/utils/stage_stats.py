@@ -0,0 +1,66 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from loguru import logger
+
+
+class StageStats:
+    """
+    记录流水线各阶段的忙碌(busy)与空闲等待(idle)时间，用于观察设备利用率。
+    只记录了busy的阶段(如BatchAnalyze内的layout/mfd/mfr/ocr_det/ocr_rec/table)不计算利用率。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'busy': 0.0, 'idle': 0.0, 'count': 0, 'idle_tracked': False})
+
+    def add(self, stage, key, elapsed):
+        with self._lock:
+            self._stats[stage][key] += elapsed
+            if key == 'busy':
+                self._stats[stage]['count'] += 1
+            else:
+                self._stats[stage]['idle_tracked'] = True
+
+    @contextmanager
+    def busy(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, 'busy', time.perf_counter() - start)
+
+    @contextmanager
+    def idle(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, 'idle', time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        result = {}
+        with self._lock:
+            for stage, stat in self._stats.items():
+                result[stage] = {
+                    'busy': round(stat['busy'], 3),
+                    'count': stat['count'],
+                }
+                if stat['idle_tracked']:
+                    total = stat['busy'] + stat['idle']
+                    result[stage]['idle'] = round(stat['idle'], 3)
+                    result[stage]['utilization'] = round(stat['busy'] / total, 3) if total > 0 else 0.0
+        return result
+
+    def log(self, title='pipeline stages'):
+        for stage, stat in self.summary().items():
+            if 'utilization' in stat:
+                logger.info(
+                    f"{title} [{stage}] busy: {stat['busy']}s, idle: {stat['idle']}s, "
+                    f"count: {stat['count']}, utilization: {stat['utilization']:.1%}"
+                )
+            else:
+                logger.info(f"{title} [{stage}] busy: {stat['busy']}s, count: {stat['count']}")
@@ -0,0 +1,169 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import os
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+from loguru import logger
+
+# 与ultralytics/doclayout_yolo的LetterBox、non_max_suppression默认参数保持一致
+LETTERBOX_PAD_VALUE = 114
+MAX_DET = 300
+MAX_NMS = 30000
+MAX_WH = 7680
+
+
+def is_yolo_onnx_enabled():
+    return os.getenv('MINERU_YOLO_ONNX', 'false').lower() == 'true'
+
+
+def letterbox_batch(images, imgsz, stride=32):
+    """
+    与YOLO predict相同的letterbox：长边缩放到imgsz并居中填充114，
+    同一批图像尺寸相同时只填充到stride的整数倍(与pt模型的rect推理一致)，否则填充为imgsz*imgsz。
+    images为BGR ndarray，返回float32的NCHW(RGB, 0~1)输入张量和各图的原始shape。
+    """
+    orig_shapes = [image.shape[:2] for image in images]
+    same_shapes = len(set(orig_shapes)) == 1
+
+    layouts = []
+    for height, width in orig_shapes:
+        ratio = min(imgsz / height, imgsz / width)
+        new_width, new_height = round(width * ratio), round(height * ratio)
+        pad_width, pad_height = imgsz - new_width, imgsz - new_height
+        if same_shapes:
+            pad_width, pad_height = pad_width % stride, pad_height % stride
+        layouts.append((new_width, new_height, pad_width / 2, pad_height / 2))
+
+    new_width, new_height, pad_width, pad_height = layouts[0]
+    input_height = new_height + round(pad_height - 0.1) + round(pad_height + 0.1)
+    input_width = new_width + round(pad_width - 0.1) + round(pad_width + 0.1)
+    batch = np.full((len(images), input_height, input_width, 3), LETTERBOX_PAD_VALUE, dtype=np.uint8)
+    for index, (image, (new_width, new_height, pad_width, pad_height)) in enumerate(zip(images, layouts)):
+        if image.shape[:2] != (new_height, new_width):
+            image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        top, left = round(pad_height - 0.1), round(pad_width - 0.1)
+        batch[index, top: top + new_height, left: left + new_width] = image
+
+    # BGR->RGB、HWC->CHW、归一化一次性对整批完成
+    batch = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2)).astype(np.float32)
+    batch *= 1 / 255.0
+    return batch, orig_shapes
+
+
+def scale_boxes(boxes, input_shape, orig_shape, per_axis=True):
+    """
+    把模型输入坐标系下的xyxy检测框(ndarray)换算回原图坐标，并裁剪到原图范围内。
+    per_axis与模型库自身的scale_boxes保持一致：新版ultralytics按宽高分别换算，doclayout_yolo使用统一的比例。
+    """
+    gain = min(input_shape[0] / orig_shape[0], input_shape[1] / orig_shape[1])
+    if per_axis:
+        new_height, new_width = round(orig_shape[0] * gain), round(orig_shape[1] * gain)
+        gain_y, gain_x = new_height / orig_shape[0], new_width / orig_shape[1]
+    else:
+        new_height, new_width = orig_shape[0] * gain, orig_shape[1] * gain
+        gain_y = gain_x = gain
+    pad_x = round((input_shape[1] - new_width) / 2 - 0.1)
+    pad_y = round((input_shape[0] - new_height) / 2 - 0.1)
+    boxes[:, 0::2] = ((boxes[:, 0::2] - pad_x) / gain_x).clip(0, orig_shape[1])
+    boxes[:, 1::2] = ((boxes[:, 1::2] - pad_y) / gain_y).clip(0, orig_shape[0])
+    return boxes
+
+
+def nms(boxes, scores, iou_thres):
+    """贪心NMS，每轮向量化计算当前最高分框与剩余框的IoU，返回按分数降序保留的下标"""
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = (-scores).argsort(kind='stable')
+    keep = []
+    while order.size > 0:
+        index = order[0]
+        keep.append(index)
+        rest = order[1:]
+        inter_width = (np.minimum(boxes[index, 2], boxes[rest, 2]) - np.maximum(boxes[index, 0], boxes[rest, 0])).clip(0)
+        inter_height = (np.minimum(boxes[index, 3], boxes[rest, 3]) - np.maximum(boxes[index, 1], boxes[rest, 1])).clip(0)
+        inter = inter_width * inter_height
+        iou = inter / (areas[index] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_thres]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def postprocess(output, conf, iou, max_det=MAX_DET):
+    """
+    解析onnx输出，返回每张图(n, 6)的[x1, y1, x2, y2, score, cls]。
+    端到端输出(batch, n, 6)(YOLOv10)只按置信度过滤；
+    原始输出(batch, 4 + nc, anchors)(YOLOv8)取最高分类别后按类别做NMS。
+    """
+    if output.shape[-1] == 6:
+        return [pred[pred[:, 4] > conf][:max_det] for pred in output]
+
+    results = []
+    for pred in output.transpose(0, 2, 1):
+        class_scores = pred[:, 4:]
+        cls = class_scores.argmax(1)
+        scores = class_scores[np.arange(len(cls)), cls]
+        mask = scores > conf
+        pred, cls, scores = pred[mask], cls[mask], scores[mask]
+        if len(scores) > MAX_NMS:
+            top = (-scores).argsort(kind='stable')[:MAX_NMS]
+            pred, cls, scores = pred[top], cls[top], scores[top]
+
+        xy, wh = pred[:, :2], pred[:, 2:4] / 2
+        boxes = np.concatenate((xy - wh, xy + wh), axis=1)
+        # 按类别平移框，一次NMS即可实现分类别抑制
+        keep = nms(boxes + cls[:, None] * MAX_WH, scores, iou)[:max_det]
+        results.append(np.concatenate(
+            (boxes[keep], scores[keep, None], cls[keep, None].astype(np.float32)), axis=1
+        ))
+    return results
+
+
+class YOLOOnnxSession:
+    """
+    onnxruntime(CPU)推理YOLO导出的onnx模型，预处理和后处理与predict保持一致。
+    """
+
+    def __init__(self, onnx_path, stride=32):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.stride = stride
+
+    def predict(self, images, imgsz, conf, iou, per_axis=True):
+        """返回各图原图坐标下(n, 6)的[x1, y1, x2, y2, score, cls]"""
+        images = [
+            image if isinstance(image, np.ndarray)
+            else cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+            for image in images
+        ]
+        batch, orig_shapes = letterbox_batch(images, imgsz, self.stride)
+        output = self.session.run(None, {self.input_name: batch})[0]
+        preds = postprocess(output, conf, iou)
+        for pred, orig_shape in zip(preds, orig_shapes):
+            scale_boxes(pred[:, :4], batch.shape[2:], orig_shape, per_axis)
+        return preds
+
+
+_export_lock = threading.Lock()
+
+
+def load_yolo_onnx_session(yolo, weight, imgsz):
+    """
+    将YOLO(ultralytics/doclayout_yolo)权重导出为动态尺寸的onnx并缓存在权重文件旁，
+    权重更新后重新导出；导出或加载失败时返回None，调用方继续使用torch推理。
+    """
+    onnx_path = Path(weight).with_suffix('.onnx')
+    stride = int(max(yolo.model.stride))
+    try:
+        with _export_lock:
+            if not onnx_path.exists() or onnx_path.stat().st_mtime < Path(weight).stat().st_mtime:
+                logger.info(f"exporting {weight} to onnx")
+                # 导出文件默认写在权重旁(weight.onnx，较大的模型还会附带.onnx.data)
+                onnx_path = Path(
+                    yolo.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=False, verbose=False)
+                )
+        return YOLOOnnxSession(str(onnx_path), stride)
+    except Exception as e:
+        logger.warning(f"onnxruntime backend unavailable for {weight}, fallback to torch: {e}")
+        return None
@@ -0,0 +1,45 @@
+# Copyright (c) Opendatalab. All rights reserved.
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+
+from mineru.model.mfr.unimernet.Unimernet import MathDataset, UnimernetModel
+from mineru.model.mfr.unimernet.unimernet_hf.unimer_swin.image_processing_unimer_swin import UnimerSwinImageProcessor
+
+
+def make_formula_crops():
+    """白底上随机深色笔画的彩色裁剪图，尺寸各不相同"""
+    rng = np.random.default_rng(0)
+    crops = []
+    for height, width in [(40, 200), (64, 64), (120, 900), (30, 31), (200, 480)]:
+        image = np.full((height, width, 3), 255, dtype=np.uint8)
+        for _ in range(12):
+            y, x = rng.integers(0, height - 4), rng.integers(0, width - 4)
+            image[y: y + rng.integers(2, 8), x: x + rng.integers(2, 20)] = rng.integers(0, 120, 3)
+        crops.append(Image.fromarray(image))
+    return crops
+
+
+def test_mfr_preprocess_paths_identical():
+    # 不加载权重，只构造预处理用到的属性
+    mfr_model = UnimernetModel.__new__(UnimernetModel)
+    mfr_model.device = "cpu"
+    mfr_model.model = SimpleNamespace(transform=UnimerSwinImageProcessor(), dtype=torch.float32)
+    crops = make_formula_crops()
+    to_gray = mfr_model.model.transform.transform.transforms[0]
+
+    # ToGray按概率生效，分别固定为生效和不生效，比较两种情况下各路径的结果
+    for probability in (1.0, 0.0):
+        to_gray.p = probability
+        dataloader = DataLoader(MathDataset(crops, transform=mfr_model.model.transform), batch_size=len(crops), num_workers=0)
+        dataloader_batch = next(iter(dataloader))
+
+        threaded_batch = next(mfr_model._iter_preprocessed_batches(crops, len(crops), workers=2))
+        prepared_batch = next(mfr_model._iter_prepared_batches(mfr_model._prepare_inputs(crops, workers=2), len(crops)))
+
+        assert dataloader_batch.shape == (len(crops), 1, 192, 672)
+        assert torch.equal(dataloader_batch, threaded_batch)
+        assert torch.equal(dataloader_batch, prepared_batch)
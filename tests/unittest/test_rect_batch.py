@@ -0,0 +1,124 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import numpy as np
+from ultralytics.data.augment import LetterBox
+from ultralytics.utils.ops import scale_boxes as yolo_scale_boxes
+
+from mineru.utils.image_pyramid import (
+    ImagePyramid, iter_rect_batches, letterbox_size, letterbox_to, rect_input_shape, rescale_boxes, resolve_model_inputs
+)
+from mineru.utils.yolo_onnx import scale_boxes
+
+# 竖版、横版、方形、小于imgsz(需要放大)和细长的页面
+PAGE_SHAPES = [(2200, 1700, 3), (1700, 2200, 3), (1000, 1000, 3), (600, 450, 3), (3000, 500, 3)]
+IMGSZ_LIST = [1280, 1888]
+STRIDE = 32
+
+
+def make_page(shape, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def make_boxes(height, width, count=20, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.uniform(0, width, (count, 2)), axis=1)
+    y = np.sort(rng.uniform(0, height, (count, 2)), axis=1)
+    return np.stack([x[:, 0], y[:, 0], x[:, 1], y[:, 1]], axis=1).astype(np.float32)
+
+
+def test_rect_letterbox_matches_yolo():
+    for shape in PAGE_SHAPES:
+        page = make_page(shape)
+        for imgsz in IMGSZ_LIST:
+            input_shape = rect_input_shape(shape, imgsz, STRIDE)
+            assert input_shape[0] % STRIDE == 0 and input_shape[1] % STRIDE == 0
+            assert max(input_shape) == imgsz
+            expected = LetterBox(new_shape=(imgsz, imgsz), auto=True, stride=STRIDE)(image=page)
+            assert np.array_equal(letterbox_to(page, input_shape, imgsz), expected)
+
+
+def test_square_letterbox_matches_yolo():
+    for shape in PAGE_SHAPES:
+        page = make_page(shape)
+        for imgsz in IMGSZ_LIST:
+            expected = LetterBox(new_shape=(imgsz, imgsz), auto=False, stride=STRIDE)(image=page)
+            assert np.array_equal(letterbox_to(page, (imgsz, imgsz), imgsz), expected)
+
+
+def test_rect_and_square_letterbox_share_content():
+    """矩形输入与方形输入只有填充不同，缩放后的页面内容完全一致"""
+    for shape in PAGE_SHAPES:
+        page = make_page(shape)
+        for imgsz in IMGSZ_LIST:
+            width, height = letterbox_size(shape, imgsz)
+            contents = []
+            for input_shape in (rect_input_shape(shape, imgsz, STRIDE), (imgsz, imgsz)):
+                image = letterbox_to(page, input_shape, imgsz)
+                top, left = round((input_shape[0] - height) / 2 - 0.1), round((input_shape[1] - width) / 2 - 0.1)
+                contents.append(image[top: top + height, left: left + width])
+            assert np.array_equal(contents[0], contents[1])
+
+
+def test_scale_boxes_matches_yolo():
+    for shape in PAGE_SHAPES:
+        boxes = make_boxes(*shape[:2])
+        for imgsz in IMGSZ_LIST:
+            for input_shape in (rect_input_shape(shape, imgsz, STRIDE), (imgsz, imgsz)):
+                input_boxes = make_boxes(*input_shape, seed=1)
+                expected = yolo_scale_boxes(input_shape, input_boxes.copy(), shape[:2])
+                assert np.allclose(scale_boxes(input_boxes.copy(), input_shape, shape[:2]), expected, atol=1e-3)
+            # 原图坐标经letterbox映射到输入坐标后再换算回来，与原坐标一致
+            input_shape = rect_input_shape(shape, imgsz, STRIDE)
+            width, height = letterbox_size(shape, imgsz)
+            gain_x, gain_y = width / shape[1], height / shape[0]
+            pad_x = round((input_shape[1] - width) / 2 - 0.1)
+            pad_y = round((input_shape[0] - height) / 2 - 0.1)
+            input_boxes = boxes.copy()
+            input_boxes[:, 0::2] = input_boxes[:, 0::2] * gain_x + pad_x
+            input_boxes[:, 1::2] = input_boxes[:, 1::2] * gain_y + pad_y
+            assert np.allclose(scale_boxes(input_boxes, input_shape, shape[:2]), boxes, atol=1e-2)
+
+
+def test_rescale_boxes_round_trip():
+    for shape in PAGE_SHAPES:
+        page = make_page(shape)
+        boxes = make_boxes(*shape[:2])
+        for imgsz in IMGSZ_LIST:
+            inputs, scales = resolve_model_inputs([ImagePyramid(page), page], imgsz)
+            level, scale = inputs[0], scales[0]
+            assert level.shape[:2] == letterbox_size(shape, imgsz)[::-1]
+            assert scale == (level.shape[:2], shape[:2])
+            # 普通图像不需要换算
+            assert scales[1] is None and rescale_boxes(boxes, None) is boxes
+
+            gain_x, gain_y = level.shape[1] / shape[1], level.shape[0] / shape[0]
+            level_boxes = boxes.copy()
+            level_boxes[:, 0::2] *= gain_x
+            level_boxes[:, 1::2] *= gain_y
+            assert np.allclose(rescale_boxes(level_boxes, scale), boxes, atol=1e-2)
+
+            gain = min(gain_x, gain_y)
+            assert np.allclose(rescale_boxes(boxes * gain, scale, per_axis=False), boxes, atol=1e-2)
+
+            # 超出层级范围的框被裁剪到原图范围内，输入不被修改
+            outside = np.array([[-10, -10, level.shape[1] + 10, level.shape[0] + 10]], dtype=np.float32)
+            assert np.array_equal(rescale_boxes(outside, scale), [[0, 0, shape[1], shape[0]]])
+            assert outside[0, 0] == -10
+
+
+def test_iter_rect_batches_buckets():
+    shapes = [PAGE_SHAPES[index % len(PAGE_SHAPES)] for index in range(23)]
+    pages = [make_page(shape, seed=index) for index, shape in enumerate(shapes)]
+    imgsz = 1280
+    for batch_size, pixel_budget in [(4, None), (64, None), (64, 2 * 1280 * 992), (3, 1)]:
+        seen = []
+        for input_shape, batch_indices, batch in iter_rect_batches(pages, imgsz, STRIDE, batch_size, pixel_budget):
+            assert 1 <= len(batch_indices) <= batch_size
+            if pixel_budget is not None and len(batch_indices) > 1:
+                assert len(batch_indices) * input_shape[0] * input_shape[1] <= pixel_budget
+            for index, image in zip(batch_indices, batch):
+                # 同一批内的输入尺寸一致，且与逐张letterbox的结果相同
+                assert rect_input_shape(pages[index].shape, imgsz, STRIDE) == input_shape
+                assert np.array_equal(image, letterbox_to(pages[index], input_shape, imgsz))
+            seen += batch_indices
+        # 每张图恰好出现一次
+        assert sorted(seen) == list(range(len(pages)))